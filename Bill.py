@@ -1,10 +1,15 @@
 """
 Modèle Bill pour la gestion des additions du coffee shop
 """
+import heapq
+import secrets
+from itertools import islice
 from datetime import datetime
 from bson import ObjectId
 from marshmallow import Schema, fields, validate, post_load
-from src.config.database import get_db
+from src.config.database import get_db, current_store
+from src.config.cache import bill_cache
+from src.models.offline_queue import offline_queue
 
 class BillItem:
     """Classe pour représenter un item dans une addition"""
@@ -31,11 +36,14 @@ class Bill:
         self.payment_status = "pending"
         self.bill_date = datetime.utcnow()
         self.cashier = cashier
+        # Magasin de l'addition (chaque magasin a sa propre base)
+        self.store_id = current_store()
     
     def _generate_bill_number(self):
         """Génère un numéro d'addition unique"""
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        return f"BILL-{timestamp}"
+        # Suffixe aléatoire : plusieurs additions peuvent être créées dans la même seconde
+        return f"BILL-{timestamp}-{secrets.token_hex(3).upper()}"
     
     def _calculate_subtotal(self):
         """Calcule le sous-total avant taxes et remises"""
@@ -90,7 +98,8 @@ class Bill:
             "paymentMethod": self.payment_method,
             "paymentStatus": self.payment_status,
             "billDate": self.bill_date,
-            "cashier": self.cashier
+            "cashier": self.cashier,
+            "storeId": self.store_id
         }
     
     @classmethod
@@ -121,56 +130,144 @@ class Bill:
         bill.subtotal = data.get("subtotal")
         bill.tax = data.get("tax")
         bill.total_amount = data.get("totalAmount")
+        bill.store_id = data.get("storeId") or bill.store_id
         
         return bill
 
+def build_bill_from_order(order, cashier=""):
+    """Construit une addition à partir d'une commande"""
+    items = [
+        BillItem(
+            item.product_name,
+            item.quantity,
+            item.price
+        ) for item in order.items
+    ]
+    
+    bill = Bill(
+        order_id=order._id,
+        customer_name=order.customer_name,
+        items=items,
+        cashier=cashier
+    )
+    bill.store_id = order.store_id
+    return bill
+
+def compute_bill_stats(bills):
+    """Calcule les statistiques d'une liste d'additions"""
+    paid_bills = [b for b in bills if b.payment_status == 'paid']
+    stats = {
+        'total': len(bills),
+        'pending': len([b for b in bills if b.payment_status == 'pending']),
+        'paid': len(paid_bills),
+        'refunded': len([b for b in bills if b.payment_status == 'refunded']),
+        'total_revenue': sum(b.total_amount for b in paid_bills),
+        'total_tax': sum(b.tax for b in paid_bills),
+        'total_discounts': sum(b.discount for b in bills),
+        'average_bill_amount': 0
+    }
+    
+    if len(paid_bills) > 0:
+        stats['average_bill_amount'] = stats['total_revenue'] / len(paid_bills)
+    
+    # Statistiques par méthode de paiement
+    payment_methods = {}
+    for bill in paid_bills:
+        method = bill.payment_method or 'unknown'
+        if method not in payment_methods:
+            payment_methods[method] = {'count': 0, 'amount': 0}
+        payment_methods[method]['count'] += 1
+        payment_methods[method]['amount'] += bill.total_amount
+    
+    stats['payment_methods'] = payment_methods
+    return stats
+
 class BillService:
     """Service pour les opérations CRUD sur les additions"""
     
-    def __init__(self):
+    def __init__(self, cache=None, local_queue=None):
         self.db = get_db()
         self.collection = self.db.bills
+        # Additions payées ou remboursées anciennes (src.models.archive), lues sur demande
+        self.archive_collection = self.db.bills_archive
+        self.cache = cache or bill_cache
+        # File locale des écritures faites pendant une indisponibilité de MongoDB
+        self.offline_queue = local_queue or offline_queue
     
     def create_bill_from_order(self, order, cashier=""):
         """Crée une addition à partir d'une commande"""
-        items = [
-            BillItem(
-                item.product_name,
-                item.quantity,
-                item.price
-            ) for item in order.items
-        ]
+        bill = build_bill_from_order(order, cashier)
+        document = bill.to_dict()
         
-        bill = Bill(
-            order_id=order._id,
-            customer_name=order.customer_name,
-            items=items,
-            cashier=cashier
+        # Mise en file locale si le primaire est indisponible (_id déjà attribué)
+        result = self.offline_queue.execute(
+            "bills", "insert", bill._id, document,
+            lambda: self.collection.insert_one(document),
+            number=bill.bill_number
         )
-        
-        result = self.collection.insert_one(bill.to_dict())
-        bill._id = result.inserted_id
+        if result is not None:
+            bill._id = result.inserted_id
         return bill
     
-    def get_bill_by_id(self, bill_id):
-        """Récupère une addition par son ID"""
-        data = self.collection.find_one({"_id": ObjectId(bill_id)})
+    def get_bill_by_id(self, bill_id, include_archive=False):
+        """Récupère une addition par son ID (archive incluse sur demande)"""
+        data = self.offline_queue.find("bills", entity_id=ObjectId(bill_id))
+        if data is None:
+            data = self.cache.get_by_id(
+                str(ObjectId(bill_id)),
+                lambda: self.collection.find_one({"_id": ObjectId(bill_id)}),
+                "billNumber"
+            )
+            if data is None and include_archive:
+                data = self.archive_collection.find_one({"_id": ObjectId(bill_id)})
+            data = self.offline_queue.overlay("bills", data)
         return Bill.from_dict(data) if data else None
     
-    def get_bill_by_number(self, bill_number):
-        """Récupère une addition par son numéro"""
-        data = self.collection.find_one({"billNumber": bill_number})
+    def get_bill_by_number(self, bill_number, include_archive=False):
+        """Récupère une addition par son numéro (archive incluse sur demande)"""
+        data = self.offline_queue.find("bills", number=bill_number)
+        if data is None:
+            data = self.cache.get_by_number(
+                bill_number,
+                lambda: self.collection.find_one({"billNumber": bill_number}),
+                "billNumber"
+            )
+            if data is None and include_archive:
+                data = self.archive_collection.find_one({"billNumber": bill_number})
+            data = self.offline_queue.overlay("bills", data)
         return Bill.from_dict(data) if data else None
     
-    def get_bills_by_order(self, order_id):
-        """Récupère toutes les additions d'une commande"""
-        cursor = self.collection.find({"orderId": ObjectId(order_id)})
-        return [Bill.from_dict(data) for data in cursor]
+    def _load_bill(self, bill_id):
+        """Lecture directe en base, sans cache, pour les décisions d'écriture
+
+        Hors ligne, la dernière copie en cache tient lieu de lecture en base.
+        """
+        data = self.offline_queue.find("bills", entity_id=ObjectId(bill_id))
+        if data is None:
+            data = self.offline_queue.overlay("bills", self.offline_queue.read(
+                lambda: self.collection.find_one({"_id": ObjectId(bill_id)}),
+                lambda: self.cache.get_by_id(str(ObjectId(bill_id)), lambda: None, "billNumber")
+            ))
+        return Bill.from_dict(data) if data else None
+    
+    def get_bills_by_order(self, order_id, include_archive=False):
+        """Récupère toutes les additions d'une commande (archive incluse sur demande)"""
+        query = {"orderId": ObjectId(order_id)}
+        bills = [Bill.from_dict(data) for data in self.offline_queue.merge_pending(
+            "bills", self.collection.find(query), query, "billDate"
+        )]
+        if include_archive:
+            bills.extend(Bill.from_dict(data) for data in self.archive_collection.find(query))
+        return bills
     
-    def get_all_bills(self, payment_status=None, limit=50):
-        """Récupère toutes les additions avec filtrage optionnel"""
+    def get_all_bills(self, payment_status=None, limit=50, include_archive=False):
+        """Récupère toutes les additions avec filtrage optionnel (archive incluse sur demande)"""
         query = {"paymentStatus": payment_status} if payment_status else {}
         cursor = self.collection.find(query).sort("billDate", -1).limit(limit)
+        if include_archive:
+            archived = self.archive_collection.find(query).sort("billDate", -1).limit(limit)
+            cursor = islice(heapq.merge(cursor, archived, key=lambda data: data["billDate"], reverse=True), limit)
+        cursor = self.offline_queue.merge_pending("bills", cursor, query, "billDate", limit)
         return [Bill.from_dict(data) for data in cursor]
     
     def update_payment_status(self, bill_id, payment_status, payment_method=None):
@@ -183,36 +280,53 @@ class BillService:
         if payment_method:
             update_data["paymentMethod"] = payment_method
         
-        result = self.collection.update_one(
-            {"_id": ObjectId(bill_id)},
-            {"$set": update_data}
+        result = self.offline_queue.execute(
+            "bills", "update", bill_id, update_data,
+            lambda: self.collection.update_one(
+                {"_id": ObjectId(bill_id)},
+                {"$set": update_data}
+            )
         )
-        return result.modified_count > 0
+        self.cache.invalidate(bill_id)
+        # None : paiement mis en file locale, écrit à la reprise de MongoDB
+        return result is None or result.modified_count > 0
     
     def apply_discount_to_bill(self, bill_id, discount_amount):
         """Applique une remise à une addition"""
-        bill = self.get_bill_by_id(bill_id)
+        bill = self._load_bill(bill_id)
         if not bill:
             return False
         
         bill.apply_discount(discount_amount)
         
-        result = self.collection.update_one(
-            {"_id": ObjectId(bill_id)},
-            {"$set": {
-                "discount": bill.discount,
-                "tax": bill.tax,
-                "totalAmount": bill.total_amount
-            }}
+        update_data = {
+            "discount": bill.discount,
+            "tax": bill.tax,
+            "totalAmount": bill.total_amount
+        }
+        result = self.offline_queue.execute(
+            "bills", "update", bill_id, update_data,
+            lambda: self.collection.update_one(
+                {"_id": ObjectId(bill_id)},
+                {"$set": update_data}
+            )
         )
-        return result.modified_count > 0
+        self.cache.invalidate(bill_id)
+        # None : remise mise en file locale, écrite à la reprise de MongoDB
+        return result is None or result.modified_count > 0
     
     def delete_bill(self, bill_id):
         """Supprime une addition (seulement si non payée)"""
-        bill = self.get_bill_by_id(bill_id)
+        bill = self._load_bill(bill_id)
         if bill and bill.payment_status == "pending":
-            result = self.collection.delete_one({"_id": ObjectId(bill_id)})
-            return result.deleted_count > 0
+            # Le filtre sur le statut écarte une addition payée entre-temps (ou avant le rejeu)
+            result = self.offline_queue.execute(
+                "bills", "delete", bill_id, {"paymentStatus": "pending"},
+                lambda: self.collection.delete_one({"_id": ObjectId(bill_id), "paymentStatus": "pending"})
+            )
+            self.cache.invalidate(bill_id)
+            # None : suppression mise en file locale, faite à la reprise de MongoDB
+            return result is None or result.deleted_count > 0
         return False
 
 # Schémas de validation avec Marshmallow
@@ -233,3 +347,14 @@ class BillSchema(Schema):
     def make_bill(self, data, **kwargs):
         return data
 
+# Corps des requêtes de /api/bills
+class BillFromOrderSchema(Schema):
+    cashier = fields.Str(missing="")
+
+class BillPaymentSchema(Schema):
+    paymentStatus = fields.Str(required=True, validate=validate.OneOf(["pending", "paid", "refunded"]))
+    paymentMethod = fields.Str(allow_none=True, validate=validate.OneOf(["cash", "card", "mobile", "check"]))
+
+class BillDiscountSchema(Schema):
+    discountAmount = fields.Float(required=True, validate=validate.Range(min=0))
+
@@ -0,0 +1,339 @@
+"""
+Modèle Stock pour la gestion de l'inventaire du coffee shop
+"""
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from marshmallow import Schema, fields, validate, post_load
+from src.config.database import get_db, current_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+STOCK_CATEGORIES = ["coffee", "pastry", "equipment", "supplies"]
+STOCK_STATUSES = ["available", "low_stock", "out_of_stock", "expired"]
+
+# Valeurs d'un produit créé sans ces champs (mêmes défauts que StockSchema)
+STOCK_DEFAULTS = {
+    "description": "",
+    "quantity": 0,
+    "unit": "unit",
+    "minQuantity": 0,
+    "price": 0,
+    "supplier": ""
+}
+
+class Stock:
+    """Modèle pour les produits en stock"""
+
+    def __init__(self, product_id, name, category, quantity=0, unit="unit",
+                 min_quantity=0, price=0, description="", supplier="", _id=None):
+        self._id = _id or ObjectId()
+        self.product_id = product_id
+        self.name = name
+        self.description = description
+        self.category = category
+        self.quantity = quantity
+        self.unit = unit
+        self.min_quantity = min_quantity
+        self.price = price
+        self.supplier = supplier
+        self.status = self._calculate_status()
+        self.last_updated = datetime.utcnow()
+        # Magasin du produit (chaque magasin a son propre stock)
+        self.store_id = current_store()
+
+    def _calculate_status(self):
+        """Détermine le statut du produit selon la quantité disponible"""
+        return compute_stock_status(self.quantity, self.min_quantity)
+
+    def to_dict(self):
+        """Convertit le produit en dictionnaire pour MongoDB"""
+        return {
+            "_id": str(self._id),
+            "productId": self.product_id,
+            "name": self.name,
+            "description": self.description,
+            "category": self.category,
+            "quantity": self.quantity,
+            "unit": self.unit,
+            "minQuantity": self.min_quantity,
+            "price": self.price,
+            "supplier": self.supplier,
+            "status": self.status,
+            "lastUpdated": self.last_updated,
+            "storeId": self.store_id
+        }
+
+    def to_document(self):
+        """Convertit le produit en document MongoDB (ObjectId natif)"""
+        document = self.to_dict()
+        document["_id"] = self._id
+        return document
+
+    @classmethod
+    def from_dict(cls, data):
+        """Crée un Stock à partir d'un dictionnaire MongoDB"""
+        product = cls(
+            product_id=data["productId"],
+            name=data["name"],
+            category=data["category"],
+            quantity=data.get("quantity", 0),
+            unit=data.get("unit", "unit"),
+            min_quantity=data.get("minQuantity", 0),
+            price=data.get("price", 0),
+            description=data.get("description", ""),
+            supplier=data.get("supplier", ""),
+            _id=data.get("_id")
+        )
+
+        # Restaurer les valeurs depuis la DB
+        product.status = data.get("status", product.status)
+        product.last_updated = data.get("lastUpdated")
+        product.store_id = data.get("storeId") or product.store_id
+
+        return product
+
+def compute_stock_status(quantity, min_quantity):
+    """Calcule le statut d'un produit à partir de sa quantité et de son seuil"""
+    if quantity <= 0:
+        return "out_of_stock"
+    if quantity <= min_quantity:
+        return "low_stock"
+    return "available"
+
+# Nombre de lots du journal dont l'application est mémorisée par produit
+LEDGER_APPLIED_HISTORY = 100
+
+# Équivalent de compute_stock_status pour les mises à jour par pipeline
+STOCK_STATUS_EXPRESSION = {"$switch": {
+    "branches": [
+        {"case": {"$lte": ["$quantity", 0]}, "then": "out_of_stock"},
+        {"case": {"$lte": ["$quantity", {"$ifNull": ["$minQuantity", 0]}]}, "then": "low_stock"}
+    ],
+    "default": "available"
+}}
+
+def duplicate_key_field(error):
+    """Champ unique (productId, name) en cause dans une DuplicateKeyError"""
+    return next(iter((getattr(error, "details", None) or {}).get("keyPattern", {})), None)
+
+class StockService:
+    """Service pour les opérations CRUD sur le stock"""
+
+    def __init__(self):
+        self.db = get_db()
+        self.collection = self.db.stock
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """Enregistre un callback appelé après chaque écriture (operation, product_id)"""
+        self.listeners.append(callback)
+
+    def _notify(self, operation, product_id=None):
+        """Prévient les listeners d'une écriture (product_id=None pour une écriture en masse)"""
+        for callback in self.listeners:
+            try:
+                callback(operation, product_id)
+            except Exception as e:
+                logger.warning(f"Listener de stock en échec ({operation}): {e}")
+
+    def get_all_stock(self, filters=None, page=1, limit=20):
+        """Récupère les produits avec filtres et pagination"""
+        skip = (page - 1) * limit
+        cursor = self.collection.find(filters or {}).sort("name", 1).skip(skip).limit(limit)
+        return [Stock.from_dict(data) for data in cursor]
+
+    def count_stock(self, filters=None):
+        """Compte les produits correspondant aux filtres"""
+        return self.collection.count_documents(filters or {})
+
+    def get_stock_by_id(self, product_id):
+        """Récupère un produit par son ID"""
+        data = self.collection.find_one({"_id": ObjectId(product_id)})
+        return Stock.from_dict(data) if data else None
+
+    def get_stock_by_product_id(self, product_id):
+        """Récupère un produit par son identifiant métier (productId)"""
+        data = self.collection.find_one({"productId": product_id})
+        return Stock.from_dict(data) if data else None
+
+    def existing_product_ids(self, product_ids):
+        """productId donnés qui existent déjà, avec l'_id de leur produit"""
+        return {
+            data["productId"]: data["_id"]
+            for data in self.collection.find({"productId": {"$in": list(product_ids)}}, {"productId": 1})
+        }
+
+    def create_stock(self, stock_data):
+        """Crée un nouveau produit en stock"""
+        product = Stock(
+            product_id=stock_data["productId"],
+            name=stock_data["name"],
+            category=stock_data["category"],
+            quantity=stock_data.get("quantity", 0),
+            unit=stock_data.get("unit", "unit"),
+            min_quantity=stock_data.get("minQuantity", 0),
+            price=stock_data.get("price", 0),
+            description=stock_data.get("description", ""),
+            supplier=stock_data.get("supplier", "")
+        )
+
+        result = self.collection.insert_one(product.to_document())
+        product._id = result.inserted_id
+        self._notify("create", product._id)
+        return product
+
+    def update_stock(self, product_id, stock_data):
+        """Met à jour un produit et recalcule son statut"""
+        current = self.get_stock_by_id(product_id)
+        if not current:
+            return None
+
+        update_data = dict(stock_data)
+        quantity = update_data.get("quantity", current.quantity)
+        min_quantity = update_data.get("minQuantity", current.min_quantity)
+        update_data["status"] = compute_stock_status(quantity, min_quantity)
+        update_data["lastUpdated"] = datetime.utcnow()
+
+        self.collection.update_one(
+            {"_id": ObjectId(product_id)},
+            {"$set": update_data}
+        )
+        self._notify("update", product_id)
+        return self.get_stock_by_id(product_id)
+
+    def delete_stock(self, product_id):
+        """Supprime un produit"""
+        result = self.collection.delete_one({"_id": ObjectId(product_id)})
+        if result.deleted_count > 0:
+            self._notify("delete", product_id)
+        return result.deleted_count > 0
+
+    def bulk_upsert_stock(self, rows, upsert=True):
+        """Upsert en lot de produits validés, par productId.
+
+        `rows` est une liste de couples (référence, données validées
+        partiellement). Seuls les champs présents sont écrits : un produit
+        existant garde ses autres valeurs, un produit créé reçoit les valeurs
+        par défaut du schéma. lastUpdated ne change que si un champ change
+        réellement. Retourne les compteurs d'écriture (insérés, modifiés,
+        trouvés mais inchangés) et les erreurs associées à chaque référence.
+        """
+        if not rows:
+            return {"inserted": 0, "updated": 0, "unchanged": 0, "errors": []}
+
+        now = datetime.utcnow()
+        operations = []
+        for _, data in rows:
+            provided = {k: v for k, v in data.items() if k != "productId"}
+            changed = {"$or": [{"$ne": [f"${k}", {"$literal": v}]} for k, v in provided.items()]}
+            operations.append(UpdateOne(
+                {"productId": data["productId"]},
+                [
+                    # Les expressions d'une même étape lisent le document avant écriture
+                    {"$set": {
+                        **{k: {"$ifNull": [f"${k}", {"$literal": v}]} for k, v in STOCK_DEFAULTS.items()},
+                        **{k: {"$literal": v} for k, v in provided.items()},
+                        "storeId": {"$ifNull": ["$storeId", current_store()]},
+                        "lastUpdated": {"$cond": [changed, now, {"$ifNull": ["$lastUpdated", now]}]}
+                    }},
+                    {"$set": {"status": STOCK_STATUS_EXPRESSION}}
+                ],
+                upsert=upsert
+            ))
+
+        errors = []
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get("writeErrors", []):
+                ref = rows[write_error["index"]][0]
+                if write_error.get("code") == 11000:
+                    field = next(iter(write_error.get("keyPattern", {})), "name")
+                    errors.append((ref, {field: ["Déjà utilisé par un autre produit."]}))
+                else:
+                    errors.append((ref, write_error.get("errmsg", "Erreur d'écriture")))
+
+        self._notify("bulk")
+
+        return {
+            "inserted": details.get("nUpserted", 0),
+            "updated": details.get("nModified", 0),
+            "unchanged": details.get("nMatched", 0) - details.get("nModified", 0),
+            "errors": errors
+        }
+
+    def apply_ledger_delta(self, stock_id, delta, compaction_id):
+        """Reporte un lot du journal de mouvements dans la quantité d'un produit.
+
+        Idempotent pour un lot donné : les derniers lots appliqués sont gardés
+        dans appliedCompactionIds ; retourne la quantité résultante.
+        Le statut n'est pas touché : il suit la quantité à jour (mouvements
+        en attente compris), voir StockMovementService.refresh_status.
+        """
+        data = self.collection.find_one_and_update(
+            {
+                "_id": ObjectId(stock_id),
+                "appliedCompactionIds": {"$ne": compaction_id},
+                # Produits compactés avant appliedCompactionIds
+                "lastCompactionId": {"$ne": compaction_id}
+            },
+            [
+                {"$set": {
+                    "quantity": {"$add": [{"$ifNull": ["$quantity", 0]}, delta]},
+                    "appliedCompactionIds": {"$slice": [
+                        {"$concatArrays": [{"$ifNull": ["$appliedCompactionIds", []]}, [compaction_id]]},
+                        -LEDGER_APPLIED_HISTORY
+                    ]},
+                    "lastCompactionId": compaction_id,
+                    "lastUpdated": datetime.utcnow()
+                }}
+            ],
+            return_document=ReturnDocument.AFTER
+        )
+        if data is None:
+            # Lot déjà appliqué (ou produit supprimé)
+            data = self.collection.find_one({"_id": ObjectId(stock_id)}, {"quantity": 1})
+            return data["quantity"] if data else None
+
+        self._notify("update", stock_id)
+        return data["quantity"]
+
+    def get_prices(self, names):
+        """Récupère prix et statut d'un ensemble de produits (par nom) en une requête"""
+        cursor = self.collection.find(
+            {"name": {"$in": list(names)}},
+            {"name": 1, "price": 1, "status": 1, "productId": 1}
+        )
+        return {data["name"]: data for data in cursor}
+
+    def get_low_stock_alerts(self):
+        """Récupère les produits en stock faible ou en rupture"""
+        cursor = self.collection.find(
+            {"status": {"$in": ["low_stock", "out_of_stock"]}}
+        ).sort("quantity", 1)
+        return [Stock.from_dict(data) for data in cursor]
+
+    def get_categories(self):
+        """Récupère la liste des catégories utilisées"""
+        return sorted(self.collection.distinct("category"))
+
+# Schémas de validation avec Marshmallow
+class StockSchema(Schema):
+    productId = fields.Str(required=True, validate=validate.Length(min=1))
+    name = fields.Str(required=True, validate=validate.Length(min=1))
+    description = fields.Str(missing="")
+    category = fields.Str(required=True, validate=validate.OneOf(STOCK_CATEGORIES))
+    quantity = fields.Float(missing=0, validate=validate.Range(min=0))
+    unit = fields.Str(missing="unit")
+    minQuantity = fields.Float(missing=0, validate=validate.Range(min=0))
+    price = fields.Float(missing=0, validate=validate.Range(min=0))
+    supplier = fields.Str(missing="")
+
+    @post_load
+    def make_stock(self, data, **kwargs):
+        return data
@@ -1,10 +1,22 @@
 """
 Modèle Order pour la gestion des commandes du coffee shop
 """
+import heapq
+import secrets
+import logging
+from itertools import islice
 from datetime import datetime
 from bson import ObjectId
+from pymongo.errors import PyMongoError
 from marshmallow import Schema, fields, validate, post_load
-from src.config.database import get_db
+from src.config.database import get_db, current_store
+from src.config.cache import order_cache
+from src.models.Inventory import StockService
+from src.models.StockMovement import StockMovementService, sale_movements
+from src.models.write_behind import order_status_writer
+from src.models.offline_queue import offline_queue
+
+logger = logging.getLogger(__name__)
 
 class OrderItem:
     """Classe pour représenter un item dans une commande"""
@@ -27,11 +39,14 @@ class Order:
         self.order_date = datetime.utcnow()
         self.estimated_time = self._calculate_estimated_time()
         self.notes = notes
+        # Magasin de la commande (chaque magasin a sa propre base)
+        self.store_id = current_store()
     
     def _generate_order_number(self):
         """Génère un numéro de commande unique"""
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        return f"ORD-{timestamp}"
+        # Suffixe aléatoire : plusieurs commandes peuvent être créées dans la même seconde
+        return f"ORD-{timestamp}-{secrets.token_hex(3).upper()}"
     
     def _calculate_total(self):
         """Calcule le montant total de la commande"""
@@ -61,7 +76,8 @@ class Order:
             "status": self.status,
             "orderDate": self.order_date,
             "estimatedTime": self.estimated_time,
-            "notes": self.notes
+            "notes": self.notes,
+            "storeId": self.store_id
         }
     
     @classmethod
@@ -89,75 +105,248 @@ class Order:
         order.order_date = data.get("orderDate")
         order.estimated_time = data.get("estimatedTime")
         order.total_amount = data.get("totalAmount")
+        order.store_id = data.get("storeId") or order.store_id
         
         return order
 
+def check_catalog_prices(names, catalog):
+    """Vérifie les produits demandés contre le catalogue et retourne leurs prix"""
+    unknown = sorted(names - set(catalog))
+    if unknown:
+        raise ValueError(f"Produits inconnus: {', '.join(unknown)}")
+    
+    unavailable = sorted(name for name in names if catalog[name].get("status") == "out_of_stock")
+    if unavailable:
+        raise ValueError(f"Produits indisponibles: {', '.join(unavailable)}")
+    
+    return {name: catalog[name].get("price", 0) for name in names}
+
+def build_order(order_data, prices):
+    """Construit une commande à partir des données validées et des prix du catalogue"""
+    items = [
+        OrderItem(
+            item["productName"],
+            item["quantity"],
+            prices[item["productName"]],
+            item.get("customizations", [])
+        ) for item in order_data.get("items", [])
+    ]
+    
+    return Order(
+        customer_name=order_data["customerName"],
+        items=items,
+        notes=order_data.get("notes", "")
+    )
+
+def compute_order_stats(orders):
+    """Calcule les statistiques d'une liste de commandes"""
+    completed_orders = [o for o in orders if o.status == 'completed']
+    stats = {
+        'total': len(orders),
+        'pending': len([o for o in orders if o.status == 'pending']),
+        'preparing': len([o for o in orders if o.status == 'preparing']),
+        'ready': len([o for o in orders if o.status == 'ready']),
+        'completed': len(completed_orders),
+        'total_revenue': sum(o.total_amount for o in completed_orders),
+        'average_order_value': 0
+    }
+    
+    if stats['completed'] > 0:
+        stats['average_order_value'] = stats['total_revenue'] / len(completed_orders)
+    
+    return stats
+
 class OrderService:
     """Service pour les opérations CRUD sur les commandes"""
     
-    def __init__(self):
+    def __init__(self, price_catalog=None, cache=None, status_writer=None, local_queue=None,
+                 movement_service=None):
         self.db = get_db()
         self.collection = self.db.orders
+        # Commandes clôturées anciennes (src.models.archive), lues sur demande
+        self.archive_collection = self.db.orders_archive
+        # Source des prix : réplique en mémoire du catalogue ou StockService
+        self.price_catalog = price_catalog or StockService()
+        self.cache = cache or order_cache
+        # Statuts écrits en différé (ORDER_STATUS_WRITE_BEHIND), relus via le tampon
+        self.status_writer = status_writer or order_status_writer
+        # File locale des écritures faites pendant une indisponibilité de MongoDB
+        self.offline_queue = local_queue or offline_queue
+        # Journal de stock : chaque commande y enregistre ses ventes
+        self.movement_service = movement_service or StockMovementService(StockService())
+    
+    def read_catalog(self, names):
+        """Prix, disponibilité et identifiants des produits en un seul appel au catalogue"""
+        # Hors ligne : dernier relevé local des prix, sans attendre MongoDB
+        return self.offline_queue.read_prices(names, lambda: self.price_catalog.get_prices(names))
+    
+    def resolve_prices(self, items_data):
+        """Résout les prix et la disponibilité de tous les items en un seul appel au catalogue"""
+        names = {item["productName"] for item in items_data}
+        return check_catalog_prices(names, self.read_catalog(names))
     
     def create_order(self, order_data):
-        """Crée une nouvelle commande"""
-        items = [
-            OrderItem(
-                item["productName"],
-                item["quantity"],
-                item["price"],
-                item.get("customizations", [])
-            ) for item in order_data.get("items", [])
-        ]
+        """Crée une nouvelle commande (prix issus du catalogue, pas du client)"""
+        names = {item["productName"] for item in order_data.get("items", [])}
+        catalog = self.read_catalog(names)
+        order = build_order(order_data, check_catalog_prices(names, catalog))
+        document = order.to_dict()
         
-        order = Order(
-            customer_name=order_data["customerName"],
-            items=items,
-            notes=order_data.get("notes", "")
+        # Mise en file locale si le primaire est indisponible (_id déjà attribué)
+        result = self.offline_queue.execute(
+            "orders", "insert", order._id, document,
+            lambda: self.collection.insert_one(document),
+            number=order.order_number
         )
-        
-        result = self.collection.insert_one(order.to_dict())
-        order._id = result.inserted_id
+        if result is not None:
+            order._id = result.inserted_id
+        self.record_sales(order, catalog)
         return order
     
-    def get_order_by_id(self, order_id):
-        """Récupère une commande par son ID"""
-        data = self.collection.find_one({"_id": ObjectId(order_id)})
+    def record_sales(self, order, catalog):
+        """Enregistre les ventes d'une commande dans le journal de stock (file locale si hors ligne)"""
+        written = []
+        for movement in sale_movements(order.items, catalog, reference=order.order_number):
+            movement.order_id = order._id
+            document = movement.to_dict()
+            result = self.offline_queue.execute(
+                "stock_movements", "insert", movement._id, document,
+                lambda document=document: self.movement_service.collection.insert_one(document)
+            )
+            if result is not None:
+                written.append(movement.stock_id)
+        if written:
+            try:
+                self.movement_service.refresh_status(written)
+            except PyMongoError as e:
+                # Rattrapé à la prochaine compaction du journal
+                logger.warning(f"Statut de stock non recalculé après la commande {order.order_number}: {e}")
+    
+    def get_order_by_id(self, order_id, include_archive=False, for_update=False):
+        """Récupère une commande par son ID (archive incluse sur demande).
+
+        for_update=True lit la base sans passer par le cache, pour les
+        décisions d'écriture (suppression, facturation).
+        """
+        if for_update:
+            return self._load_order(order_id)
+        data = self.offline_queue.find("orders", entity_id=ObjectId(order_id))
+        if data is None:
+            data = self.cache.get_by_id(
+                str(ObjectId(order_id)),
+                lambda: self.collection.find_one({"_id": ObjectId(order_id)}),
+                "orderNumber"
+            )
+            if data is None and include_archive:
+                data = self.archive_collection.find_one({"_id": ObjectId(order_id)})
+            data = self.offline_queue.overlay("orders", data)
+        data = self.status_writer.overlay(data)
+        return Order.from_dict(data) if data else None
+    
+    def _load_order(self, order_id):
+        """Lecture directe en base, sans cache, pour les décisions d'écriture
+
+        Hors ligne, la dernière copie en cache tient lieu de lecture en base.
+        """
+        data = self.offline_queue.find("orders", entity_id=ObjectId(order_id))
+        if data is None:
+            data = self.offline_queue.overlay("orders", self.offline_queue.read(
+                lambda: self.collection.find_one({"_id": ObjectId(order_id)}),
+                lambda: self.cache.get_by_id(str(ObjectId(order_id)), lambda: None, "orderNumber")
+            ))
+        data = self.status_writer.overlay(data)
         return Order.from_dict(data) if data else None
     
-    def get_order_by_number(self, order_number):
-        """Récupère une commande par son numéro"""
-        data = self.collection.find_one({"orderNumber": order_number})
+    def get_order_by_number(self, order_number, include_archive=False):
+        """Récupère une commande par son numéro (archive incluse sur demande)"""
+        data = self.offline_queue.find("orders", number=order_number)
+        if data is None:
+            data = self.cache.get_by_number(
+                order_number,
+                lambda: self.collection.find_one({"orderNumber": order_number}),
+                "orderNumber"
+            )
+            if data is None and include_archive:
+                data = self.archive_collection.find_one({"orderNumber": order_number})
+            data = self.offline_queue.overlay("orders", data)
+        data = self.status_writer.overlay(data)
         return Order.from_dict(data) if data else None
     
-    def get_all_orders(self, status=None, limit=50):
-        """Récupère toutes les commandes avec filtrage optionnel"""
+    def get_all_orders(self, status=None, limit=50, include_archive=False):
+        """Récupère toutes les commandes avec filtrage optionnel (archive incluse sur demande)"""
         query = {"status": status} if status else {}
         cursor = self.collection.find(query).sort("orderDate", -1).limit(limit)
+        if include_archive:
+            archived = self.archive_collection.find(query).sort("orderDate", -1).limit(limit)
+            cursor = islice(heapq.merge(cursor, archived, key=lambda data: data["orderDate"], reverse=True), limit)
+        cursor = self.offline_queue.merge_pending("orders", cursor, query, "orderDate", limit)
+        if self.status_writer.enabled:
+            cursor = self._overlay_pending(cursor, status, limit)
         return [Order.from_dict(data) for data in cursor]
     
+    def _overlay_pending(self, documents, status, limit):
+        """Applique les statuts en attente à une liste triée par orderDate desc"""
+        documents = [self.status_writer.overlay(data) for data in documents]
+        if not status:
+            return documents
+        # Commandes sorties du filtre, et commandes qui y entrent depuis le tampon
+        documents = [data for data in documents if data["status"] == status]
+        seen = {data["_id"] for data in documents}
+        entering = [order_id for order_id in self.status_writer.pending_with_status(status) if order_id not in seen]
+        if entering:
+            documents.extend(self.status_writer.overlay(data) for data in self.collection.find({"_id": {"$in": entering}}))
+            documents.sort(key=lambda data: data["orderDate"], reverse=True)
+        return documents[:limit]
+    
     def update_order_status(self, order_id, new_status):
         """Met à jour le statut d'une commande"""
         valid_statuses = ["pending", "preparing", "ready", "completed"]
         if new_status not in valid_statuses:
             raise ValueError(f"Statut invalide: {new_status}")
         
-        result = self.collection.update_one(
-            {"_id": ObjectId(order_id)},
-            {"$set": {"status": new_status}}
+        if self.status_writer.enabled and not self.offline_queue.has_pending():
+            # Acquitté depuis le journal local, écrit au prochain vidage ; le statut
+            # de départ est lu en base (pas dans le cache) : il conditionne l'écriture
+            order = self.get_order_by_id(order_id, for_update=True)
+            if order is None or order.status == new_status:
+                return False
+            self.status_writer.enqueue(order_id, new_status, previous=order.status)
+            return True
+        
+        # Le nouveau statut remplace un statut différé encore en attente : sinon le
+        # tampon le masquerait en lecture et pourrait l'écraser au prochain vidage
+        self.status_writer.discard(order_id)
+        result = self.offline_queue.execute(
+            "orders", "update", order_id, {"status": new_status},
+            lambda: self.collection.update_one(
+                {"_id": ObjectId(order_id)},
+                {"$set": {"status": new_status}}
+            )
         )
-        return result.modified_count > 0
+        self.cache.invalidate(order_id)
+        # None : mis en file locale, écrit à la reprise de MongoDB
+        return result is None or result.modified_count > 0
     
     def delete_order(self, order_id):
-        """Supprime une commande"""
-        result = self.collection.delete_one({"_id": ObjectId(order_id)})
-        return result.deleted_count > 0
+        """Supprime une commande encore en attente"""
+        if self.status_writer.pending_status(order_id) not in (None, "pending"):
+            return False
+        # Le filtre sur le statut écarte une commande passée en préparation entre-temps
+        result = self.offline_queue.execute(
+            "orders", "delete", order_id, {"status": "pending"},
+            lambda: self.collection.delete_one({"_id": ObjectId(order_id), "status": "pending"})
+        )
+        self.status_writer.discard(order_id)
+        self.cache.invalidate(order_id)
+        # None : suppression mise en file locale, faite à la reprise de MongoDB
+        return result is None or result.deleted_count > 0
 
 # Schémas de validation avec Marshmallow
 class OrderItemSchema(Schema):
     productName = fields.Str(required=True, validate=validate.Length(min=1))
     quantity = fields.Int(required=True, validate=validate.Range(min=1))
-    price = fields.Float(required=True, validate=validate.Range(min=0))
+    # Indicatif : le prix appliqué est toujours celui du catalogue
+    price = fields.Float(validate=validate.Range(min=0))
     customizations = fields.List(fields.Str(), missing=[])
 
 class OrderSchema(Schema):
@@ -0,0 +1,447 @@
+"""
+Modèle StockMovement : journal des mouvements de stock en ajout seul
+
+Chaque réception, vente, perte ou ajustement est un simple insert dans
+`stock_movements` : les écritures concurrentes sur un même produit ne se
+disputent plus le document de stock. Un compacteur en arrière-plan reporte
+périodiquement les mouvements dans la quantité du produit et dans des
+instantanés journaliers (`stock_snapshots`).
+
+La quantité à jour d'un produit est sa quantité compactée plus ses
+mouvements en attente. Une quantité fixée en absolu (mise à jour du produit,
+import) est donc enregistrée comme un ajustement de l'écart avec cette
+quantité à jour, jamais écrite directement dans le produit. Le statut
+(low_stock, out_of_stock) est recalculé sur la quantité à jour après chaque
+mouvement, sans attendre la compaction.
+"""
+import os
+import uuid
+import threading
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from marshmallow import Schema, fields, validate, post_load, validates_schema, ValidationError
+from src.config.database import get_db, db_config, use_store
+from src.models.Inventory import compute_stock_status
+
+logger = logging.getLogger(__name__)
+
+MOVEMENT_TYPES = ["receipt", "sale", "waste", "adjustment"]
+# Durée du bail d'un compacteur sur un lot : au-delà, le lot est considéré abandonné
+STOCK_LEDGER_LEASE_SECONDS = float(os.getenv('STOCK_LEDGER_LEASE_SECONDS', '300'))
+# Lots mémorisés par instantané (voir LEDGER_APPLIED_HISTORY pour les produits)
+SNAPSHOT_APPLIED_HISTORY = 100
+
+class StockMovement:
+    """Modèle pour un mouvement de stock"""
+
+    def __init__(self, stock_id, product_id, movement_type, quantity, reason="", reference="", _id=None,
+                 order_id=None):
+        if movement_type not in MOVEMENT_TYPES:
+            raise ValueError(f"Type de mouvement invalide: {movement_type}")
+        self._id = _id or ObjectId()
+        self.stock_id = ObjectId(stock_id) if isinstance(stock_id, str) else stock_id
+        self.product_id = product_id
+        self.movement_type = movement_type
+        self.quantity = quantity
+        self.delta = self._calculate_delta()
+        self.reason = reason
+        self.reference = reference
+        # Commande à l'origine d'une vente
+        self.order_id = order_id
+        self.created_at = datetime.utcnow()
+        self.compaction_id = None
+        self.compacted = False
+
+    def _calculate_delta(self):
+        """Calcule la variation signée de quantité"""
+        if self.movement_type == "receipt":
+            return abs(self.quantity)
+        if self.movement_type in ("sale", "waste"):
+            return -abs(self.quantity)
+        # Un ajustement porte son propre signe
+        return self.quantity
+
+    def to_dict(self):
+        """Convertit le mouvement en dictionnaire pour MongoDB"""
+        return {
+            "_id": self._id,
+            "stockId": self.stock_id,
+            "productId": self.product_id,
+            "type": self.movement_type,
+            "quantity": self.quantity,
+            "delta": self.delta,
+            "reason": self.reason,
+            "reference": self.reference,
+            "orderId": self.order_id,
+            "createdAt": self.created_at,
+            "compactionId": self.compaction_id,
+            "compacted": self.compacted
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Crée un StockMovement à partir d'un dictionnaire MongoDB"""
+        movement = cls(
+            stock_id=data["stockId"],
+            product_id=data.get("productId"),
+            movement_type=data["type"],
+            quantity=data["quantity"],
+            reason=data.get("reason", ""),
+            reference=data.get("reference", ""),
+            _id=data.get("_id"),
+            order_id=data.get("orderId")
+        )
+
+        # Restaurer les valeurs depuis la DB
+        movement.delta = data.get("delta", movement.delta)
+        movement.created_at = data.get("createdAt")
+        movement.compaction_id = data.get("compactionId")
+        movement.compacted = data.get("compacted", False)
+
+        return movement
+
+def sale_movements(items, catalog, reference=""):
+    """Mouvements de vente d'une commande (un par produit), catalog issu de get_prices"""
+    quantities = {}
+    for item in items:
+        quantities[item.product_name] = quantities.get(item.product_name, 0) + item.quantity
+    return [
+        StockMovement(
+            stock_id=catalog[name]["_id"],
+            product_id=catalog[name].get("productId"),
+            movement_type="sale",
+            quantity=quantity,
+            reason="Vente",
+            reference=reference
+        )
+        for name, quantity in quantities.items()
+        if catalog.get(name, {}).get("_id") is not None
+    ]
+
+def pending_deltas_pipeline(stock_ids):
+    """Agrégation des mouvements non compactés, par produit et par lot"""
+    return [
+        {"$match": {"stockId": {"$in": list(stock_ids)}, "compacted": False}},
+        {"$group": {"_id": {"stockId": "$stockId", "compactionId": "$compactionId"}, "delta": {"$sum": "$delta"}}}
+    ]
+
+# Champs du produit nécessaires au calcul de la quantité à jour
+EFFECTIVE_QUANTITY_PROJECTION = {
+    "quantity": 1, "minQuantity": 1, "status": 1, "lastCompactionId": 1, "appliedCompactionIds": 1
+}
+
+def effective_quantities(products, groups):
+    """Quantité à jour de chaque produit : quantité compactée plus mouvements en attente
+
+    Les lots déjà reportés dans le produit mais pas encore marqués compactés
+    ne sont pas recomptés.
+    """
+    quantities = {}
+    applied = {}
+    for data in products:
+        quantities[data["_id"]] = data.get("quantity", 0)
+        applied[data["_id"]] = set(data.get("appliedCompactionIds", [])) | {data.get("lastCompactionId")}
+    for group in groups:
+        stock_id = group["_id"]["stockId"]
+        compaction_id = group["_id"].get("compactionId")
+        if stock_id in quantities and (compaction_id is None or compaction_id not in applied[stock_id]):
+            quantities[stock_id] += group["delta"]
+    return quantities
+
+def adjustment_movements(products, quantities, targets, reason, reference=""):
+    """Ajustements qui amènent chaque produit de sa quantité à jour à la quantité cible"""
+    movements = []
+    for data in products:
+        target = targets.get(data["_id"])
+        if target is None or quantities[data["_id"]] == target:
+            continue
+        movements.append(StockMovement(
+            stock_id=data["_id"],
+            product_id=data.get("productId"),
+            movement_type="adjustment",
+            quantity=target - quantities[data["_id"]],
+            reason=reason,
+            reference=reference
+        ))
+    return movements
+
+class StockMovementService:
+    """Service pour le journal des mouvements et sa compaction"""
+
+    def __init__(self, stock_service, lease_seconds=STOCK_LEDGER_LEASE_SECONDS):
+        self.db = get_db()
+        self.collection = self.db.stock_movements
+        self.snapshots = self.db.stock_snapshots
+        self.stock_service = stock_service
+        self.lease_seconds = lease_seconds
+
+    def record_movement(self, product, movement_data):
+        """Ajoute un mouvement au journal (insert seul, sans toucher au produit)"""
+        movement = StockMovement(
+            stock_id=product._id,
+            product_id=product.product_id,
+            movement_type=movement_data["type"],
+            quantity=movement_data["quantity"],
+            reason=movement_data.get("reason", ""),
+            reference=movement_data.get("reference", "")
+        )
+        result = self.collection.insert_one(movement.to_dict())
+        movement._id = result.inserted_id
+        self.refresh_status([movement.stock_id])
+        return movement
+
+    def record_movements(self, movements):
+        """Ajoute plusieurs mouvements au journal puis met à jour le statut des produits"""
+        if not movements:
+            return []
+        self.collection.insert_many([movement.to_dict() for movement in movements], ordered=False)
+        self.refresh_status({movement.stock_id for movement in movements})
+        return movements
+
+    def set_quantities(self, targets, reason="Quantité fixée", reference=""):
+        """Fixe la quantité de produits existants ({stock_id: quantité}) par des ajustements
+
+        Les mouvements encore en attente restent comptés : seul l'écart entre
+        la quantité à jour et la cible est enregistré.
+        """
+        targets = {ObjectId(stock_id): quantity for stock_id, quantity in targets.items()}
+        products, quantities = self._effective(targets.keys(), {"productId": 1})
+        movements = adjustment_movements(products, quantities, targets, reason, reference)
+        self.record_movements(movements)
+        return movements
+
+    def update_stock(self, product_id, stock_data):
+        """Met à jour un produit ; une nouvelle quantité devient un ajustement du journal"""
+        stock_data = dict(stock_data)
+        quantity = stock_data.pop("quantity", None)
+        product = self.stock_service.update_stock(product_id, stock_data)
+        if product is None:
+            return None
+        if quantity is not None:
+            self.set_quantities({product._id: quantity}, reason="Mise à jour du produit")
+        else:
+            # minQuantity a pu changer : statut recalculé sur la quantité à jour
+            self.refresh_status([product._id])
+        return self.stock_service.get_stock_by_id(product_id)
+
+    def _effective(self, stock_ids, projection=None):
+        """Produits (champs utiles au calcul) et leur quantité à jour"""
+        stock_ids = [ObjectId(stock_id) for stock_id in stock_ids]
+        if not stock_ids:
+            return [], {}
+        products = list(self.stock_service.collection.find(
+            {"_id": {"$in": stock_ids}}, {**EFFECTIVE_QUANTITY_PROJECTION, **(projection or {})}
+        ))
+        groups = self.collection.aggregate(pending_deltas_pipeline(stock_ids))
+        return products, effective_quantities(products, groups)
+
+    def refresh_status(self, stock_ids):
+        """Recalcule le statut des produits sur leur quantité à jour (seulement s'il change)"""
+        products, quantities = self._effective(stock_ids)
+        changed = []
+        for data in products:
+            status = compute_stock_status(quantities[data["_id"]], data.get("minQuantity", 0))
+            if status == data.get("status"):
+                continue
+            # Filtré sur l'ancien statut : un recalcul concurrent plus récent n'est pas écrasé
+            result = self.stock_service.collection.update_one(
+                {"_id": data["_id"], "status": data.get("status")},
+                {"$set": {"status": status, "lastUpdated": datetime.utcnow()}}
+            )
+            if result.modified_count:
+                changed.append(data["_id"])
+        for stock_id in changed:
+            self.stock_service._notify("update", stock_id)
+        return len(changed)
+
+    def get_movements(self, stock_id, limit=50):
+        """Récupère l'historique des mouvements d'un produit"""
+        cursor = self.collection.find(
+            {"stockId": ObjectId(stock_id)}
+        ).sort("createdAt", -1).limit(limit)
+        return [StockMovement.from_dict(data) for data in cursor]
+
+    def get_current_quantity(self, stock_id):
+        """Quantité à jour : quantité compactée plus mouvements en attente"""
+        _, quantities = self._effective([stock_id])
+        return quantities.get(ObjectId(stock_id))
+
+    def get_snapshots(self, stock_id, limit=30):
+        """Récupère les instantanés journaliers d'un produit"""
+        cursor = self.snapshots.find(
+            {"stockId": ObjectId(stock_id)}, {"_id": 0, "lastCompactionId": 0, "appliedCompactionIds": 0}
+        ).sort("day", -1).limit(limit)
+        return list(cursor)
+
+    def compact(self, batch_size=1000):
+        """Reporte un lot de mouvements dans les produits et les instantanés.
+
+        Chaque lot est tenu par un bail dans `locks` : un lot non terminé
+        n'est repris que si le bail de son compacteur a expiré (processus
+        arrêté en cours de compaction), jamais pendant qu'un autre worker le
+        traite. Chaque étape reste idempotente pour un lot donné.
+        """
+        compacted = 0
+        for compaction_id in self.collection.distinct(
+            "compactionId", {"compacted": False, "compactionId": {"$ne": None}}
+        ):
+            if self._acquire_batch(compaction_id):
+                compacted += self._compact_batch(compaction_id)
+
+        compaction_id = self._claim_batch(batch_size)
+        if compaction_id:
+            compacted += self._compact_batch(compaction_id)
+        return compacted
+
+    def _claim_batch(self, batch_size):
+        """Réserve un lot de mouvements pour ce compacteur"""
+        candidates = [
+            data["_id"] for data in self.collection.find(
+                {"compactionId": None}, {"_id": 1}
+            ).sort("createdAt", 1).limit(batch_size)
+        ]
+        if not candidates:
+            return None
+
+        compaction_id = uuid.uuid4().hex
+        if not self._acquire_batch(compaction_id):
+            return None
+        # Un autre compacteur peut avoir réservé une partie des candidats entre-temps
+        self.collection.update_many(
+            {"_id": {"$in": candidates}, "compactionId": None},
+            {"$set": {"compactionId": compaction_id}}
+        )
+        return compaction_id
+
+    def _acquire_batch(self, compaction_id):
+        """Prend le bail d'un lot ; False s'il est tenu par un compacteur encore actif"""
+        now = datetime.utcnow()
+        try:
+            self.db.locks.find_one_and_update(
+                {"_id": f"compaction:{compaction_id}", "until": {"$lt": now}},
+                {"$set": {"until": now + timedelta(seconds=self.lease_seconds), "owner": f"{os.getpid()}"}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def _compact_batch(self, compaction_id):
+        """Applique un lot réservé aux produits puis aux instantanés"""
+        per_day = list(self.collection.aggregate([
+            {"$match": {"compactionId": compaction_id}},
+            {"$group": {
+                "_id": {
+                    "stockId": "$stockId",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$createdAt"}},
+                    "type": "$type"
+                },
+                "delta": {"$sum": "$delta"},
+                "count": {"$sum": 1}
+            }}
+        ]))
+        if not per_day:
+            self.db.locks.delete_one({"_id": f"compaction:{compaction_id}"})
+            return 0
+
+        per_stock = {}
+        per_snapshot = {}
+        for group in per_day:
+            key = group["_id"]
+            per_stock[key["stockId"]] = per_stock.get(key["stockId"], 0) + group["delta"]
+            snapshot = per_snapshot.setdefault((key["stockId"], key["day"]), {"net": 0, "movements": 0})
+            snapshot["net"] += group["delta"]
+            snapshot["movements"] += group["count"]
+            snapshot[key["type"]] = snapshot.get(key["type"], 0) + group["delta"]
+
+        quantities = {}
+        for stock_id, delta in per_stock.items():
+            quantities[stock_id] = self.stock_service.apply_ledger_delta(stock_id, delta, compaction_id)
+
+        operations = []
+        for (stock_id, day), totals in per_snapshot.items():
+            update = {
+                "$inc": totals,
+                "$set": {"lastCompactionId": compaction_id, "updatedAt": datetime.utcnow()},
+                "$push": {"appliedCompactionIds": {"$each": [compaction_id], "$slice": -SNAPSHOT_APPLIED_HISTORY}}
+            }
+            if quantities.get(stock_id) is not None:
+                update["$set"]["closingQuantity"] = quantities[stock_id]
+            operations.append(UpdateOne(
+                {
+                    "stockId": stock_id,
+                    "day": day,
+                    "appliedCompactionIds": {"$ne": compaction_id},
+                    "lastCompactionId": {"$ne": compaction_id}
+                },
+                update,
+                upsert=True
+            ))
+        if operations:
+            try:
+                self.snapshots.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # Clé dupliquée : l'instantané a déjà reçu ce lot (reprise)
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+
+        result = self.collection.update_many(
+            {"compactionId": compaction_id},
+            {"$set": {"compacted": True, "compactedAt": datetime.utcnow()}}
+        )
+        self.db.locks.delete_one({"_id": f"compaction:{compaction_id}"})
+        # Rattrape les recalculs de statut manqués (écriture concurrente, autre processus)
+        self.refresh_status(per_stock.keys())
+        logger.info(f"Compaction du journal de stock {compaction_id}: {result.modified_count} mouvements")
+        return result.modified_count
+
+class StockLedgerCompactor:
+    """Thread de compaction périodique du journal de stock"""
+
+    def __init__(self, movement_service, interval=None):
+        self.movement_service = movement_service
+        self.interval = interval or float(os.getenv('STOCK_LEDGER_COMPACT_SECONDS', '30'))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Démarre la compaction en arrière-plan"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='stock-ledger-compactor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Arrête la compaction"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # Chaque magasin a son propre journal
+            for store_id in db_config.store_ids():
+                try:
+                    with use_store(store_id):
+                        self.movement_service.compact()
+                except Exception as e:
+                    logger.error(f"Erreur lors de la compaction du journal de stock ({store_id}): {e}")
+
+# Schémas de validation avec Marshmallow
+class StockMovementSchema(Schema):
+    type = fields.Str(required=True, validate=validate.OneOf(MOVEMENT_TYPES))
+    quantity = fields.Float(required=True)
+    reason = fields.Str(missing="")
+    reference = fields.Str(missing="")
+
+    @validates_schema
+    def validate_quantity(self, data, **kwargs):
+        if data.get("type") != "adjustment" and data.get("quantity", 0) <= 0:
+            raise ValidationError("La quantité doit être positive pour ce type de mouvement", "quantity")
+
+    @post_load
+    def make_movement(self, data, **kwargs):
+        return data
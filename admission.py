@@ -0,0 +1,272 @@
+"""
+Contrôle d'admission et délestage de l'API Coffee Shop
+
+Chaque requête est rangée dans une classe de route :
+- critical : prise de commande, création et paiement d'une addition,
+- default : lectures et mises à jour courantes, y compris les statistiques
+  et alertes servies par CoalescedCache (un seul calcul par rafale),
+- reporting : rapports multi-magasins et imports.
+
+Chaque worker limite le nombre de requêtes en cours, globalement et par
+classe. Les classes non critiques se partagent au plus
+ADMISSION_MAX_CONCURRENCY - ADMISSION_CRITICAL_RESERVE places : les
+dernières restent disponibles pour les prises de commande et les
+paiements, même quand lectures et rapports saturent. Une requête en
+attente occupe un thread du worker (gthread) : une requête non critique
+n'attend donc que si les requêtes non critiques en cours et en attente
+laissent la réserve intacte, sinon elle reçoit tout de suite un 503.
+Dans la file, les classes les plus prioritaires passent en premier. Si
+la file de sa classe est pleine ou si l'attente dépasse son délai, la
+requête reçoit un 503 avec Retry-After. Un seau à jetons par client et
+par classe renvoie 429 au-delà du débit autorisé.
+
+Client : adresse de la requête. Derrière un ou plusieurs proxys
+(ADMISSION_TRUSTED_PROXIES > 0), ProxyFix la remplace par l'adresse
+transmise dans X-Forwarded-For ; sans cela, tous les clients passant par le
+proxy partageraient le même seau.
+
+Toutes les limites sont réglables par variables d'environnement :
+ADMISSION_<CLASSE>_CONCURRENCY, _QUEUE, _TIMEOUT_MS, _RATE et _BURST.
+"""
+import os
+import math
+import time
+import threading
+from flask import request, g, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
+from prometheus_client import Counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+# Par défaut, autant de requêtes en cours que de threads du worker
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', os.getenv('WEB_THREADS', '8')))
+ADMISSION_MAX_CLIENTS = int(os.getenv('ADMISSION_MAX_CLIENTS', '10000'))
+# Places que les classes non critiques ne peuvent jamais occuper
+ADMISSION_CRITICAL_RESERVE = int(os.getenv('ADMISSION_CRITICAL_RESERVE', '2'))
+# Nombre de proxys de confiance devant le serveur (X-Forwarded-For)
+ADMISSION_TRUSTED_PROXIES = int(os.getenv('ADMISSION_TRUSTED_PROXIES', '0'))
+
+def _class_config(name, priority, concurrency, queue, timeout_ms, rate, burst):
+    prefix = f"ADMISSION_{name.upper()}_"
+    return {
+        'priority': priority,
+        'concurrency': int(os.getenv(prefix + 'CONCURRENCY', str(concurrency))),
+        'queue': int(os.getenv(prefix + 'QUEUE', str(queue))),
+        'timeout': float(os.getenv(prefix + 'TIMEOUT_MS', str(timeout_ms))) / 1000,
+        'rate': float(os.getenv(prefix + 'RATE', str(rate))),
+        'burst': float(os.getenv(prefix + 'BURST', str(burst)))
+    }
+
+# Priorité 0 = servie en premier
+ROUTE_CLASSES = {
+    'critical': _class_config('critical', 0, ADMISSION_MAX_CONCURRENCY, 64, 2000, 10, 20),
+    'default': _class_config('default', 1, max(1, ADMISSION_MAX_CONCURRENCY * 3 // 4), 32, 1000, 20, 40),
+    'reporting': _class_config('reporting', 2, max(1, ADMISSION_MAX_CONCURRENCY // 4), 8, 2000, 2, 10)
+}
+
+CRITICAL_ROUTES = {
+    ('POST', '/api/orders/'),
+    ('POST', '/api/bills/from-order/<order_id>'),
+    ('PUT', '/api/bills/<bill_id>/payment')
+}
+REPORTING_ROUTES = {
+    ('POST', '/api/stock/import'),
+    ('GET', '/api/reports/stores')
+}
+# Lectures rafraîchies ensemble par les tableaux de bord, dédoublonnées par
+# CoalescedCache : classe default, pour qu'une rafale ne soit pas délestée
+COALESCED_ROUTES = {
+    ('GET', '/api/orders/stats'),
+    ('GET', '/api/bills/stats'),
+    ('GET', '/api/stock/alerts/low-stock')
+}
+# Sondes et métriques ne doivent jamais être délestées
+EXEMPT_PREFIXES = ('/api/health', '/api/live', '/api/ready', '/api/metrics')
+
+ADMISSION_REJECTIONS = Counter(
+    'coffeeshop_admission_rejections_total',
+    'Requêtes refusées par le contrôle d\'admission',
+    ['route_class', 'reason']
+)
+
+def classify_request(method, rule):
+    """Classe d'une requête d'après sa méthode et sa règle de routage (None = exemptée)"""
+    if rule is None or not rule.startswith('/api/') or rule.startswith(EXEMPT_PREFIXES):
+        return None
+    if (method, rule) in CRITICAL_ROUTES:
+        return 'critical'
+    if (method, rule) in COALESCED_ROUTES:
+        return 'default'
+    if rule.endswith('/stats') or (method, rule) in REPORTING_ROUTES:
+        return 'reporting'
+    return 'default'
+
+class TokenBucketLimiter:
+    """Seaux à jetons par client et par classe de route"""
+
+    def __init__(self, classes=ROUTE_CLASSES, max_clients=ADMISSION_MAX_CLIENTS):
+        self.classes = classes
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, client, route_class):
+        """Retourne 0 si la requête est autorisée, sinon le délai en secondes avant un jeton"""
+        config = self.classes[route_class]
+        if config['rate'] <= 0:
+            return 0
+        now = time.monotonic()
+        key = (client, route_class)
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (config['burst'], now))
+            tokens = min(config['burst'], tokens + (now - updated_at) * config['rate'])
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._evict(now)
+            return (1 - tokens) / config['rate']
+
+    def _evict(self, now):
+        # Un seau plein est équivalent à un seau absent
+        for key, (tokens, updated_at) in list(self._buckets.items()):
+            config = self.classes[key[1]]
+            if tokens + (now - updated_at) * config['rate'] >= config['burst']:
+                del self._buckets[key]
+
+class AdmissionController:
+    """Places d'exécution d'un worker, attribuées par priorité de classe"""
+
+    def __init__(self, classes=ROUTE_CLASSES, max_concurrency=ADMISSION_MAX_CONCURRENCY,
+                 critical_reserve=ADMISSION_CRITICAL_RESERVE):
+        self.classes = classes
+        self.max_concurrency = max_concurrency
+        # Plafond commun des classes non critiques (priorité > 0)
+        self.shared_limit = max(1, max_concurrency - critical_reserve)
+        self.active = {name: 0 for name in classes}
+        self.waiting = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    def _can_run(self, route_class):
+        if sum(self.active.values()) >= self.max_concurrency:
+            return False
+        if self.active[route_class] >= self.classes[route_class]['concurrency']:
+            return False
+        if self.classes[route_class]['priority'] > 0:
+            shared = sum(active for name, active in self.active.items() if self.classes[name]['priority'] > 0)
+            return shared < self.shared_limit
+        return True
+
+    def _threads_left_for_reserve(self, route_class):
+        """Une requête non critique de plus (en cours ou en attente) laisse-t-elle la réserve intacte ?"""
+        if self.classes[route_class]['priority'] == 0:
+            return True
+        shared = sum(active for name, active in self.active.items() if self.classes[name]['priority'] > 0)
+        shared += sum(1 for ticket in self.waiting if ticket[0] > 0)
+        return shared < self.shared_limit
+
+    def _next_waiter(self):
+        eligible = [ticket for ticket in self.waiting if self._can_run(ticket[2])]
+        return min(eligible) if eligible else None
+
+    def acquire(self, route_class):
+        """Réserve une place ; retourne False si la file est pleine ou l'attente trop longue"""
+        config = self.classes[route_class]
+        with self._condition:
+            if self._can_run(route_class) and self._next_waiter() is None:
+                self.active[route_class] += 1
+                return True
+
+            queued = sum(1 for ticket in self.waiting if ticket[2] == route_class)
+            if queued >= config['queue']:
+                return False
+            # Attendre bloquerait un thread de la réserve critique
+            if not self._threads_left_for_reserve(route_class):
+                return False
+
+            self._sequence += 1
+            ticket = (config['priority'], self._sequence, route_class)
+            self.waiting.append(ticket)
+            deadline = time.monotonic() + config['timeout']
+            try:
+                while self._next_waiter() != ticket:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self.active[route_class] += 1
+                return True
+            finally:
+                self.waiting.remove(ticket)
+                # Le départ d'un ticket peut débloquer le suivant
+                self._condition.notify_all()
+
+    def release(self, route_class):
+        with self._condition:
+            self.active[route_class] -= 1
+            self._condition.notify_all()
+
+    def get_status(self):
+        with self._condition:
+            return {
+                'maxConcurrency': self.max_concurrency,
+                'nonCriticalLimit': self.shared_limit,
+                'active': dict(self.active),
+                'waiting': {
+                    name: sum(1 for ticket in self.waiting if ticket[2] == name)
+                    for name in self.classes
+                }
+            }
+
+admission_controller = AdmissionController()
+rate_limiter = TokenBucketLimiter()
+
+def _client_id():
+    # Derrière un proxy, ProxyFix (init_admission) renseigne remote_addr
+    return request.remote_addr or 'unknown'
+
+def _reject(status_code, route_class, reason, error, retry_after):
+    ADMISSION_REJECTIONS.labels(route_class, reason).inc()
+    response = jsonify({
+        'success': False,
+        'error': error
+    })
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def _before_request():
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    route_class = classify_request(request.method, rule)
+    if route_class is None:
+        return None
+
+    retry_after = rate_limiter.consume(_client_id(), route_class)
+    if retry_after:
+        return _reject(429, route_class, 'rate_limited', 'Trop de requêtes, réessayez plus tard', retry_after)
+
+    if not admission_controller.acquire(route_class):
+        logger.warning(f"Requête {request.method} {rule} délestée (classe {route_class})")
+        return _reject(503, route_class, 'overloaded', 'Service surchargé, réessayez plus tard', 1)
+
+    g.admission_class = route_class
+    return None
+
+def _teardown_request(exc):
+    route_class = g.pop('admission_class', None)
+    if route_class is not None:
+        admission_controller.release(route_class)
+
+def init_admission(app):
+    """Active le contrôle d'admission sur l'application Flask"""
+    if not ADMISSION_ENABLED:
+        logger.info("Contrôle d'admission désactivé")
+        return
+    if ADMISSION_TRUSTED_PROXIES > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=ADMISSION_TRUSTED_PROXIES)
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,200 @@
+"""
+Archivage des commandes et additions clôturées (données froides)
+
+Les commandes terminées et les additions payées ou remboursées de plus de
+ARCHIVE_AFTER_DAYS jours sont déplacées de `orders` / `bills` vers
+`orders_archive` / `bills_archive`, créées compressées (zstd). Les
+collections chaudes, leurs index et leurs tris restent ainsi limités au
+travail en cours et tiennent en mémoire ; les services ne lisent l'archive
+que si l'historique est demandé (include_archive=True, ?history=true).
+
+Le déplacement est idempotent : copie (upsert par _id) puis suppression,
+document par document, des seuls documents identiques à leur copie sur les
+champs modifiables (statut, montants). Un document modifié entre-temps
+(remboursement, remise) reste dans la collection chaude, sa copie est
+retirée de l'archive et il est archivé à nouveau avec son contenu à jour.
+
+Planification : ARCHIVE_ENABLED=true démarre un thread par worker ; un bail
+dans `locks` garantit un seul passage par intervalle pour tous les workers.
+Chaque magasin est archivé dans sa propre base, sous son propre bail.
+Usage ponctuel : python -m src.models.archive [--days N] [--dry-run] [--store ID]
+"""
+import os
+import sys
+import argparse
+import threading
+import logging
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, DeleteOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from src.config.database import get_db, db_config, use_store
+from src.config.cache import order_cache, bill_cache
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+# Collection chaude -> (archive, filtre des documents clôturés, champ de date, cache)
+ARCHIVE_RULES = {
+    'orders': ('orders_archive', {'status': 'completed'}, 'orderDate', order_cache),
+    'bills': ('bills_archive', {'paymentStatus': {'$in': ['paid', 'refunded']}}, 'billDate', bill_cache),
+}
+
+# Champs encore modifiables après clôture : la suppression exige qu'ils
+# n'aient pas changé depuis la copie
+ARCHIVE_SNAPSHOT_FIELDS = {
+    'orders': ('status', 'items', 'totalAmount', 'notes'),
+    'bills': ('paymentStatus', 'paymentMethod', 'discount', 'tax', 'totalAmount'),
+}
+
+class DataArchiver:
+    """Déplace les documents clôturés anciens vers les collections d'archive"""
+
+    def __init__(self, after_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+        self.db = get_db()
+        self.after_days = after_days
+        self.batch_size = batch_size
+
+    def candidates_query(self, name, now=None):
+        """Filtre des documents à archiver pour une collection chaude"""
+        _, closed_filter, date_field, _ = ARCHIVE_RULES[name]
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.after_days)
+        return {**closed_filter, date_field: {'$lt': cutoff}}
+
+    def count_candidates(self, name):
+        return self.db[name].count_documents(self.candidates_query(name))
+
+    def archive_collection(self, name):
+        """Archive une collection par lots ; retourne le nombre de documents déplacés"""
+        archive_name, _, date_field, cache = ARCHIVE_RULES[name]
+        hot = self.db[name]
+        archive = self.db[archive_name]
+        query = self.candidates_query(name)
+        moved = 0
+        # Documents modifiés pendant leur déplacement : repris une fois, puis
+        # laissés au passage suivant s'ils changent encore
+        retried, skipped = set(), set()
+
+        while True:
+            documents = list(hot.find(
+                {**query, '_id': {'$nin': list(skipped)}} if skipped else query
+            ).sort(date_field, 1).limit(self.batch_size))
+            if not documents:
+                break
+
+            archived_at = datetime.utcnow()
+            try:
+                archive.bulk_write([
+                    ReplaceOne({'_id': document['_id']}, {**document, 'archivedAt': archived_at}, upsert=True)
+                    for document in documents
+                ], ordered=False)
+            except BulkWriteError as e:
+                logger.error(f"Archivage de {name} interrompu: {e.details.get('writeErrors', [])[:3]}")
+                break
+
+            ids = [document['_id'] for document in documents]
+            result = hot.bulk_write([
+                DeleteOne({
+                    '_id': document['_id'],
+                    **query,
+                    **{field: document.get(field) for field in ARCHIVE_SNAPSHOT_FIELDS[name]}
+                })
+                for document in documents
+            ], ordered=False)
+            kept = []
+            if result.deleted_count < len(ids):
+                # Modifiés depuis la lecture : ils restent chauds, leur copie périmée est retirée
+                kept = [document['_id'] for document in hot.find({'_id': {'$in': ids}}, {'_id': 1})]
+                archive.delete_many({'_id': {'$in': kept}})
+            for entity_id in ids:
+                cache.invalidate(entity_id)
+            moved += result.deleted_count
+
+            # Archivés à nouveau, avec leur contenu à jour, à l'itération suivante
+            retry = [entity_id for entity_id in kept if entity_id not in retried]
+            retried.update(retry)
+            skipped.update(entity_id for entity_id in kept if entity_id not in retry)
+            if len(documents) < self.batch_size and not retry:
+                break
+
+        if moved:
+            logger.info(f"{moved} documents de {name} archivés dans {archive_name}")
+        return moved
+
+    def run(self):
+        """Archive toutes les collections chaudes"""
+        return {name: self.archive_collection(name) for name in ARCHIVE_RULES}
+
+    def acquire_lease(self, seconds, owner):
+        """Bail partagé par les workers : un seul passage d'archivage par intervalle"""
+        now = datetime.utcnow()
+        try:
+            self.db.locks.find_one_and_update(
+                {'_id': 'archive', 'until': {'$lt': now}},
+                {'$set': {'until': now + timedelta(seconds=seconds), 'owner': owner}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Bail encore valide, détenu par un autre worker
+            return False
+
+class ArchiveScheduler:
+    """Thread d'archivage périodique"""
+
+    def __init__(self, archiver=None, interval=ARCHIVE_INTERVAL_SECONDS):
+        self.archiver = archiver
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Démarre l'archivage en arrière-plan"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='data-archiver', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Arrête l'archivage"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            archiver = self.archiver or DataArchiver()
+            for store_id in db_config.store_ids():
+                try:
+                    with use_store(store_id):
+                        if archiver.acquire_lease(self.interval * 0.9, f"{os.getpid()}"):
+                            archiver.run()
+                except Exception as e:
+                    logger.error(f"Erreur lors de l'archivage du magasin {store_id}: {e}")
+
+def main(argv=None):
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Archivage des commandes et additions clôturées")
+    parser.add_argument('--days', type=float, default=ARCHIVE_AFTER_DAYS,
+                        help="Âge minimal en jours des documents archivés")
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help="Compte les documents sans les déplacer")
+    parser.add_argument('--store', action='append', dest='stores',
+                        help="Magasin à archiver (répétable ; tous par défaut)")
+    args = parser.parse_args(argv)
+
+    archiver = DataArchiver(after_days=args.days, batch_size=args.batch_size)
+    for store_id in args.stores or db_config.store_ids():
+        with use_store(store_id):
+            if args.dry_run:
+                for name in ARCHIVE_RULES:
+                    print(f"[{store_id}] {name}: {archiver.count_candidates(name)} documents à archiver")
+                continue
+            for name, moved in archiver.run().items():
+                print(f"[{store_id}] {name}: {moved} documents archivés")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,455 @@
+"""
+Point d'entrée ASGI de l'API Coffee Shop
+
+Sert le même contrat que l'application Flask (/api/orders, /api/bills,
+/api/stock) au-dessus des services asynchrones : une requête qui attend
+MongoDB ne bloque pas de thread, et les connexions inactives ne coûtent
+presque rien.
+
+Démarrage : hypercorn src.asgi:app  (ou uvicorn src.asgi:app)
+"""
+import re
+import logging
+from bson import ObjectId
+from bson.errors import InvalidId
+from marshmallow import ValidationError
+from pymongo.errors import DuplicateKeyError
+from quart import Quart, Blueprint, request, jsonify
+from quart_cors import cors
+from src.config.database import db_config
+from src.models.Order import OrderSchema, compute_order_stats
+from src.models.Bill import compute_bill_stats
+from src.models.Inventory import StockSchema, duplicate_key_field
+from src.middleware.validation import CompiledValidator
+from src.models.async_services import (
+    async_db_config, AsyncOrderService, AsyncBillService, AsyncStockService
+)
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+
+stock_service = AsyncStockService()
+order_service = AsyncOrderService(stock_service)
+bill_service = AsyncBillService()
+order_schema = CompiledValidator(OrderSchema())
+stock_schema = CompiledValidator(StockSchema())
+
+orders_bp = Blueprint('orders', __name__, url_prefix='/api/orders')
+bills_bp = Blueprint('bills', __name__, url_prefix='/api/bills')
+stock_bp = Blueprint('stock', __name__, url_prefix='/api/stock')
+
+def _error(message, status):
+    return jsonify({'success': False, 'error': message}), status
+
+def _order_json(order):
+    order_dict = order.to_dict()
+    order_dict['_id'] = str(order_dict['_id'])
+    return order_dict
+
+def _bill_json(bill):
+    bill_dict = bill.to_dict()
+    bill_dict['_id'] = str(bill_dict['_id'])
+    bill_dict['orderId'] = str(bill_dict['orderId'])
+    return bill_dict
+
+# === Commandes ===
+
+@orders_bp.route('/', methods=['GET'])
+async def get_all_orders():
+    """Récupère toutes les commandes avec filtrage optionnel"""
+    try:
+        status = request.args.get('status')
+        limit = int(request.args.get('limit', 50))
+        orders = await order_service.get_all_orders(status=status, limit=limit)
+        orders_data = [_order_json(order) for order in orders]
+        return jsonify({'success': True, 'data': orders_data, 'count': len(orders_data)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des commandes: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@orders_bp.route('/stats', methods=['GET'])
+async def get_order_stats():
+    """Récupère les statistiques des commandes"""
+    try:
+        all_orders = await order_service.get_all_orders(limit=1000)
+        return jsonify({'success': True, 'data': compute_order_stats(all_orders)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors du calcul des statistiques: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@orders_bp.route('/<order_id>', methods=['GET'])
+async def get_order_by_id(order_id):
+    """Récupère une commande par son ID"""
+    if not ObjectId.is_valid(order_id):
+        return _error('ID de commande invalide', 400)
+    try:
+        order = await order_service.get_order_by_id(order_id)
+        if not order:
+            return _error('Commande non trouvée', 404)
+        return jsonify({'success': True, 'data': _order_json(order)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération de la commande {order_id}: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@orders_bp.route('/number/<order_number>', methods=['GET'])
+async def get_order_by_number(order_number):
+    """Récupère une commande par son numéro"""
+    try:
+        order = await order_service.get_order_by_number(order_number)
+        if not order:
+            return _error('Commande non trouvée', 404)
+        return jsonify({'success': True, 'data': _order_json(order)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération de la commande {order_number}: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@orders_bp.route('/', methods=['POST'])
+async def create_order():
+    """Crée une nouvelle commande"""
+    try:
+        try:
+            order_data = order_schema.load(await request.get_json())
+        except ValidationError as err:
+            return jsonify({'success': False, 'error': 'Données invalides', 'details': err.messages}), 400
+
+        order = await order_service.create_order(order_data)
+        return jsonify({
+            'success': True,
+            'message': 'Commande créée avec succès',
+            'data': _order_json(order)
+        }), 201
+    except ValueError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        logger.error(f"Erreur lors de la création de la commande: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@orders_bp.route('/<order_id>/status', methods=['PUT'])
+async def update_order_status(order_id):
+    """Met à jour le statut d'une commande"""
+    if not ObjectId.is_valid(order_id):
+        return _error('ID de commande invalide', 400)
+    try:
+        data = await request.get_json()
+        new_status = data.get('status')
+        if not new_status:
+            return _error('Statut requis', 400)
+
+        if not await order_service.update_order_status(order_id, new_status):
+            return _error('Impossible de mettre à jour le statut', 400)
+        return jsonify({'success': True, 'message': 'Statut mis à jour avec succès'}), 200
+    except ValueError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        logger.error(f"Erreur lors de la mise à jour du statut: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@orders_bp.route('/<order_id>', methods=['DELETE'])
+async def delete_order(order_id):
+    """Supprime une commande"""
+    if not ObjectId.is_valid(order_id):
+        return _error('ID de commande invalide', 400)
+    try:
+        order = await order_service.get_order_by_id(order_id)
+        if not order:
+            return _error('Commande non trouvée', 404)
+        if order.status != 'pending':
+            return _error('Seules les commandes en attente peuvent être supprimées', 400)
+        if not await order_service.delete_order(order_id):
+            return _error('Impossible de supprimer la commande', 400)
+        return jsonify({'success': True, 'message': 'Commande supprimée avec succès'}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la suppression de la commande: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+# === Additions ===
+
+@bills_bp.route('/', methods=['GET'])
+async def get_all_bills():
+    """Récupère toutes les additions avec filtrage optionnel"""
+    try:
+        payment_status = request.args.get('paymentStatus')
+        limit = int(request.args.get('limit', 50))
+        bills = await bill_service.get_all_bills(payment_status=payment_status, limit=limit)
+        bills_data = [_bill_json(bill) for bill in bills]
+        return jsonify({'success': True, 'data': bills_data, 'count': len(bills_data)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des additions: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@bills_bp.route('/stats', methods=['GET'])
+async def get_bill_stats():
+    """Récupère les statistiques des additions"""
+    try:
+        all_bills = await bill_service.get_all_bills(limit=1000)
+        return jsonify({'success': True, 'data': compute_bill_stats(all_bills)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors du calcul des statistiques: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@bills_bp.route('/<bill_id>', methods=['GET'])
+async def get_bill_by_id(bill_id):
+    """Récupère une addition par son ID"""
+    if not ObjectId.is_valid(bill_id):
+        return _error('ID d\'addition invalide', 400)
+    try:
+        bill = await bill_service.get_bill_by_id(bill_id)
+        if not bill:
+            return _error('Addition non trouvée', 404)
+        return jsonify({'success': True, 'data': _bill_json(bill)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération de l'addition {bill_id}: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@bills_bp.route('/number/<bill_number>', methods=['GET'])
+async def get_bill_by_number(bill_number):
+    """Récupère une addition par son numéro"""
+    try:
+        bill = await bill_service.get_bill_by_number(bill_number)
+        if not bill:
+            return _error('Addition non trouvée', 404)
+        return jsonify({'success': True, 'data': _bill_json(bill)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération de l'addition {bill_number}: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@bills_bp.route('/order/<order_id>', methods=['GET'])
+async def get_bills_by_order(order_id):
+    """Récupère toutes les additions d'une commande"""
+    if not ObjectId.is_valid(order_id):
+        return _error('ID de commande invalide', 400)
+    try:
+        bills = await bill_service.get_bills_by_order(order_id)
+        bills_data = [_bill_json(bill) for bill in bills]
+        return jsonify({'success': True, 'data': bills_data, 'count': len(bills_data)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des additions pour la commande {order_id}: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@bills_bp.route('/from-order/<order_id>', methods=['POST'])
+async def create_bill_from_order(order_id):
+    """Crée une addition à partir d'une commande"""
+    if not ObjectId.is_valid(order_id):
+        return _error('ID de commande invalide', 400)
+    try:
+        order = await order_service.get_order_by_id(order_id)
+        if not order:
+            return _error('Commande non trouvée', 404)
+        if order.status not in ['ready', 'completed']:
+            return _error('La commande doit être prête ou terminée pour générer une addition', 400)
+
+        data = await request.get_json(silent=True) or {}
+        bill = await bill_service.create_bill_from_order(order, data.get('cashier', ''))
+        return jsonify({
+            'success': True,
+            'message': 'Addition créée avec succès',
+            'data': _bill_json(bill)
+        }), 201
+    except Exception as e:
+        logger.error(f"Erreur lors de la création de l'addition: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@bills_bp.route('/<bill_id>/payment', methods=['PUT'])
+async def update_payment_status(bill_id):
+    """Met à jour le statut de paiement d'une addition"""
+    if not ObjectId.is_valid(bill_id):
+        return _error('ID d\'addition invalide', 400)
+    try:
+        data = await request.get_json()
+        payment_status = data.get('paymentStatus')
+        if not payment_status:
+            return _error('Statut de paiement requis', 400)
+
+        if not await bill_service.update_payment_status(bill_id, payment_status, data.get('paymentMethod')):
+            return _error('Impossible de mettre à jour le statut de paiement', 400)
+        return jsonify({'success': True, 'message': 'Statut de paiement mis à jour avec succès'}), 200
+    except ValueError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        logger.error(f"Erreur lors de la mise à jour du paiement: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@bills_bp.route('/<bill_id>/discount', methods=['PUT'])
+async def apply_discount(bill_id):
+    """Applique une remise à une addition"""
+    if not ObjectId.is_valid(bill_id):
+        return _error('ID d\'addition invalide', 400)
+    try:
+        data = await request.get_json()
+        discount_amount = data.get('discountAmount')
+        if discount_amount is None or discount_amount < 0:
+            return _error('Montant de remise invalide', 400)
+
+        if not await bill_service.apply_discount_to_bill(bill_id, discount_amount):
+            return _error('Impossible d\'appliquer la remise', 400)
+
+        bill = await bill_service.get_bill_by_id(bill_id)
+        return jsonify({
+            'success': True,
+            'message': 'Remise appliquée avec succès',
+            'data': _bill_json(bill)
+        }), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de l'application de la remise: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+@bills_bp.route('/<bill_id>', methods=['DELETE'])
+async def delete_bill(bill_id):
+    """Supprime une addition (seulement si non payée)"""
+    if not ObjectId.is_valid(bill_id):
+        return _error('ID d\'addition invalide', 400)
+    try:
+        if not await bill_service.delete_bill(bill_id):
+            return _error('Impossible de supprimer l\'addition (peut-être déjà payée)', 400)
+        return jsonify({'success': True, 'message': 'Addition supprimée avec succès'}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la suppression de l'addition: {e}")
+        return _error('Erreur interne du serveur', 500)
+
+# === Stock ===
+
+@stock_bp.route('/', methods=['GET'])
+async def get_all_stock():
+    """Récupère tous les produits en stock avec filtres optionnels"""
+    try:
+        category = request.args.get('category')
+        status = request.args.get('status')
+        search = request.args.get('search')
+        page = int(request.args.get('page', 1))
+        limit = int(request.args.get('limit', 20))
+
+        filters = {}
+        if category:
+            filters['category'] = category
+        if status:
+            filters['status'] = status
+        if search:
+            filters['$or'] = [
+                {'name': {'$regex': re.escape(search), '$options': 'i'}},
+                {'description': {'$regex': re.escape(search), '$options': 'i'}}
+            ]
+
+        products = await stock_service.get_all_stock(filters, page, limit)
+        return jsonify({
+            'success': True,
+            'data': [product.to_dict() for product in products],
+            'pagination': {
+                'page': page,
+                'limit': limit,
+                'total': await stock_service.count_stock(filters)
+            }
+        }), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération du stock: {e}")
+        return _error('Erreur lors de la récupération du stock', 500)
+
+@stock_bp.route('/alerts/low-stock', methods=['GET'])
+async def get_low_stock_alerts():
+    """Récupère les alertes de stock faible"""
+    try:
+        alerts = await stock_service.get_low_stock_alerts()
+        return jsonify({'success': True, 'data': [alert.to_dict() for alert in alerts], 'count': len(alerts)}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des alertes: {e}")
+        return _error('Erreur lors de la récupération des alertes', 500)
+
+@stock_bp.route('/categories', methods=['GET'])
+async def get_categories():
+    """Récupère toutes les catégories de produits"""
+    try:
+        return jsonify({'success': True, 'data': await stock_service.get_categories()}), 200
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des catégories: {e}")
+        return _error('Erreur lors de la récupération des catégories', 500)
+
+@stock_bp.route('/<product_id>', methods=['GET'])
+async def get_stock_by_id(product_id):
+    """Récupère un produit par son ID"""
+    try:
+        product = await stock_service.get_stock_by_id(product_id)
+        if not product:
+            return _error('Produit non trouvé', 404)
+        return jsonify({'success': True, 'data': product.to_dict()}), 200
+    except InvalidId:
+        return _error('ID de produit invalide', 400)
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération du produit {product_id}: {e}")
+        return _error('Erreur lors de la récupération du produit', 500)
+
+@stock_bp.route('/', methods=['POST'])
+async def create_stock():
+    """Crée un nouveau produit en stock"""
+    try:
+        data = stock_schema.load(await request.get_json())
+        product = await stock_service.create_stock(data)
+        return jsonify({'success': True, 'message': 'Produit créé avec succès', 'data': product.to_dict()}), 201
+    except ValidationError as e:
+        return jsonify({'success': False, 'error': 'Données invalides', 'details': e.messages}), 400
+    except DuplicateKeyError as e:
+        return _error(f"Un produit existe déjà avec ce {duplicate_key_field(e) or 'name'}", 409)
+    except Exception as e:
+        logger.error(f"Erreur lors de la création du produit: {e}")
+        return _error('Erreur lors de la création du produit', 500)
+
+@stock_bp.route('/<product_id>', methods=['PUT'])
+async def update_stock(product_id):
+    """Met à jour un produit"""
+    try:
+        data = stock_schema.load(await request.get_json(), partial=True)
+        product = await stock_service.update_stock(product_id, data)
+        if not product:
+            return _error('Produit non trouvé', 404)
+        return jsonify({'success': True, 'message': 'Produit mis à jour avec succès', 'data': product.to_dict()}), 200
+    except ValidationError as e:
+        return jsonify({'success': False, 'error': 'Données invalides', 'details': e.messages}), 400
+    except InvalidId:
+        return _error('ID de produit invalide', 400)
+    except DuplicateKeyError as e:
+        return _error(f"Un produit existe déjà avec ce {duplicate_key_field(e) or 'name'}", 409)
+    except Exception as e:
+        logger.error(f"Erreur lors de la mise à jour du produit {product_id}: {e}")
+        return _error('Erreur lors de la mise à jour du produit', 500)
+
+@stock_bp.route('/<product_id>', methods=['DELETE'])
+async def delete_stock(product_id):
+    """Supprime un produit"""
+    try:
+        if not await stock_service.delete_stock(product_id):
+            return _error('Produit non trouvé', 404)
+        return jsonify({'success': True, 'message': 'Produit supprimé avec succès'}), 200
+    except InvalidId:
+        return _error('ID de produit invalide', 400)
+    except Exception as e:
+        logger.error(f"Erreur lors de la suppression du produit {product_id}: {e}")
+        return _error('Erreur lors de la suppression du produit', 500)
+
+app.register_blueprint(orders_bp)
+app.register_blueprint(bills_bp)
+app.register_blueprint(stock_bp)
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """Endpoint de vérification de santé de l'API"""
+    try:
+        await async_db_config.get_database().command('ping')
+        return jsonify({
+            'success': True,
+            'message': 'API Coffee Shop opérationnelle',
+            'database': 'MongoDB connecté',
+            'version': '1.0.0'
+        }), 200
+    except Exception as e:
+        logger.error(f"Erreur de santé de l'API: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Problème de connexion à la base de données',
+            'error': str(e)
+        }), 500
+
+@app.after_serving
+async def close_database():
+    """Ferme le client asynchrone à l'arrêt du serveur"""
+    async_db_config.close_connection()
+    db_config.close_connection()
@@ -0,0 +1,278 @@
+"""
+Services asynchrones (asyncio + Motor) pour le Coffee Shop CRUD
+
+Équivalents non bloquants d'OrderService, BillService et StockService,
+utilisés par le point d'entrée ASGI. Les modèles (Order, Bill, Stock) et
+leurs règles de calcul sont partagés avec la pile synchrone.
+"""
+import os
+from datetime import datetime
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from src.config.database import db_config
+from src.models.Order import Order, build_order, check_catalog_prices
+from src.models.Bill import Bill, build_bill_from_order
+from src.models.Inventory import Stock, compute_stock_status
+from src.models.StockMovement import (
+    EFFECTIVE_QUANTITY_PROJECTION, pending_deltas_pipeline, effective_quantities, adjustment_movements,
+    sale_movements
+)
+
+class AsyncDatabaseConfig:
+    """Client Motor créé paresseusement, un par processus, avec la configuration de DatabaseConfig"""
+
+    def __init__(self, config):
+        self.config = config
+        self.client = None
+        self.db = None
+        self.pid = None
+
+    def get_database(self):
+        """Retourne la base de données asynchrone du processus courant"""
+        if self.client is None or self.pid != os.getpid():
+            self.client = AsyncIOMotorClient(self.config.MONGO_URI, **self.config.client_options())
+            self.db = self.client[self.config.DATABASE_NAME]
+            self.pid = os.getpid()
+        return self.db
+
+    def close_connection(self):
+        """Ferme le client asynchrone"""
+        if self.client and self.pid == os.getpid():
+            self.client.close()
+        self.client = None
+        self.db = None
+
+# Instance globale de configuration asynchrone
+async_db_config = AsyncDatabaseConfig(db_config)
+
+class AsyncStockService:
+    """Service asynchrone pour le stock"""
+
+    @property
+    def collection(self):
+        return async_db_config.get_database().stock
+
+    async def get_all_stock(self, filters=None, page=1, limit=20):
+        """Récupère les produits avec filtres et pagination"""
+        skip = (page - 1) * limit
+        cursor = self.collection.find(filters or {}).sort("name", 1).skip(skip).limit(limit)
+        return [Stock.from_dict(data) async for data in cursor]
+
+    async def count_stock(self, filters=None):
+        """Compte les produits correspondant aux filtres"""
+        return await self.collection.count_documents(filters or {})
+
+    async def get_stock_by_id(self, product_id):
+        """Récupère un produit par son ID"""
+        data = await self.collection.find_one({"_id": ObjectId(product_id)})
+        return Stock.from_dict(data) if data else None
+
+    async def create_stock(self, stock_data):
+        """Crée un nouveau produit en stock"""
+        product = Stock(
+            product_id=stock_data["productId"],
+            name=stock_data["name"],
+            category=stock_data["category"],
+            quantity=stock_data.get("quantity", 0),
+            unit=stock_data.get("unit", "unit"),
+            min_quantity=stock_data.get("minQuantity", 0),
+            price=stock_data.get("price", 0),
+            description=stock_data.get("description", ""),
+            supplier=stock_data.get("supplier", "")
+        )
+        result = await self.collection.insert_one(product.to_document())
+        product._id = result.inserted_id
+        return product
+
+    @property
+    def movements(self):
+        return async_db_config.get_database().stock_movements
+
+    async def update_stock(self, product_id, stock_data):
+        """Met à jour un produit ; une nouvelle quantité devient un ajustement du journal"""
+        update_data = dict(stock_data)
+        quantity = update_data.pop("quantity", None)
+        update_data["lastUpdated"] = datetime.utcnow()
+        result = await self.collection.update_one({"_id": ObjectId(product_id)}, {"$set": update_data})
+        if result.matched_count == 0:
+            return None
+
+        # Même calcul que StockMovementService : quantité à jour = compactée + mouvements en attente
+        data = await self.collection.find_one(
+            {"_id": ObjectId(product_id)}, {**EFFECTIVE_QUANTITY_PROJECTION, "productId": 1}
+        )
+        groups = await self.movements.aggregate(pending_deltas_pipeline([data["_id"]])).to_list(None)
+        quantities = effective_quantities([data], groups)
+        if quantity is not None:
+            movements = adjustment_movements([data], quantities, {data["_id"]: quantity}, "Mise à jour du produit")
+            if movements:
+                await self.movements.insert_many([movement.to_dict() for movement in movements])
+            quantities[data["_id"]] = quantity
+
+        status = compute_stock_status(quantities[data["_id"]], data.get("minQuantity", 0))
+        if status != data.get("status"):
+            await self.collection.update_one(
+                {"_id": data["_id"], "status": data.get("status")}, {"$set": {"status": status}}
+            )
+        return await self.get_stock_by_id(product_id)
+
+    async def delete_stock(self, product_id):
+        """Supprime un produit"""
+        result = await self.collection.delete_one({"_id": ObjectId(product_id)})
+        return result.deleted_count > 0
+
+    async def get_prices(self, names):
+        """Récupère prix et statut d'un ensemble de produits (par nom) en une requête"""
+        cursor = self.collection.find(
+            {"name": {"$in": list(names)}},
+            {"name": 1, "price": 1, "status": 1, "productId": 1}
+        )
+        return {data["name"]: data async for data in cursor}
+
+    async def get_low_stock_alerts(self):
+        """Récupère les produits en stock faible ou en rupture"""
+        cursor = self.collection.find(
+            {"status": {"$in": ["low_stock", "out_of_stock"]}}
+        ).sort("quantity", 1)
+        return [Stock.from_dict(data) async for data in cursor]
+
+    async def get_categories(self):
+        """Récupère la liste des catégories utilisées"""
+        return sorted(await self.collection.distinct("category"))
+
+class AsyncOrderService:
+    """Service asynchrone pour les commandes"""
+
+    def __init__(self, stock_service=None):
+        self.stock_service = stock_service or AsyncStockService()
+
+    @property
+    def collection(self):
+        return async_db_config.get_database().orders
+
+    async def create_order(self, order_data):
+        """Crée une nouvelle commande (prix issus du catalogue, pas du client)"""
+        names = {item["productName"] for item in order_data.get("items", [])}
+        catalog = await self.stock_service.get_prices(names)
+        prices = check_catalog_prices(names, catalog)
+        order = build_order(order_data, prices)
+
+        result = await self.collection.insert_one(order.to_dict())
+        order._id = result.inserted_id
+
+        # Ventes au journal de stock (statut recalculé à la compaction par la pile synchrone)
+        movements = sale_movements(order.items, catalog, reference=order.order_number)
+        for movement in movements:
+            movement.order_id = order._id
+        if movements:
+            await self.stock_service.movements.insert_many([movement.to_dict() for movement in movements])
+        return order
+
+    async def get_order_by_id(self, order_id):
+        """Récupère une commande par son ID"""
+        data = await self.collection.find_one({"_id": ObjectId(order_id)})
+        return Order.from_dict(data) if data else None
+
+    async def get_order_by_number(self, order_number):
+        """Récupère une commande par son numéro"""
+        data = await self.collection.find_one({"orderNumber": order_number})
+        return Order.from_dict(data) if data else None
+
+    async def get_all_orders(self, status=None, limit=50):
+        """Récupère toutes les commandes avec filtrage optionnel"""
+        query = {"status": status} if status else {}
+        cursor = self.collection.find(query).sort("orderDate", -1).limit(limit)
+        return [Order.from_dict(data) async for data in cursor]
+
+    async def update_order_status(self, order_id, new_status):
+        """Met à jour le statut d'une commande"""
+        valid_statuses = ["pending", "preparing", "ready", "completed"]
+        if new_status not in valid_statuses:
+            raise ValueError(f"Statut invalide: {new_status}")
+
+        result = await self.collection.update_one(
+            {"_id": ObjectId(order_id)},
+            {"$set": {"status": new_status}}
+        )
+        return result.modified_count > 0
+
+    async def delete_order(self, order_id):
+        """Supprime une commande encore en attente"""
+        result = await self.collection.delete_one({"_id": ObjectId(order_id), "status": "pending"})
+        return result.deleted_count > 0
+
+class AsyncBillService:
+    """Service asynchrone pour les additions"""
+
+    @property
+    def collection(self):
+        return async_db_config.get_database().bills
+
+    async def create_bill_from_order(self, order, cashier=""):
+        """Crée une addition à partir d'une commande"""
+        bill = build_bill_from_order(order, cashier)
+        result = await self.collection.insert_one(bill.to_dict())
+        bill._id = result.inserted_id
+        return bill
+
+    async def get_bill_by_id(self, bill_id):
+        """Récupère une addition par son ID"""
+        data = await self.collection.find_one({"_id": ObjectId(bill_id)})
+        return Bill.from_dict(data) if data else None
+
+    async def get_bill_by_number(self, bill_number):
+        """Récupère une addition par son numéro"""
+        data = await self.collection.find_one({"billNumber": bill_number})
+        return Bill.from_dict(data) if data else None
+
+    async def get_bills_by_order(self, order_id):
+        """Récupère toutes les additions d'une commande"""
+        cursor = self.collection.find({"orderId": ObjectId(order_id)})
+        return [Bill.from_dict(data) async for data in cursor]
+
+    async def get_all_bills(self, payment_status=None, limit=50):
+        """Récupère toutes les additions avec filtrage optionnel"""
+        query = {"paymentStatus": payment_status} if payment_status else {}
+        cursor = self.collection.find(query).sort("billDate", -1).limit(limit)
+        return [Bill.from_dict(data) async for data in cursor]
+
+    async def update_payment_status(self, bill_id, payment_status, payment_method=None):
+        """Met à jour le statut de paiement d'une addition"""
+        valid_statuses = ["pending", "paid", "refunded"]
+        if payment_status not in valid_statuses:
+            raise ValueError(f"Statut de paiement invalide: {payment_status}")
+
+        update_data = {"paymentStatus": payment_status}
+        if payment_method:
+            update_data["paymentMethod"] = payment_method
+
+        result = await self.collection.update_one(
+            {"_id": ObjectId(bill_id)},
+            {"$set": update_data}
+        )
+        return result.modified_count > 0
+
+    async def apply_discount_to_bill(self, bill_id, discount_amount):
+        """Applique une remise à une addition"""
+        bill = await self.get_bill_by_id(bill_id)
+        if not bill:
+            return False
+
+        bill.apply_discount(discount_amount)
+        result = await self.collection.update_one(
+            {"_id": ObjectId(bill_id)},
+            {"$set": {
+                "discount": bill.discount,
+                "tax": bill.tax,
+                "totalAmount": bill.total_amount
+            }}
+        )
+        return result.modified_count > 0
+
+    async def delete_bill(self, bill_id):
+        """Supprime une addition (seulement si non payée)"""
+        bill = await self.get_bill_by_id(bill_id)
+        if bill and bill.payment_status == "pending":
+            result = await self.collection.delete_one({"_id": ObjectId(bill_id)})
+            return result.deleted_count > 0
+        return False
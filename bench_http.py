@@ -0,0 +1,369 @@
+"""
+Benchmark de charge HTTP reproductible de l'API Coffee Shop
+
+Démarre l'API (serveur de production) sur une base dédiée d'un mongod local,
+injecte un catalogue réaliste puis joue une charge mixte à concurrence
+contrôlée : création de commandes, changements de statut, listes et
+statistiques, création et paiement d'additions, recherche dans le stock.
+
+Rapporte le débit et les latences p50/p95/p99 par endpoint, et échoue si
+les résultats régressent au-delà de la tolérance par rapport à la
+référence enregistrée.
+
+Usage :
+    python -m src.bench_http --duration 30 --concurrency 16
+    python -m src.bench_http --update-baseline
+    python -m src.bench_http --url http://127.0.0.1:5000   (API déjà lancée)
+
+Avec --url, l'API doit être lancée avec des limites de débit par client
+suffisantes (voir BENCH_ADMISSION_LIMITS), sinon la charge reçoit des 429.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+from pymongo import MongoClient
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+# Catalogue injecté avant la charge
+SEED_PRODUCTS = [
+    ("ESP-001", "Espresso", "coffee", 2.0), ("DBL-001", "Double Espresso", "coffee", 2.8),
+    ("AME-001", "Americano", "coffee", 2.5), ("LAT-001", "Latte", "coffee", 3.8),
+    ("CAP-001", "Cappuccino", "coffee", 3.5), ("MOC-001", "Mocha", "coffee", 4.2),
+    ("FLW-001", "Flat White", "coffee", 3.9), ("CRO-001", "Croissant", "pastry", 1.8),
+    ("PAC-001", "Pain au chocolat", "pastry", 2.0), ("MUF-001", "Muffin myrtille", "pastry", 2.6),
+    ("COO-001", "Cookie", "pastry", 1.9), ("CHE-001", "Cheesecake", "pastry", 4.5),
+]
+
+# Poids de chaque opération dans la charge mixte
+WORKLOAD = {
+    'create_order': 25,
+    'update_status': 25,
+    'list_orders': 10,
+    'order_stats': 5,
+    'create_bill': 10,
+    'pay_bill': 10,
+    'bill_stats': 5,
+    'stock_search': 10,
+}
+
+ORDER_STATUS_FLOW = ['pending', 'preparing', 'ready', 'completed']
+
+def percentile(sorted_values, fraction):
+    """Percentile par rang le plus proche sur une liste triée"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+class WorkloadState:
+    """Commandes et additions créées pendant la charge, partagées entre les clients"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.orders = {status: [] for status in ORDER_STATUS_FLOW}
+        self.pending_bills = []
+
+    def push_order(self, order_id, status):
+        with self.lock:
+            self.orders[status].append(order_id)
+
+    def pop_order(self, statuses, rng):
+        with self.lock:
+            candidates = [s for s in statuses if self.orders[s]]
+            if not candidates:
+                return None, None
+            status = rng.choice(candidates)
+            queue = self.orders[status]
+            return queue.pop(rng.randrange(len(queue))), status
+
+    def push_bill(self, bill_id):
+        with self.lock:
+            self.pending_bills.append(bill_id)
+
+    def pop_bill(self, rng):
+        with self.lock:
+            if not self.pending_bills:
+                return None
+            return self.pending_bills.pop(rng.randrange(len(self.pending_bills)))
+
+class LoadClient(threading.Thread):
+    """Client HTTP keep-alive qui tire des opérations selon les poids de la charge"""
+
+    def __init__(self, base_url, state, seed, deadline, warmup_until, results):
+        super().__init__(daemon=True)
+        parsed = urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.state = state
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.warmup_until = warmup_until
+        self.results = results
+        self.operations = list(WORKLOAD)
+        self.weights = [WORKLOAD[name] for name in self.operations]
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        """Envoie une requête et retourne (statut, JSON)"""
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+        return response.status, json.loads(data) if data else None
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            name = self.rng.choices(self.operations, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                status = getattr(self, f"op_{name}")()
+            except Exception:
+                status = 'error'
+            if status is None:
+                # Rien à faire pour cette opération (file vide) : non mesurée
+                continue
+            elapsed = time.perf_counter() - start
+            if time.monotonic() >= self.warmup_until:
+                self.results.append((name, elapsed, status))
+
+    # --- Opérations ---
+
+    def op_create_order(self):
+        items = [
+            {'productName': product[1], 'quantity': self.rng.randint(1, 3)}
+            for product in self.rng.sample(SEED_PRODUCTS, self.rng.randint(1, 4))
+        ]
+        status, data = self.request('POST', '/api/orders/', {
+            'customerName': f"Client {self.rng.randint(1, 500)}",
+            'items': items
+        })
+        if status == 201:
+            self.state.push_order(data['data']['_id'], 'pending')
+        return status
+
+    def op_update_status(self):
+        order_id, current = self.state.pop_order(ORDER_STATUS_FLOW[:-1], self.rng)
+        if order_id is None:
+            return None
+        next_status = ORDER_STATUS_FLOW[ORDER_STATUS_FLOW.index(current) + 1]
+        status, _ = self.request('PUT', f'/api/orders/{order_id}/status', {'status': next_status})
+        self.state.push_order(order_id, next_status if status == 200 else current)
+        return status
+
+    def op_list_orders(self):
+        return self.request('GET', '/api/orders/?limit=50')[0]
+
+    def op_order_stats(self):
+        return self.request('GET', '/api/orders/stats')[0]
+
+    def op_create_bill(self):
+        order_id, current = self.state.pop_order(['ready', 'completed'], self.rng)
+        if order_id is None:
+            return None
+        status, data = self.request('POST', f'/api/bills/from-order/{order_id}', {'cashier': 'bench'})
+        if status == 201:
+            self.state.push_bill(data['data']['_id'])
+        return status
+
+    def op_pay_bill(self):
+        bill_id = self.state.pop_bill(self.rng)
+        if bill_id is None:
+            return None
+        return self.request('PUT', f'/api/bills/{bill_id}/payment', {
+            'paymentStatus': 'paid',
+            'paymentMethod': self.rng.choice(['cash', 'card', 'mobile'])
+        })[0]
+
+    def op_bill_stats(self):
+        return self.request('GET', '/api/bills/stats')[0]
+
+    def op_stock_search(self):
+        term = self.rng.choice(['esp', 'lat', 'cro', 'moc', 'che'])
+        return self.request('GET', f'/api/stock/?search={term}&limit=20')[0]
+
+def seed_database(mongo_uri, database_name):
+    """Réinitialise la base de benchmark et injecte le catalogue"""
+    client = MongoClient(mongo_uri)
+    client.drop_database(database_name)
+    db = client[database_name]
+    db.stock.insert_many([
+        {
+            'productId': product_id, 'name': name, 'description': f"{name} maison",
+            'category': category, 'quantity': 10000, 'unit': 'unit', 'minQuantity': 50,
+            'price': price, 'supplier': 'bench', 'status': 'available'
+        } for product_id, name, category, price in SEED_PRODUCTS
+    ])
+    client.close()
+
+# Tous les clients partagent 127.0.0.1 : sans ces limites, le seau à jetons
+# par client du contrôle d'admission refuserait la charge en 429
+BENCH_ADMISSION_LIMITS = {
+    f"ADMISSION_{route_class}_{setting}": '100000'
+    for route_class in ('CRITICAL', 'DEFAULT', 'REPORTING')
+    for setting in ('RATE', 'BURST')
+}
+
+def start_server(port, mongo_uri, database_name, workers):
+    """Lance le serveur de production sur la base de benchmark"""
+    env = dict(os.environ)
+    env.update({
+        'MONGO_URI': mongo_uri,
+        'DATABASE_NAME': database_name,
+        'PORT': str(port),
+        'WEB_WORKERS': str(workers),
+        'INIT_INDEXES': 'startup',
+        'APP_WARMUP': 'true'
+    })
+    env.update(BENCH_ADMISSION_LIMITS)
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, '-m', 'src.server'], cwd=project_root, env=env)
+
+def wait_until_ready(base_url, timeout=60):
+    """Attend que /api/health réponde 200"""
+    parsed = urlparse(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=2)
+            connection.request('GET', '/api/health')
+            if connection.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+def summarize(results, duration):
+    """Débit et latences par endpoint (en millisecondes)"""
+    by_operation = {}
+    for name, elapsed, status in results:
+        by_operation.setdefault(name, []).append((elapsed, status))
+
+    summary = {}
+    for name, samples in sorted(by_operation.items()):
+        latencies = sorted(elapsed * 1000 for elapsed, _ in samples)
+        errors = sum(1 for _, status in samples if status == 'error' or status >= 500)
+        summary[name] = {
+            'requests': len(samples),
+            'throughput': round(len(samples) / duration, 2),
+            'errors': errors,
+            'p50': round(percentile(latencies, 0.50), 2),
+            'p95': round(percentile(latencies, 0.95), 2),
+            'p99': round(percentile(latencies, 0.99), 2),
+        }
+    return summary
+
+def compare_to_baseline(summary, baseline, tolerance):
+    """Liste les régressions de latence (p95, p99) ou de débit au-delà de la tolérance"""
+    regressions = []
+    for name, reference in baseline.get('endpoints', {}).items():
+        current = summary.get(name)
+        if current is None:
+            regressions.append(f"{name}: absent de la mesure")
+            continue
+        for metric in ('p95', 'p99'):
+            if current[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {current[metric]} ms > {reference[metric]} ms")
+        if current['throughput'] < reference['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: débit {current['throughput']}/s < {reference['throughput']}/s")
+        if current['errors'] > 0:
+            regressions.append(f"{name}: {current['errors']} erreurs")
+    return regressions
+
+def main(argv=None):
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Benchmark de charge HTTP de l'API Coffee Shop")
+    parser.add_argument('--url', help="API déjà démarrée (sinon lancée sur --port)")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--workers', type=int, default=2, help="Workers du serveur lancé")
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--database', default='coffee_shop_bench')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help="Durée mesurée en secondes")
+    parser.add_argument('--warmup', type=float, default=5, help="Préchauffage non mesuré en secondes")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.20, help="Régression tolérée (0.20 = 20%%)")
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', help="Écrit le rapport JSON dans ce fichier")
+    args = parser.parse_args(argv)
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        seed_database(args.mongo_uri, args.database)
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = start_server(args.port, args.mongo_uri, args.database, args.workers)
+
+    try:
+        if not wait_until_ready(base_url):
+            print("L'API n'a pas démarré à temps", file=sys.stderr)
+            return 2
+
+        results = []
+        start = time.monotonic()
+        warmup_until = start + args.warmup
+        deadline = warmup_until + args.duration
+        state = WorkloadState()
+        clients = [
+            LoadClient(base_url, state, args.seed + index, deadline, warmup_until, results)
+            for index in range(args.concurrency)
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    summary = summarize(results, args.duration)
+    report = {
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'endpoints': summary
+    }
+
+    print(f"{'endpoint':<15}{'req':>8}{'req/s':>10}{'err':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, row in summary.items():
+        print(f"{name:<15}{row['requests']:>8}{row['throughput']:>10}{row['errors']:>6}"
+              f"{row['p50']:>10}{row['p95']:>10}{row['p99']:>10}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Référence enregistrée dans {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("Aucune référence : utilisez --update-baseline pour l'enregistrer")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare_to_baseline(summary, json.load(baseline_file), args.tolerance)
+    for regression in regressions:
+        print(f"RÉGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
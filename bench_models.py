@@ -0,0 +1,215 @@
+"""
+Micro-benchmarks de la couche modèle et de la sérialisation
+
+Mesure, pour 1, 100 et 10 000 documents :
+- Order / Bill : to_dict et from_dict,
+- schémas marshmallow OrderSchema / BillSchema : load,
+- encodage JSON tel que fait par les routes (ObjectId -> str puis jsonify),
+- validation d'une requête POST /api/orders/ : pile de décorateurs de
+  validation.py + OrderSchema.load, contre le validateur compilé.
+
+Aucune base de données n'est nécessaire. Les résultats (µs par document,
+meilleur de plusieurs répétitions) sont comparés à une référence enregistrée
+pour prouver et protéger les optimisations de ces chemins.
+
+Usage :
+    python -m src.bench_models
+    python -m src.bench_models --update-baseline
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+from bson import ObjectId
+from flask import Flask, jsonify, request
+from src.models.Order import Order, OrderItem, OrderSchema
+from src.models.Bill import Bill, BillItem, BillSchema
+from src.middleware.validation import (
+    CompiledValidator, validate_body, validate_json, validate_required_fields, validate_string_length
+)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_models_baseline.json')
+SIZES = [1, 100, 10000]
+
+def make_order(index):
+    """Commande représentative (3 items, personnalisations)"""
+    return Order(
+        customer_name=f"Client {index}",
+        items=[
+            OrderItem("Latte", 2, 3.8, ["lait d'avoine"]),
+            OrderItem("Croissant", 1, 1.8),
+            OrderItem("Espresso", 1, 2.0, ["serré"]),
+        ],
+        notes="À emporter"
+    )
+
+def make_bill(order):
+    """Addition correspondant à une commande"""
+    return Bill(
+        order_id=order._id,
+        customer_name=order.customer_name,
+        items=[BillItem(item.product_name, item.quantity, item.price) for item in order.items],
+        cashier="bench"
+    )
+
+def order_payload(index):
+    """Corps de requête POST /api/orders/"""
+    return {
+        'customerName': f"Client {index}",
+        'items': [
+            {'productName': 'Latte', 'quantity': 2, 'customizations': ["lait d'avoine"]},
+            {'productName': 'Croissant', 'quantity': 1},
+        ],
+        'notes': 'À emporter'
+    }
+
+def bill_payload(index):
+    """Données validées par BillSchema"""
+    return {
+        'orderId': str(ObjectId()),
+        'customerName': f"Client {index}",
+        'items': [
+            {'productName': 'Latte', 'quantity': 2, 'unitPrice': 3.8},
+            {'productName': 'Croissant', 'quantity': 1, 'unitPrice': 1.8},
+        ],
+        'cashier': 'bench',
+        'paymentMethod': 'card'
+    }
+
+def build_cases(size):
+    """Fonctions à mesurer pour une taille de lot donnée"""
+    orders = [make_order(i) for i in range(size)]
+    bills = [make_bill(order) for order in orders]
+    order_docs = [order.to_dict() for order in orders]
+    bill_docs = [bill.to_dict() for bill in bills]
+    order_payloads = [order_payload(i) for i in range(size)]
+    bill_payloads = [bill_payload(i) for i in range(size)]
+    order_schema = OrderSchema()
+    bill_schema = BillSchema()
+    order_validator = CompiledValidator(order_schema)
+    app = Flask(__name__)
+
+    @validate_json
+    @validate_required_fields(['customerName', 'items'])
+    @validate_string_length('customerName', min_length=1)
+    def decorated_route():
+        return order_schema.load(request.get_json())
+
+    @validate_body(order_validator)
+    def compiled_route():
+        return None
+
+    def validate_requests(route):
+        for payload in order_payloads:
+            with app.test_request_context('/api/orders/', method='POST', json=payload):
+                route()
+
+    def encode_orders():
+        # Même travail que GET /api/orders/ une fois les commandes chargées
+        with app.app_context():
+            orders_data = []
+            for order in orders:
+                order_dict = order.to_dict()
+                order_dict['_id'] = str(order_dict['_id'])
+                orders_data.append(order_dict)
+            jsonify({'success': True, 'data': orders_data, 'count': len(orders_data)}).get_data()
+
+    def encode_bills():
+        with app.app_context():
+            bills_data = []
+            for bill in bills:
+                bill_dict = bill.to_dict()
+                bill_dict['_id'] = str(bill_dict['_id'])
+                bill_dict['orderId'] = str(bill_dict['orderId'])
+                bills_data.append(bill_dict)
+            jsonify({'success': True, 'data': bills_data, 'count': len(bills_data)}).get_data()
+
+    return {
+        'Order.to_dict': lambda: [order.to_dict() for order in orders],
+        'Order.from_dict': lambda: [Order.from_dict(doc) for doc in order_docs],
+        'Bill.to_dict': lambda: [bill.to_dict() for bill in bills],
+        'Bill.from_dict': lambda: [Bill.from_dict(doc) for doc in bill_docs],
+        'OrderSchema.load': lambda: [order_schema.load(payload) for payload in order_payloads],
+        'BillSchema.load': lambda: [bill_schema.load(payload) for payload in bill_payloads],
+        'OrderValidator.load': lambda: [order_validator.load(payload) for payload in order_payloads],
+        'validation.decorators': lambda: validate_requests(decorated_route),
+        'validation.compiled': lambda: validate_requests(compiled_route),
+        'orders.json': encode_orders,
+        'bills.json': encode_bills,
+    }
+
+def measure(function, size, min_time=0.2, repeat=5):
+    """Temps par document en microsecondes (meilleure répétition)"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return best / size * 1e6
+
+def run(sizes=SIZES, selected=None):
+    """Exécute tous les cas et retourne {cas: {taille: µs/document}}"""
+    results = {}
+    for size in sizes:
+        for name, function in build_cases(size).items():
+            if selected and name not in selected:
+                continue
+            results.setdefault(name, {})[str(size)] = round(measure(function, size), 3)
+    return results
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Liste les cas plus lents que la référence au-delà de la tolérance"""
+    regressions = []
+    for name, by_size in baseline.get('results', {}).items():
+        for size, reference in by_size.items():
+            current = results.get(name, {}).get(size)
+            if current is not None and current > reference * (1 + tolerance):
+                regressions.append(f"{name}[{size}]: {current} µs/doc > {reference} µs/doc")
+    return regressions
+
+def main(argv=None):
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Micro-benchmarks des modèles et de la sérialisation")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--case', action='append', help="Limite aux cas nommés (répétable)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Ralentissement toléré (0.25 = 25%%)")
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', help="Écrit les résultats JSON dans ce fichier")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.case)
+
+    header = ''.join(f"{size:>12}" for size in args.sizes)
+    print(f"{'cas (µs/doc)':<20}{header}")
+    for name, by_size in results.items():
+        print(f"{name:<20}" + ''.join(f"{by_size.get(str(size), ''):>12}" for size in args.sizes))
+
+    report = {
+        'python': sys.version.split()[0],
+        'measuredAt': datetime.utcnow().isoformat(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Référence enregistrée dans {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("Aucune référence : utilisez --update-baseline pour l'enregistrer")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+    for regression in regressions:
+        print(f"RÉGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
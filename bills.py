@@ -4,8 +4,15 @@ Routes API pour la gestion des additions
 from flask import Blueprint, request, jsonify
 from marshmallow import ValidationError
 from bson import ObjectId
-from src.models.Bill import BillService, BillSchema
+from src.models.Bill import (
+    BillService, BillFromOrderSchema, BillPaymentSchema, BillDiscountSchema, compute_bill_stats
+)
 from src.models.Order import OrderService
+from src.routes.stock import stock_catalog, movement_service
+from src.config.services import LazyService
+from src.config.cache import CoalescedCache
+from src.config.database import current_store
+from src.middleware.validation import CompiledValidator
 import logging
 
 # Configuration du logging
@@ -14,10 +21,19 @@ logger = logging.getLogger(__name__)
 # Création du blueprint
 bills_bp = Blueprint('bills', __name__, url_prefix='/api/bills')
 
-# Instances des services
-bill_service = BillService()
-order_service = OrderService()
-bill_schema = BillSchema()
+# Instances des services, construites au premier usage
+bill_service = LazyService(BillService)
+# Même construction que les routes des commandes (catalogue en mémoire, journal de stock)
+order_service = LazyService(lambda: OrderService(price_catalog=stock_catalog, movement_service=movement_service))
+from_order_validator = CompiledValidator(BillFromOrderSchema())
+payment_validator = CompiledValidator(BillPaymentSchema())
+discount_validator = CompiledValidator(BillDiscountSchema())
+# Statistiques partagées par les tableaux de bord qui se rafraîchissent ensemble
+stats_cache = CoalescedCache('bills_stats')
+
+def wants_history():
+    """?history=true : inclure les additions archivées"""
+    return request.args.get('history', 'false').lower() == 'true'
 
 @bills_bp.route('/', methods=['GET'])
 def get_all_bills():
@@ -26,7 +42,7 @@ def get_all_bills():
         payment_status = request.args.get('paymentStatus')
         limit = int(request.args.get('limit', 50))
         
-        bills = bill_service.get_all_bills(payment_status=payment_status, limit=limit)
+        bills = bill_service.get_all_bills(payment_status=payment_status, limit=limit, include_archive=wants_history())
         
         bills_data = []
         for bill in bills:
@@ -60,7 +76,7 @@ def get_bill_by_id(bill_id):
                 'error': 'ID d\'addition invalide'
             }), 400
         
-        bill = bill_service.get_bill_by_id(bill_id)
+        bill = bill_service.get_bill_by_id(bill_id, include_archive=wants_history())
         
         if not bill:
             return jsonify({
@@ -88,7 +104,7 @@ def get_bill_by_id(bill_id):
 def get_bill_by_number(bill_number):
     """Récupère une addition par son numéro"""
     try:
-        bill = bill_service.get_bill_by_number(bill_number)
+        bill = bill_service.get_bill_by_number(bill_number, include_archive=wants_history())
         
         if not bill:
             return jsonify({
@@ -123,7 +139,7 @@ def get_bills_by_order(order_id):
                 'error': 'ID de commande invalide'
             }), 400
         
-        bills = bill_service.get_bills_by_order(order_id)
+        bills = bill_service.get_bills_by_order(order_id, include_archive=wants_history())
         
         bills_data = []
         for bill in bills:
@@ -156,8 +172,8 @@ def create_bill_from_order(order_id):
                 'error': 'ID de commande invalide'
             }), 400
         
-        # Récupérer la commande
-        order = order_service.get_order_by_id(order_id)
+        # Récupérer la commande (lecture sans cache)
+        order = order_service.get_order_by_id(order_id, for_update=True)
         if not order:
             return jsonify({
                 'success': False,
@@ -172,8 +188,8 @@ def create_bill_from_order(order_id):
             }), 400
         
         # Récupérer le caissier depuis les données de la requête
-        data = request.get_json() or {}
-        cashier = data.get('cashier', '')
+        data = from_order_validator.load(request.get_json(silent=True) or {})
+        cashier = data['cashier']
         
         # Créer l'addition
         bill = bill_service.create_bill_from_order(order, cashier)
@@ -188,6 +204,12 @@ def create_bill_from_order(order_id):
             'data': bill_dict
         }), 201
         
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': 'Données invalides',
+            'details': e.messages
+        }), 400
     except Exception as e:
         logger.error(f"Erreur lors de la création de l'addition: {e}")
         return jsonify({
@@ -206,16 +228,10 @@ def update_payment_status(bill_id):
                 'error': 'ID d\'addition invalide'
             }), 400
         
-        data = request.get_json()
-        payment_status = data.get('paymentStatus')
+        data = payment_validator.load(request.get_json(silent=True) or {})
+        payment_status = data['paymentStatus']
         payment_method = data.get('paymentMethod')
         
-        if not payment_status:
-            return jsonify({
-                'success': False,
-                'error': 'Statut de paiement requis'
-            }), 400
-        
         # Mettre à jour le statut de paiement
         success = bill_service.update_payment_status(bill_id, payment_status, payment_method)
         
@@ -230,6 +246,12 @@ def update_payment_status(bill_id):
             'message': 'Statut de paiement mis à jour avec succès'
         }), 200
         
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': 'Données invalides',
+            'details': e.messages
+        }), 400
     except ValueError as e:
         return jsonify({
             'success': False,
@@ -253,14 +275,8 @@ def apply_discount(bill_id):
                 'error': 'ID d\'addition invalide'
             }), 400
         
-        data = request.get_json()
-        discount_amount = data.get('discountAmount')
-        
-        if discount_amount is None or discount_amount < 0:
-            return jsonify({
-                'success': False,
-                'error': 'Montant de remise invalide'
-            }), 400
+        data = discount_validator.load(request.get_json(silent=True) or {})
+        discount_amount = data['discountAmount']
         
         # Appliquer la remise
         success = bill_service.apply_discount_to_bill(bill_id, discount_amount)
@@ -283,6 +299,12 @@ def apply_discount(bill_id):
             'data': bill_dict
         }), 200
         
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': 'Données invalides',
+            'details': e.messages
+        }), 400
     except Exception as e:
         logger.error(f"Erreur lors de l'application de la remise: {e}")
         return jsonify({
@@ -326,34 +348,11 @@ def delete_bill(bill_id):
 def get_bill_stats():
     """Récupère les statistiques des additions"""
     try:
-        # Récupérer toutes les additions pour calculer les stats
-        all_bills = bill_service.get_all_bills(limit=1000)
-        
-        stats = {
-            'total': len(all_bills),
-            'pending': len([b for b in all_bills if b.payment_status == 'pending']),
-            'paid': len([b for b in all_bills if b.payment_status == 'paid']),
-            'refunded': len([b for b in all_bills if b.payment_status == 'refunded']),
-            'total_revenue': sum(b.total_amount for b in all_bills if b.payment_status == 'paid'),
-            'total_tax': sum(b.tax for b in all_bills if b.payment_status == 'paid'),
-            'total_discounts': sum(b.discount for b in all_bills),
-            'average_bill_amount': 0
-        }
-        
-        paid_bills = [b for b in all_bills if b.payment_status == 'paid']
-        if len(paid_bills) > 0:
-            stats['average_bill_amount'] = sum(b.total_amount for b in paid_bills) / len(paid_bills)
-        
-        # Statistiques par méthode de paiement
-        payment_methods = {}
-        for bill in paid_bills:
-            method = bill.payment_method or 'unknown'
-            if method not in payment_methods:
-                payment_methods[method] = {'count': 0, 'amount': 0}
-            payment_methods[method]['count'] += 1
-            payment_methods[method]['amount'] += bill.total_amount
-        
-        stats['payment_methods'] = payment_methods
+        # Un seul calcul par magasin pour tous les appels simultanés
+        stats = stats_cache.get(
+            current_store(),
+            lambda: compute_bill_stats(bill_service.get_all_bills(limit=1000))
+        )
         
         return jsonify({
             'success': True,
@@ -0,0 +1,418 @@
+"""
+Caches de lecture de l'API Coffee Shop
+
+Entités
+-------
+Les tickets sont relus sans cesse pendant leur préparation et leur
+paiement : les services passent par un cache read-through (LRU borné avec
+TTL) indexé par ID et par numéro. Les écritures invalident précisément
+l'entrée concernée.
+
+Backends (ENTITY_CACHE_BACKEND) :
+- auto (défaut) : memory avec un seul worker ; avec plusieurs (WEB_WORKERS,
+  exporté par src.server), redis s'il répond, sinon off.
+- memory : propre au processus. Une écriture n'invalide que le worker qui la
+  traite : refusé au démarrage avec plusieurs workers, qui serviraient
+  l'ancienne version jusqu'à ENTITY_CACHE_TTL.
+- redis : partagé par tous les processus (ENTITY_CACHE_REDIS_URL, un Redis
+  local suffit), l'invalidation est visible immédiatement partout.
+- off : désactivé.
+
+Chaque invalidation incrémente une génération tenue par le backend ; un
+document chargé avant une écriture n'est stocké que si la génération n'a pas
+bougé depuis le début du chargement (sous verrou en mémoire, par
+compare-and-set Lua avec Redis).
+
+Lectures coûteuses
+------------------
+Les statistiques et alertes, rafraîchies en même temps par toutes les
+tablettes, passent par CoalescedCache : les appels identiques simultanés
+partagent un seul calcul (single-flight), le résultat est resservi pendant
+READ_CACHE_FRESH_SECONDS, puis encore READ_CACHE_STALE_SECONDS pendant
+qu'un seul rafraîchissement tourne en arrière-plan (stale-while-revalidate).
+"""
+import os
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+import bson
+from prometheus_client import Counter
+from src.config.database import current_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+ENTITY_CACHE_BACKEND = os.getenv('ENTITY_CACHE_BACKEND', 'auto')
+# Nombre de workers qui partagent les données (src.server l'exporte avant de charger l'app)
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv('ENTITY_CACHE_MAX_ENTRIES', '5000'))
+ENTITY_CACHE_TTL = float(os.getenv('ENTITY_CACHE_TTL', '10'))
+ENTITY_CACHE_REDIS_URL = os.getenv('ENTITY_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+READ_CACHE_FRESH_SECONDS = float(os.getenv('READ_CACHE_FRESH_SECONDS', '1'))
+READ_CACHE_STALE_SECONDS = float(os.getenv('READ_CACHE_STALE_SECONDS', '5'))
+
+CACHE_REQUESTS = Counter(
+    'coffeeshop_entity_cache_requests_total',
+    'Lectures du cache des commandes et additions',
+    ['cache', 'result']
+)
+READ_CACHE_REQUESTS = Counter(
+    'coffeeshop_read_cache_requests_total',
+    'Lectures coûteuses servies par le micro-cache single-flight',
+    ['cache', 'result']
+)
+
+class MemoryCacheBackend:
+    """LRU borné avec expiration, propre au processus"""
+
+    def __init__(self, max_entries=ENTITY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Générations d'invalidation, conservées par clear()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def _set(self, key, value, ttl):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def generation(self, generation_key):
+        with self._lock:
+            return self._generations.get(generation_key, 0)
+
+    def set_if_generation(self, generation_key, generation, items, ttl):
+        """Stocke items si aucune invalidation n'a eu lieu depuis generation"""
+        with self._lock:
+            if self._generations.get(generation_key, 0) != generation:
+                return False
+            for key, value in items:
+                self._set(key, value, ttl)
+            return True
+
+    def invalidate(self, generation_key, *keys):
+        with self._lock:
+            self._generations[generation_key] = self._generations.get(generation_key, 0) + 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+# Écrit les paires clé/valeur (ARGV[3..]) si la génération (KEYS[1]) vaut ARGV[1]
+SET_IF_GENERATION_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') ~= tonumber(ARGV[1]) then
+    return 0
+end
+for i = 3, #ARGV, 2 do
+    redis.call('SET', ARGV[i], ARGV[i + 1], 'PX', ARGV[2])
+end
+return 1
+"""
+
+class RedisCacheBackend:
+    """Cache partagé entre processus ; documents encodés en BSON"""
+
+    def __init__(self, url=ENTITY_CACHE_REDIS_URL):
+        self.url = url
+        self._client = None
+        self._set_if_generation = None
+        self._pid = None
+
+    @property
+    def client(self):
+        # Une connexion par processus : le client ne survit pas au fork
+        if self._client is None or self._pid != os.getpid():
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+            self._set_if_generation = self._client.register_script(SET_IF_GENERATION_SCRIPT)
+            self._pid = os.getpid()
+        return self._client
+
+    def get(self, key):
+        raw = self.client.get(key)
+        if raw is None:
+            return None
+        return bson.decode(raw)['v']
+
+    def set(self, key, value, ttl):
+        self.client.set(key, bson.encode({'v': value}), px=int(ttl * 1000))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+    def generation(self, generation_key):
+        return int(self.client.get(generation_key) or 0)
+
+    def set_if_generation(self, generation_key, generation, items, ttl):
+        """Compare-and-set atomique côté Redis, partagé par tous les processus"""
+        client = self.client
+        args = [generation, int(ttl * 1000)]
+        for key, value in items:
+            args.extend([key, bson.encode({'v': value})])
+        return bool(self._set_if_generation(keys=[generation_key], args=args, client=client))
+
+    def invalidate(self, generation_key, *keys):
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.incr(generation_key)
+        if keys:
+            pipeline.delete(*keys)
+        pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter('coffeeshop:*'):
+            # Les générations survivent : un chargement en cours reste périmé
+            if not key.endswith(b':generation'):
+                self.client.delete(key)
+
+    def __len__(self):
+        return -1
+
+def resolve_backend_name(name=ENTITY_CACHE_BACKEND, workers=WEB_WORKERS):
+    """Backend effectif : 'auto' résolu, 'memory' refusé avec plusieurs workers"""
+    if name == 'auto':
+        if workers <= 1:
+            return 'memory'
+        try:
+            RedisCacheBackend().client.ping()
+            return 'redis'
+        except Exception as e:
+            logger.warning(f"Redis injoignable avec {workers} workers, cache des entités désactivé: {e}")
+            return 'off'
+    if name == 'memory' and workers > 1:
+        raise RuntimeError(
+            f"ENTITY_CACHE_BACKEND=memory avec {workers} workers : les invalidations ne seraient vues "
+            f"que par un worker. Utilisez redis (ENTITY_CACHE_REDIS_URL) ou off."
+        )
+    return name
+
+def create_backend(name=None):
+    """Backend de cache désigné par ENTITY_CACHE_BACKEND (None si désactivé)"""
+    name = name or ENTITY_CACHE_BACKEND_NAME
+    if name == 'off':
+        return None
+    if name == 'redis':
+        return RedisCacheBackend()
+    if name != 'memory':
+        logger.warning(f"Backend de cache inconnu '{name}', utilisation du cache mémoire")
+    return MemoryCacheBackend()
+
+class EntityCache:
+    """Cache read-through d'une collection, indexé par ID et par numéro
+
+    Le document est stocké sous son ID ; le numéro ne pointe que vers l'ID,
+    si bien qu'invalider l'ID suffit à invalider les deux accès. Les clés
+    portent le magasin courant : les numéros ne sont uniques que par magasin.
+    """
+
+    def __init__(self, name, backend=None, ttl=ENTITY_CACHE_TTL):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def _id_key(self, entity_id):
+        return f"coffeeshop:{current_store()}:{self.name}:id:{entity_id}"
+
+    def _number_key(self, number):
+        return f"coffeeshop:{current_store()}:{self.name}:number:{number}"
+
+    def _generation_key(self):
+        # Incrémentée à chaque invalidation : un chargement commencé avant
+        # une écriture ne doit pas réinsérer l'ancienne version
+        return f"coffeeshop:{current_store()}:{self.name}:generation"
+
+    def _record(self, result):
+        with self._lock:
+            self.stats['hits' if result == 'hit' else 'misses'] += 1
+        CACHE_REQUESTS.labels(self.name, result).inc()
+
+    def _store(self, document, number_field, generation):
+        entity_id = str(document['_id'])
+        items = [(self._id_key(entity_id), document)]
+        if document.get(number_field):
+            items.append((self._number_key(document[number_field]), entity_id))
+        self.backend.set_if_generation(self._generation_key(), generation, items, self.ttl)
+
+    def get_by_id(self, entity_id, loader, number_field):
+        """Document par ID ; loader() n'est appelé qu'en cas d'absence"""
+        if not self.enabled:
+            return loader()
+        document = self.backend.get(self._id_key(entity_id))
+        if document is not None:
+            self._record('hit')
+            return document
+
+        self._record('miss')
+        generation = self.backend.generation(self._generation_key())
+        document = loader()
+        if document is not None:
+            self._store(document, number_field, generation)
+        return document
+
+    def get_by_number(self, number, loader, number_field):
+        """Document par numéro ; loader() n'est appelé qu'en cas d'absence"""
+        if not self.enabled:
+            return loader()
+        entity_id = self.backend.get(self._number_key(number))
+        if entity_id is not None:
+            document = self.backend.get(self._id_key(entity_id))
+            if document is not None:
+                self._record('hit')
+                return document
+
+        self._record('miss')
+        generation = self.backend.generation(self._generation_key())
+        document = loader()
+        if document is not None:
+            self._store(document, number_field, generation)
+        return document
+
+    def invalidate(self, entity_id):
+        """Retire un document après une écriture"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.stats['invalidations'] += 1
+        self.backend.invalidate(self._generation_key(), self._id_key(str(entity_id)))
+
+    def clear(self):
+        if self.enabled:
+            self.backend.invalidate(self._generation_key())
+            self.backend.clear()
+
+    def get_stats(self):
+        """Compteurs du processus courant et taux de succès"""
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hitRate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        stats['backend'] = ENTITY_CACHE_BACKEND_NAME if self.enabled else 'off'
+        stats['entries'] = len(self.backend) if self.enabled else 0
+        stats['ttlSeconds'] = self.ttl
+        return stats
+
+class _Flight:
+    """Calcul en cours, attendu par les appels identiques"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class CoalescedCache:
+    """Micro-cache single-flight avec stale-while-revalidate, propre au processus"""
+
+    def __init__(self, name, fresh=READ_CACHE_FRESH_SECONDS, stale=READ_CACHE_STALE_SECONDS):
+        self.name = name
+        self.fresh = fresh
+        self.stale = stale
+        self._entries = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """Valeur de key ; compute() n'est exécuté que par un seul appelant à la fois"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, computed_at = entry
+                age = now - computed_at
+                if age < self.fresh:
+                    READ_CACHE_REQUESTS.labels(self.name, 'hit').inc()
+                    return value
+                if age < self.fresh + self.stale:
+                    READ_CACHE_REQUESTS.labels(self.name, 'stale').inc()
+                    if key not in self._flights:
+                        self._flights[key] = _Flight()
+                        # Le rafraîchissement garde le contexte de l'appelant (magasin)
+                        threading.Thread(
+                            target=contextvars.copy_context().run,
+                            args=(self._run, key, compute, self._flights[key]),
+                            name=f"revalidate-{self.name}", daemon=True
+                        ).start()
+                    return value
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            READ_CACHE_REQUESTS.labels(self.name, 'miss').inc()
+            self._run(key, compute, flight)
+        else:
+            READ_CACHE_REQUESTS.labels(self.name, 'coalesced').inc()
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _run(self, key, compute, flight):
+        try:
+            flight.value = compute()
+            with self._lock:
+                self._entries[key] = (flight.value, time.monotonic())
+        except Exception as e:
+            flight.error = e
+            logger.error(f"Erreur lors du calcul de {self.name}[{key}]: {e}")
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, key=None):
+        """Oublie une valeur (ou toutes) ; les calculs en cours ne sont pas interrompus"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+# Caches partagés par toutes les instances de services du processus
+# Résolu une fois, dans le maître avant le fork quand l'app est préchargée
+ENTITY_CACHE_BACKEND_NAME = resolve_backend_name()
+order_cache = EntityCache('orders', create_backend())
+bill_cache = EntityCache('bills', create_backend())
+
+def get_cache_stats():
+    """Statistiques des caches d'entités"""
+    return {
+        'orders': order_cache.get_stats(),
+        'bills': bill_cache.get_stats()
+    }
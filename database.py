@@ -2,74 +2,394 @@
 Configuration de la base de données MongoDB pour le Coffee Shop CRUD
 """
 import os
-from pymongo import MongoClient
+import re
+import json
+import threading
+import contextvars
+from contextlib import contextmanager
+from pymongo import MongoClient, ReadPreference
 from pymongo.errors import ConnectionFailure
+from pymongo import monitoring
+from pymongo.database import Database
 import logging
 
 # Configuration de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
+
+# Magasin servi par défaut (requêtes sans X-Store-Id, tâches de fond)
+DEFAULT_STORE_ID = os.getenv('DEFAULT_STORE_ID', 'main')
+STORE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+# Magasin du contexte courant (requête, thread ou tâche asyncio)
+_current_store = contextvars.ContextVar('store_id', default=DEFAULT_STORE_ID)
+
+def current_store():
+    """Identifiant du magasin du contexte courant"""
+    return _current_store.get()
+
+def set_current_store(store_id):
+    """Change le magasin du contexte courant ; retourne le jeton pour reset_current_store"""
+    return _current_store.set(store_id)
+
+def reset_current_store(token):
+    _current_store.reset(token)
+
+@contextmanager
+def use_store(store_id):
+    """Exécute un bloc dans le contexte d'un magasin"""
+    token = _current_store.set(store_id)
+    try:
+        yield store_id
+    finally:
+        _current_store.reset(token)
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Compteurs du pool de connexions du processus courant"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {
+                'created': 0,
+                'closed': 0,
+                'checkedOut': 0,
+                'checkoutFailures': 0,
+                'waiting': 0,
+                'poolsCleared': 0
+            }
+
+    def _inc(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc('poolsCleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc('closed')
+
+    def connection_check_out_started(self, event):
+        self._inc('waiting')
+
+    def connection_check_out_failed(self, event):
+        self._inc('waiting', -1)
+        self._inc('checkoutFailures')
+
+    def connection_checked_out(self, event):
+        self._inc('waiting', -1)
+        self._inc('checkedOut')
+
+    def connection_checked_in(self, event):
+        self._inc('checkedOut', -1)
+
+class StoreConnection:
+    """Client MongoDB d'un magasin : base, pool et compteurs qui lui sont propres"""
+    
+    def __init__(self, store_id, uri, database_name):
+        self.store_id = store_id
+        self.uri = uri
+        self.database_name = database_name
+        self.pool_stats = PoolStatsListener()
+        self.client = None
+        self.db = None
+        self.pid = None
+        self.collections = {}
+    
+    @property
+    def connected(self):
+        return self.client is not None and self.pid == os.getpid()
+    
+    def reset(self):
+        self.client = None
+        self.db = None
+        self.pid = None
+        self.collections = {}
+        self.pool_stats.reset()
+
 class DatabaseConfig:
-    """Configuration et connexion à MongoDB"""
+    """Configuration et connexion à MongoDB
+    
+    Le client est créé paresseusement, une fois par processus : après un
+    fork (serveur pré-forké), le fils recrée son propre client au lieu
+    d'utiliser celui hérité du parent.
+    
+    Chaque magasin (MONGO_STORES) a sa propre base, éventuellement sur son
+    propre serveur, et donc son propre client et son propre pool : un
+    magasin de plus ajoute de la capacité au lieu de la partager. Le magasin
+    visé est celui du contexte courant (use_store, en-tête X-Store-Id).
+    """
     
     def __init__(self):
         # Configuration par défaut pour développement local
         self.MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
         self.DATABASE_NAME = os.getenv('DATABASE_NAME', 'coffee_shop_db')
-        self.client = None
-        self.db = None
+        # Pool de connexions et délais (surchargés par variables d'environnement)
+        self.MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+        self.MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+        self.MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '60000'))
+        self.WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+        self.CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+        self.SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '10000'))
+        self.SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+        self.COMPRESSORS = os.getenv('MONGO_COMPRESSORS', '')
+        self.READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+        self.stores = self._load_stores(os.getenv('MONGO_STORES', ''))
+        self._lock = threading.Lock()
+        self.event_listeners = []
+        self.database = ProcessLocalDatabase(self)
+        
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset_after_fork)
+    
+    def _load_stores(self, raw):
+        """Magasins déclarés dans MONGO_STORES (JSON), plus le magasin par défaut
+        
+        MONGO_STORES='{"lyon": {"uri": "mongodb://localhost:27018/"},
+                       "nantes": {"uri": "mongodb://localhost:27019/", "database": "nantes_db"}}'
+        Sans "uri", le magasin est sur MONGO_URI ; sans "database", sa base
+        est DATABASE_NAME suffixé de son identifiant.
+        """
+        declared = json.loads(raw) if raw else {}
+        if not isinstance(declared, dict):
+            raise ValueError("MONGO_STORES doit être un objet JSON {storeId: {uri, database}}")
+        declared.setdefault(DEFAULT_STORE_ID, {})
+        stores = {}
+        for store_id, options in declared.items():
+            if not STORE_ID_PATTERN.match(store_id):
+                raise ValueError(f"Identifiant de magasin invalide: {store_id}")
+            default_name = self.DATABASE_NAME if store_id == DEFAULT_STORE_ID else f"{self.DATABASE_NAME}_{store_id}"
+            stores[store_id] = StoreConnection(
+                store_id,
+                options.get('uri', self.MONGO_URI),
+                options.get('database', default_name)
+            )
+        return stores
+    
+    def store_ids(self):
+        """Identifiants des magasins configurés (magasin par défaut en premier)"""
+        return [DEFAULT_STORE_ID] + sorted(s for s in self.stores if s != DEFAULT_STORE_ID)
+    
+    def has_store(self, store_id):
+        return store_id in self.stores
+    
+    def get_store(self, store_id=None):
+        """Connexion du magasin demandé, ou de celui du contexte courant"""
+        store_id = store_id or current_store()
+        store = self.stores.get(store_id)
+        if store is None:
+            raise ValueError(f"Magasin inconnu: {store_id}")
+        return store
+    
+    def client_options(self, store=None):
+        """Options du MongoClient issues de la configuration"""
+        if self.READ_PREFERENCE not in READ_PREFERENCES:
+            raise ValueError(f"Préférence de lecture invalide: {self.READ_PREFERENCE}")
+        listeners = list(self.event_listeners)
+        if store is not None:
+            listeners.append(store.pool_stats)
+        options = {
+            'maxPoolSize': self.MAX_POOL_SIZE,
+            'minPoolSize': self.MIN_POOL_SIZE,
+            'maxIdleTimeMS': self.MAX_IDLE_TIME_MS,
+            'waitQueueTimeoutMS': self.WAIT_QUEUE_TIMEOUT_MS,
+            'connectTimeoutMS': self.CONNECT_TIMEOUT_MS,
+            'socketTimeoutMS': self.SOCKET_TIMEOUT_MS,
+            'serverSelectionTimeoutMS': self.SERVER_SELECTION_TIMEOUT_MS,
+            'read_preference': READ_PREFERENCES[self.READ_PREFERENCE],
+            'event_listeners': listeners
+        }
+        if self.COMPRESSORS:
+            options['compressors'] = self.COMPRESSORS
+        return options
+    
+    def add_event_listener(self, listener):
+        """Ajoute un listener pymongo (pris en compte à la création du client)"""
+        self.event_listeners.append(listener)
+        if any(store.client is not None for store in self.stores.values()):
+            logger.warning("Client MongoDB déjà créé : le listener s'appliquera au prochain client")
+    
+    def reset_after_fork(self):
+        """Oublie les clients hérités du parent (appelé dans le fils après fork)"""
+        self._lock = threading.Lock()
+        for store in self.stores.values():
+            store.reset()
+    
+    def _ensure_client(self, store_id=None):
+        """Crée le client du magasin pour le processus courant si nécessaire (sans aller-retour réseau)"""
+        store = self.get_store(store_id)
+        if store.connected:
+            return store
+        with self._lock:
+            if not store.connected:
+                store.collections = {}
+                store.client = MongoClient(store.uri, **self.client_options(store))
+                store.db = store.client[store.database_name]
+                store.pid = os.getpid()
+                logger.info(f"Client MongoDB du magasin {store.store_id} créé pour le processus {store.pid}")
+        return store
     
     def connect(self):
-        """Établit la connexion à MongoDB"""
-        try:
-            self.client = MongoClient(self.MONGO_URI)
-            # Test de la connexion
-            self.client.admin.command('ping')
-            self.db = self.client[self.DATABASE_NAME]
-            logger.info(f"Connexion réussie à MongoDB: {self.DATABASE_NAME}")
-            return True
-        except ConnectionFailure as e:
-            logger.error(f"Échec de connexion à MongoDB: {e}")
-            return False
-    
-    def get_database(self):
-        """Retourne l'instance de la base de données"""
-        if self.db is None:
-            self.connect()
-        return self.db
+        """Établit la connexion à MongoDB (tous les magasins)"""
+        connected = True
+        for store_id in self.store_ids():
+            try:
+                store = self._ensure_client(store_id)
+                # Test de la connexion
+                store.client.admin.command('ping')
+                logger.info(f"Connexion réussie à MongoDB: {store.database_name} (magasin {store_id})")
+            except ConnectionFailure as e:
+                logger.error(f"Échec de connexion à MongoDB pour le magasin {store_id}: {e}")
+                connected = False
+        return connected
+    
+    def get_database(self, store_id=None):
+        """Retourne la base du magasin courant pour le processus courant"""
+        return self._ensure_client(store_id).db
+    
+    def get_collection(self, name, store_id=None):
+        """Retourne une collection du magasin courant (mise en cache)"""
+        store = self._ensure_client(store_id)
+        collection = store.collections.get(name)
+        if collection is None:
+            collection = store.collections[name] = store.db[name]
+        return collection
+    
+    def _store_pool_stats(self, store):
+        stats = dict(store.pool_stats.stats)
+        stats.update({
+            'connected': store.connected,
+            'open': stats['created'] - stats['closed'],
+            'utilization': round(stats['checkedOut'] / self.MAX_POOL_SIZE, 3) if self.MAX_POOL_SIZE else None
+        })
+        return stats
+    
+    def get_pool_stats(self, store_id=None):
+        """Statistiques des pools de connexions du processus courant
+        
+        Sans store_id : totaux de tous les magasins, détaillés dans 'stores'.
+        """
+        if store_id is not None:
+            stats = self._store_pool_stats(self.get_store(store_id))
+            stats.update({'pid': os.getpid(), 'maxPoolSize': self.MAX_POOL_SIZE, 'minPoolSize': self.MIN_POOL_SIZE})
+            return stats
+        
+        per_store = {store_id: self._store_pool_stats(self.stores[store_id]) for store_id in self.store_ids()}
+        totals = {
+            key: sum(stats[key] for stats in per_store.values())
+            for key in ('created', 'closed', 'checkedOut', 'checkoutFailures', 'waiting', 'poolsCleared', 'open')
+        }
+        capacity = self.MAX_POOL_SIZE * len(per_store)
+        totals.update({
+            'pid': os.getpid(),
+            'connected': any(stats['connected'] for stats in per_store.values()),
+            'maxPoolSize': self.MAX_POOL_SIZE,
+            'minPoolSize': self.MIN_POOL_SIZE,
+            'utilization': round(totals['checkedOut'] / capacity, 3) if capacity else None,
+            'stores': per_store
+        })
+        return totals
     
     def close_connection(self):
-        """Ferme la connexion à MongoDB"""
-        if self.client:
-            self.client.close()
-            logger.info("Connexion MongoDB fermée")
+        """Ferme les connexions à MongoDB"""
+        for store in self.stores.values():
+            if store.connected:
+                store.client.close()
+                logger.info(f"Connexion MongoDB du magasin {store.store_id} fermée")
+            store.client = None
+            store.db = None
+            store.collections = {}
+
+class ProcessLocalDatabase:
+    """Base de données résolue à chaque accès dans le processus courant
+    
+    Les services gardent une référence à `get_db()` créée à l'import : ce
+    proxy évite qu'ils conservent un client créé avant un fork, et renvoie
+    chaque accès vers la base du magasin courant.
+    """
+    
+    def __init__(self, config):
+        self._config = config
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        # Collections (db.orders) comme méthodes de Database (db.command)
+        if hasattr(Database, name):
+            return getattr(self._config.get_database(), name)
+        return ProcessLocalCollection(self._config, name)
+    
+    def __getitem__(self, name):
+        return ProcessLocalCollection(self._config, name)
+
+class ProcessLocalCollection:
+    """Collection résolue dans le processus et le magasin courants à chaque appel"""
+    
+    def __init__(self, config, name):
+        self._config = config
+        self._name = name
+    
+    @property
+    def name(self):
+        return self._name
+    
+    def __getattr__(self, attribute):
+        return getattr(self._config.get_collection(self._name), attribute)
 
 # Instance globale de configuration
 db_config = DatabaseConfig()
 
 def get_db():
-    """Fonction utilitaire pour obtenir la base de données"""
-    return db_config.get_database()
+    """Fonction utilitaire pour obtenir la base de données (sûre après fork)"""
+    return db_config.database
 
 def init_collections():
-    """Initialise les collections avec des index pour optimiser les performances"""
-    db = get_db()
-    
-    # Index pour la collection orders
-    db.orders.create_index("orderNumber", unique=True)
-    db.orders.create_index("status")
-    db.orders.create_index("orderDate")
+    """Initialise les collections avec des index adaptés aux requêtes des services (tous les magasins)"""
+    from src.config.indexes import IndexManager
+    for store_id in db_config.store_ids():
+        with use_store(store_id):
+            IndexManager(get_db()).ensure_indexes()
     
-    # Index pour la collection bills
-    db.bills.create_index("billNumber", unique=True)
-    db.bills.create_index("orderId")
-    db.bills.create_index("paymentStatus")
-    
-    # Index pour la collection stock
-    db.stock.create_index("productId", unique=True)
-    db.stock.create_index("category")
-    db.stock.create_index("status")
+    logger.info(f"Collections et index initialisés ({len(db_config.stores)} magasins)")
+
+def init_collections_in_background():
+    """Crée les index dans un thread séparé pour ne pas bloquer le démarrage"""
+    def run():
+        try:
+            init_collections()
+        except Exception as e:
+            logger.error(f"Erreur lors de la création des index: {e}")
     
-    logger.info("Collections et index initialisés")
+    thread = threading.Thread(target=run, name='init-collections', daemon=True)
+    thread.start()
+    return thread
 
+if __name__ == '__main__':
+    # Étape de déploiement : création des index une fois pour toutes
+    init_collections()
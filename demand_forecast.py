@@ -0,0 +1,160 @@
+"""
+Prévision de la demande et calcul des points de commande du stock
+
+Le job agrège l'historique des lignes de commande (`items.productName` /
+`items.quantity`) par produit et par jour, construit une matrice de demande
+produits x jours avec NumPy puis calcule en une seule passe vectorisée,
+pour tout le catalogue, la prévision journalière (moyenne mobile ou lissage
+exponentiel), le stock de sécurité et le point de commande suggéré.
+"""
+import argparse
+import json
+import logging
+import sys
+from datetime import datetime, timedelta
+import numpy as np
+from pymongo import UpdateOne
+from src.config.database import get_db
+from src.models.Inventory import STOCK_STATUS_EXPRESSION
+
+logger = logging.getLogger(__name__)
+
+FORECAST_METHODS = ["sma", "ema"]
+
+class DemandForecaster:
+    """Calcule les prévisions et les points de commande pour l'ensemble du stock"""
+
+    def __init__(self, history_days=365, method="ema", window=28, alpha=0.3,
+                 lead_time_days=2, service_level_z=1.65):
+        if method not in FORECAST_METHODS:
+            raise ValueError(f"Méthode de prévision invalide: {method}")
+        self.db = get_db()
+        self.history_days = history_days
+        self.method = method
+        self.window = window
+        self.alpha = alpha
+        self.lead_time_days = lead_time_days
+        self.service_level_z = service_level_z
+
+    def load_daily_demand(self, end=None):
+        """Construit la matrice de demande journalière (produits x jours)"""
+        end = (end or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        start = end - timedelta(days=self.history_days)
+
+        cursor = self.db.orders.aggregate([
+            {"$match": {"orderDate": {"$gte": start, "$lt": end}}},
+            {"$unwind": "$items"},
+            {"$group": {
+                "_id": {
+                    "product": "$items.productName",
+                    "day": {"$dateTrunc": {"date": "$orderDate", "unit": "day"}}
+                },
+                "quantity": {"$sum": "$items.quantity"}
+            }}
+        ], allowDiskUse=True)
+
+        products = {}
+        rows, columns, quantities = [], [], []
+        for group in cursor:
+            name = group["_id"]["product"]
+            row = products.setdefault(name, len(products))
+            rows.append(row)
+            columns.append((group["_id"]["day"] - start).days)
+            quantities.append(group["quantity"])
+
+        demand = np.zeros((len(products), self.history_days), dtype=np.float64)
+        if quantities:
+            np.add.at(demand, (np.asarray(rows), np.asarray(columns)), np.asarray(quantities, dtype=np.float64))
+        return list(products), demand
+
+    def forecast(self, demand):
+        """Prévision journalière et écart-type de la demande, par produit"""
+        window = min(self.window, demand.shape[1])
+        recent = demand[:, -window:]
+
+        if self.method == "sma":
+            forecast = recent.mean(axis=1)
+        else:
+            # Lissage exponentiel sous forme fermée : moyenne pondérée des jours
+            ages = np.arange(demand.shape[1] - 1, -1, -1)
+            weights = self.alpha * (1 - self.alpha) ** ages
+            weights[0] += (1 - self.alpha) ** demand.shape[1]
+            forecast = demand @ weights
+
+        sigma = recent.std(axis=1, ddof=1) if window > 1 else np.zeros(demand.shape[0])
+        return forecast, sigma
+
+    def reorder_points(self, forecast, sigma):
+        """Stock de sécurité et point de commande pour le délai de réapprovisionnement"""
+        safety_stock = self.service_level_z * sigma * np.sqrt(self.lead_time_days)
+        reorder_point = np.ceil(forecast * self.lead_time_days + safety_stock)
+        return safety_stock, reorder_point
+
+    def run(self, apply=False, end=None):
+        """Exécute le job et écrit les points de commande suggérés dans le stock"""
+        products, demand = self.load_daily_demand(end=end)
+        if not products:
+            return {"products": 0, "updated": 0, "suggestions": []}
+
+        forecast, sigma = self.forecast(demand)
+        safety_stock, reorder_point = self.reorder_points(forecast, sigma)
+
+        now = datetime.utcnow()
+        suggestions = []
+        operations = []
+        for index, name in enumerate(products):
+            suggestion = {
+                "dailyDemand": round(float(forecast[index]), 3),
+                "demandStdDev": round(float(sigma[index]), 3),
+                "safetyStock": round(float(safety_stock[index]), 3),
+                "suggestedMinQuantity": float(reorder_point[index]),
+                "method": self.method,
+                "leadTimeDays": self.lead_time_days,
+                "computedAt": now
+            }
+            if apply:
+                # Le statut dépend du seuil : il est recalculé dans la même mise à jour
+                update = [
+                    {"$set": {"forecast": suggestion, "minQuantity": suggestion["suggestedMinQuantity"]}},
+                    {"$set": {"status": STOCK_STATUS_EXPRESSION}}
+                ]
+            else:
+                update = {"$set": {"forecast": suggestion}}
+            operations.append(UpdateOne({"name": name}, update))
+            suggestions.append({"productName": name, **suggestion})
+
+        result = self.db.stock.bulk_write(operations, ordered=False)
+        logger.info(f"Prévisions de demande écrites pour {result.matched_count} produits")
+        return {
+            "products": len(products),
+            "updated": result.matched_count,
+            "suggestions": suggestions
+        }
+
+def main(argv=None):
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Prévision de la demande et points de commande du stock")
+    parser.add_argument("--history-days", type=int, default=365, help="Profondeur d'historique en jours")
+    parser.add_argument("--method", choices=FORECAST_METHODS, default="ema", help="Méthode de prévision")
+    parser.add_argument("--window", type=int, default=28, help="Fenêtre (jours) de la moyenne mobile et de l'écart-type")
+    parser.add_argument("--alpha", type=float, default=0.3, help="Coefficient du lissage exponentiel")
+    parser.add_argument("--lead-time", type=float, default=2, help="Délai de réapprovisionnement en jours")
+    parser.add_argument("--z", type=float, default=1.65, help="Coefficient de niveau de service (1.65 = 95%%)")
+    parser.add_argument("--apply", action="store_true", help="Remplace minQuantity par le point de commande suggéré")
+    args = parser.parse_args(argv)
+
+    forecaster = DemandForecaster(
+        history_days=args.history_days,
+        method=args.method,
+        window=args.window,
+        alpha=args.alpha,
+        lead_time_days=args.lead_time,
+        service_level_z=args.z
+    )
+    report = forecaster.run(apply=args.apply)
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2, default=str)
+    sys.stdout.write("\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
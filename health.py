@@ -0,0 +1,178 @@
+"""
+Santé de l'API Coffee Shop
+
+Un thread de fond par worker sonde MongoDB (ping et latence), le pool de
+connexions et la chaleur des caches toutes les HEALTH_PROBE_SECONDS. Les
+endpoints répondent depuis le dernier état connu, sans jamais toucher la
+base :
+
+- /api/live : le processus répond (redémarrer le worker sinon),
+- /api/ready : le worker peut recevoir du trafic (dernière sonde réussie et
+  récente, pool non saturé),
+- /api/health : état détaillé, 200 si prêt, 503 sinon.
+"""
+import os
+import time
+import threading
+from datetime import datetime
+from flask import jsonify
+from src.config.database import db_config
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PROBE_SECONDS = float(os.getenv('HEALTH_PROBE_SECONDS', '2'))
+# Au-delà, un état non rafraîchi (sonde bloquée) ne prouve plus rien
+HEALTH_MAX_AGE_SECONDS = float(os.getenv('HEALTH_MAX_AGE_SECONDS', str(HEALTH_PROBE_SECONDS * 5)))
+HEALTH_MAX_POOL_WAITING = int(os.getenv('HEALTH_MAX_POOL_WAITING', '50'))
+
+class HealthProber:
+    """Sonde périodique dont le dernier résultat est servi depuis la mémoire"""
+
+    def __init__(self, interval=HEALTH_PROBE_SECONDS, max_age=HEALTH_MAX_AGE_SECONDS,
+                 max_pool_waiting=HEALTH_MAX_POOL_WAITING):
+        self.interval = interval
+        self.max_age = max_age
+        self.max_pool_waiting = max_pool_waiting
+        self.components = {}
+        self.status = {
+            'database': {'ok': False, 'error': 'Aucune sonde effectuée'},
+            'pool': {},
+            'components': {},
+            'probedAt': None
+        }
+        self._probed_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_component(self, name, status_function):
+        """Ajoute un composant (cache, réplique...) rapporté à chaque sonde"""
+        self.components[name] = status_function
+
+    def start(self):
+        """Démarre la sonde en arrière-plan"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Arrête la sonde"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self.probe()
+            if self._stop.wait(self.interval):
+                break
+
+    def _ping(self, store_id):
+        start = time.perf_counter()
+        try:
+            db_config.get_database(store_id).command('ping')
+            return {'ok': True, 'latencyMs': round((time.perf_counter() - start) * 1000, 2)}
+        except Exception as e:
+            logger.warning(f"Sonde de santé MongoDB en échec (magasin {store_id}): {e}")
+            return {'ok': False, 'error': str(e)}
+
+    def probe(self):
+        """Sonde MongoDB (chaque magasin), le pool et les composants, puis publie l'état"""
+        stores = {store_id: self._ping(store_id) for store_id in db_config.store_ids()}
+        failed = [store_id for store_id, result in stores.items() if not result['ok']]
+        if failed:
+            database = {'ok': False, 'error': f"Magasins injoignables: {', '.join(failed)}"}
+        else:
+            database = {'ok': True, 'latencyMs': max(result['latencyMs'] for result in stores.values())}
+        if len(stores) > 1:
+            database['stores'] = stores
+
+        components = {}
+        for name, status_function in self.components.items():
+            try:
+                components[name] = status_function()
+            except Exception as e:
+                components[name] = {'error': str(e)}
+
+        # Remplacement atomique : les lecteurs voient l'ancien ou le nouvel état
+        self.status = {
+            'database': database,
+            'pool': db_config.get_pool_stats(),
+            'components': components,
+            'probedAt': datetime.utcnow().isoformat()
+        }
+        self._probed_at = time.monotonic()
+
+    def age(self):
+        """Âge en secondes du dernier état publié"""
+        if self._probed_at is None:
+            return None
+        return time.monotonic() - self._probed_at
+
+    def readiness(self):
+        """Liste des raisons pour lesquelles le worker n'est pas prêt (vide si prêt)"""
+        status = self.status
+        age = self.age()
+        reasons = []
+        if age is None:
+            reasons.append('Aucune sonde effectuée')
+        elif age > self.max_age:
+            reasons.append(f"Dernière sonde trop ancienne ({round(age, 1)}s)")
+        if not status['database']['ok']:
+            reasons.append('MongoDB injoignable')
+        if status['pool'].get('waiting', 0) > self.max_pool_waiting:
+            reasons.append('Pool de connexions MongoDB saturé')
+        return reasons
+
+health_prober = HealthProber()
+
+def live():
+    """Vivacité : le processus traite les requêtes"""
+    return jsonify({
+        'success': True,
+        'status': 'alive',
+        'pid': os.getpid()
+    }), 200
+
+def ready():
+    """Disponibilité : le worker peut recevoir du trafic"""
+    reasons = health_prober.readiness()
+    if reasons:
+        return jsonify({
+            'success': False,
+            'status': 'not_ready',
+            'reasons': reasons
+        }), 503
+    return jsonify({
+        'success': True,
+        'status': 'ready'
+    }), 200
+
+def health_check():
+    """Endpoint de vérification de santé de l'API (servi depuis la mémoire)"""
+    status = health_prober.status
+    reasons = health_prober.readiness()
+    age = health_prober.age()
+    body = {
+        'success': not reasons,
+        'message': 'API Coffee Shop opérationnelle' if not reasons else 'API Coffee Shop indisponible',
+        'database': 'MongoDB connecté' if status['database']['ok'] else 'MongoDB injoignable',
+        'checks': {
+            'database': status['database'],
+            'pool': status['pool'],
+            **status['components']
+        },
+        'probedAt': status['probedAt'],
+        'ageSeconds': round(age, 3) if age is not None else None,
+        'version': '1.0.0'
+    }
+    if reasons:
+        body['reasons'] = reasons
+    return jsonify(body), 200 if not reasons else 503
+
+def init_health(app):
+    """Enregistre /api/health, /api/live et /api/ready"""
+    app.add_url_rule('/api/health', 'health_check', health_check, methods=['GET'])
+    app.add_url_rule('/api/live', 'live', live, methods=['GET'])
+    app.add_url_rule('/api/ready', 'ready', ready, methods=['GET'])
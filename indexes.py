@@ -0,0 +1,323 @@
+"""
+Gestionnaire d'index MongoDB guidé par les formes de requêtes
+
+Les index sont déclarés à partir des requêtes réellement émises par les
+services (filtre + tri). Le mode vérification contrôle que les index
+déclarés existent, exécute `explain()` sur chacune de ces requêtes et échoue
+si l'une d'elles parcourt toute la collection (COLLSCAN) ou trie en mémoire
+(SORT). Les exceptions sont déclarées sur la forme de requête, avec leur
+raison. Une collection absente fait échouer la vérification (son plan ne
+prouve rien).
+
+Un index non déclaré n'est supprimé que s'il est redondant : ses clés sont
+un préfixe de celles d'un index déclaré et il ne porte aucune option
+(unicité, TTL, filtre partiel...), ou s'il a été retiré des déclarations
+(RETIRED_INDEXES). Les autres index posés à la main sont seulement signalés.
+
+Chaque magasin ayant sa propre base, les index n'ont pas de préfixe
+storeId : ils sont appliqués et vérifiés dans la base de chaque magasin.
+
+Usage : python -m src.config.indexes [--apply] [--drop-redundant] [--check] [--store ID]
+"""
+import os
+import argparse
+import sys
+import logging
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+from src.config.database import get_db, db_config, use_store
+
+logger = logging.getLogger(__name__)
+
+# Index déclarés par collection (le nom sert à détecter les index redondants)
+INDEX_SPECS = {
+    "orders": [
+        IndexModel([("orderNumber", ASCENDING)], name="orderNumber_1", unique=True),
+        # get_all_orders(status) : {status} trié par orderDate desc
+        IndexModel([("status", ASCENDING), ("orderDate", DESCENDING)], name="status_1_orderDate_-1"),
+        # get_all_orders() et stats : tri par orderDate desc sans filtre
+        IndexModel([("orderDate", DESCENDING)], name="orderDate_-1"),
+    ],
+    "bills": [
+        IndexModel([("billNumber", ASCENDING)], name="billNumber_1", unique=True),
+        IndexModel([("orderId", ASCENDING)], name="orderId_1"),
+        # get_all_bills(paymentStatus) : {paymentStatus} trié par billDate desc
+        IndexModel([("paymentStatus", ASCENDING), ("billDate", DESCENDING)], name="paymentStatus_1_billDate_-1"),
+        IndexModel([("billDate", DESCENDING)], name="billDate_-1"),
+    ],
+    "stock": [
+        IndexModel([("productId", ASCENDING)], name="productId_1", unique=True),
+        # get_all_stock : {category[, status]} trié par name ; distinct(category)
+        IndexModel([("category", ASCENDING), ("status", ASCENDING), ("name", ASCENDING)], name="category_1_status_1_name_1"),
+        # get_all_stock : {status} trié par name ; alertes : {status $in} trié par quantity
+        IndexModel([("status", ASCENDING), ("name", ASCENDING)], name="status_1_name_1"),
+        IndexModel([("status", ASCENDING), ("quantity", ASCENDING)], name="status_1_quantity_1"),
+        # Les commandes résolvent leurs prix par nom : un nom désigne un seul produit.
+        # Sert aussi au $in des prix et au tri par name sans filtre
+        IndexModel([("name", ASCENDING)], name="name_1", unique=True),
+    ],
+    "stock_movements": [
+        IndexModel([("stockId", ASCENDING), ("createdAt", DESCENDING)], name="stockId_1_createdAt_-1"),
+        IndexModel([("compactionId", ASCENDING), ("createdAt", ASCENDING)], name="compactionId_1_createdAt_1"),
+        IndexModel([("stockId", ASCENDING), ("compacted", ASCENDING)], name="stockId_1_compacted_1"),
+    ],
+    "stock_snapshots": [
+        IndexModel([("stockId", ASCENDING), ("day", DESCENDING)], name="stockId_1_day_-1", unique=True),
+    ],
+    # Archives (src.models.archive) : lues seulement pour l'historique
+    "orders_archive": [
+        IndexModel([("orderNumber", ASCENDING)], name="orderNumber_1"),
+        IndexModel([("status", ASCENDING), ("orderDate", DESCENDING)], name="status_1_orderDate_-1"),
+        IndexModel([("orderDate", DESCENDING)], name="orderDate_-1"),
+    ],
+    "bills_archive": [
+        IndexModel([("billNumber", ASCENDING)], name="billNumber_1"),
+        IndexModel([("orderId", ASCENDING)], name="orderId_1"),
+        IndexModel([("paymentStatus", ASCENDING), ("billDate", DESCENDING)], name="paymentStatus_1_billDate_-1"),
+        IndexModel([("billDate", DESCENDING)], name="billDate_-1"),
+    ],
+}
+
+# Index créés par des versions précédentes, supprimés par --drop-redundant
+RETIRED_INDEXES = {
+    # Ne servait qu'à la recherche par regex, qui ne peut pas l'utiliser efficacement
+    "stock": ["description_1"],
+}
+
+# Options des collections créées explicitement (archives compressées sur disque)
+ARCHIVE_COMPRESSOR = os.getenv('ARCHIVE_COMPRESSOR', 'zstd')
+COLLECTION_OPTIONS = {
+    name: {"storageEngine": {"wiredTiger": {"configString": f"block_compressor={ARCHIVE_COMPRESSOR}"}}}
+    for name in ("orders_archive", "bills_archive")
+}
+
+# Champs d'index_information() d'un index ordinaire (sans option particulière)
+PLAIN_INDEX_FIELDS = {"v", "key", "ns", "background"}
+
+class QueryShape:
+    """Forme d'une requête émise par un service (filtre, tri, limite)"""
+
+    def __init__(self, name, collection, filter, sort=None, limit=0, allow_in_memory_sort=False,
+                 allow_collection_scan=None):
+        self.name = name
+        self.collection = collection
+        self.filter = filter
+        self.sort = sort or []
+        self.limit = limit
+        self.allow_in_memory_sort = allow_in_memory_sort
+        # Raison pour laquelle un parcours complet est accepté (None : interdit)
+        self.allow_collection_scan = allow_collection_scan
+
+# Requêtes des services, avec des valeurs représentatives
+QUERY_SHAPES = [
+    QueryShape("OrderService.get_order_by_number", "orders", {"orderNumber": "ORD-20240101000000-A1B2C3"}),
+    QueryShape("OrderService.get_all_orders(status)", "orders", {"status": "pending"}, [("orderDate", -1)], 50),
+    QueryShape("OrderService.get_all_orders", "orders", {}, [("orderDate", -1)], 1000),
+    QueryShape("BillService.get_bill_by_number", "bills", {"billNumber": "BILL-20240101000000-A1B2C3"}),
+    QueryShape("BillService.get_bills_by_order", "bills", {"orderId": ObjectId()}),
+    QueryShape("BillService.get_all_bills(paymentStatus)", "bills", {"paymentStatus": "paid"}, [("billDate", -1)], 50),
+    QueryShape("BillService.get_all_bills", "bills", {}, [("billDate", -1)], 1000),
+    QueryShape("DataArchiver.orders", "orders",
+               {"status": "completed", "orderDate": {"$lt": datetime(2024, 1, 1)}}, [("orderDate", 1)], 500),
+    QueryShape("DataArchiver.bills", "bills",
+               {"paymentStatus": {"$in": ["paid", "refunded"]}, "billDate": {"$lt": datetime(2024, 1, 1)}},
+               [("billDate", 1)], 500),
+    QueryShape("OrderService.get_all_orders(history)", "orders_archive", {}, [("orderDate", -1)], 50),
+    QueryShape("BillService.get_bills_by_order(history)", "bills_archive", {"orderId": ObjectId()}),
+    QueryShape("StockService.get_stock_by_product_id", "stock", {"productId": "ESP-001"}),
+    QueryShape("StockService.get_all_stock", "stock", {}, [("name", 1)], 20),
+    QueryShape("StockService.get_all_stock(category)", "stock", {"category": "coffee"}, [("name", 1)], 20),
+    QueryShape("StockService.get_all_stock(category, status)", "stock",
+               {"category": "coffee", "status": "available"}, [("name", 1)], 20),
+    QueryShape("StockService.get_all_stock(status)", "stock", {"status": "low_stock"}, [("name", 1)], 20),
+    QueryShape("StockService.get_all_stock(search)", "stock",
+               {"$or": [{"name": {"$regex": "esp", "$options": "i"}},
+                        {"description": {"$regex": "esp", "$options": "i"}}]},
+               [("name", 1)], 20, allow_in_memory_sort=True,
+               allow_collection_scan="recherche de sous-chaîne sans casse : aucun index ne la borne, "
+                                     "le catalogue d'un magasin est petit et servi par la réplique"),
+    QueryShape("StockService.get_low_stock_alerts", "stock",
+               {"status": {"$in": ["low_stock", "out_of_stock"]}}, [("quantity", 1)]),
+    QueryShape("StockService.get_prices", "stock", {"name": {"$in": ["Espresso", "Latte"]}}),
+    QueryShape("StockMovementService.get_movements", "stock_movements",
+               {"stockId": ObjectId()}, [("createdAt", -1)], 50),
+    QueryShape("StockMovementService._claim_batch", "stock_movements",
+               {"compactionId": None}, [("createdAt", 1)], 1000),
+    QueryShape("StockMovementService.get_snapshots", "stock_snapshots",
+               {"stockId": ObjectId()}, [("day", -1)], 30),
+]
+
+class IndexManager:
+    """Crée, nettoie et vérifie les index déclarés"""
+
+    def __init__(self, db=None):
+        self.db = db if db is not None else get_db()
+
+    def ensure_collections(self):
+        """Crée avec leurs options les collections qui en déclarent"""
+        existing = set(self.db.list_collection_names())
+        for collection_name, options in COLLECTION_OPTIONS.items():
+            if collection_name not in existing:
+                try:
+                    self.db.create_collection(collection_name, **options)
+                except CollectionInvalid:
+                    pass
+
+    def ensure_indexes(self):
+        """Crée les index déclarés"""
+        self.ensure_collections()
+        for collection_name, indexes in INDEX_SPECS.items():
+            collection = self.db[collection_name]
+            self._drop_conflicting(collection, indexes)
+            try:
+                collection.create_indexes(indexes)
+            except DuplicateKeyError:
+                # Données existantes en doublon : index par index, l'index unique en
+                # échec est créé sans contrainte et retenté au prochain démarrage
+                for index in indexes:
+                    try:
+                        collection.create_indexes([index])
+                    except DuplicateKeyError as e:
+                        name = index.document["name"]
+                        logger.error(f"Index unique {collection_name}.{name} impossible, doublons à corriger: {e}")
+                        collection.create_indexes(
+                            [IndexModel(list(index.document["key"].items()), name=name)]
+                        )
+        logger.info("Index déclarés créés")
+
+    def _drop_conflicting(self, collection, indexes):
+        """Supprime les index existants dont l'unicité diffère de leur déclaration"""
+        existing = collection.index_information()
+        for index in indexes:
+            name = index.document["name"]
+            if name in existing and existing[name].get("unique", False) != index.document.get("unique", False):
+                collection.drop_index(name)
+                logger.info(f"Index {collection.name}.{name} supprimé pour être recréé (unicité modifiée)")
+
+    def undeclared_indexes(self):
+        """Liste les index existants qui ne sont pas déclarés (collection, nom, description)"""
+        undeclared = []
+        for collection_name, indexes in INDEX_SPECS.items():
+            declared = {index.document["name"] for index in indexes} | {"_id_"}
+            for name, info in self.db[collection_name].index_information().items():
+                if name not in declared:
+                    undeclared.append((collection_name, name, info))
+        return undeclared
+
+    def redundant_indexes(self):
+        """Index retirés, et index non déclarés couverts par un index déclaré (préfixe de ses clés, sans option)"""
+        redundant = []
+        for collection_name, name, info in self.undeclared_indexes():
+            if name in RETIRED_INDEXES.get(collection_name, []):
+                redundant.append((collection_name, name))
+                continue
+            if set(info) - PLAIN_INDEX_FIELDS:
+                # Unicité, TTL, filtre partiel... : posé pour une raison, jamais supprimé
+                continue
+            keys = [tuple(key) for key in info["key"]]
+            if any(
+                list(index.document["key"].items())[:len(keys)] == keys
+                for index in INDEX_SPECS[collection_name]
+            ):
+                redundant.append((collection_name, name))
+        return redundant
+
+    def drop_redundant_indexes(self):
+        """Supprime les index non déclarés couverts par un index déclaré"""
+        redundant = self.redundant_indexes()
+        for collection_name, name in redundant:
+            self.db[collection_name].drop_index(name)
+            logger.info(f"Index redondant supprimé: {collection_name}.{name}")
+        return redundant
+
+    def missing_indexes(self):
+        """Liste les index déclarés absents de la base"""
+        missing = []
+        for collection_name, indexes in INDEX_SPECS.items():
+            existing = self.db[collection_name].index_information()
+            missing.extend(
+                (collection_name, index.document["name"])
+                for index in indexes if index.document["name"] not in existing
+            )
+        return missing
+
+    def check(self):
+        """Vérifie les index déclarés et exécute explain() sur chaque forme de requête
+
+        Retourne la liste des problèmes (nom, description).
+        """
+        failures = [(f"{collection_name}.{name}", "index absent") for collection_name, name in self.missing_indexes()]
+        collections = set(self.db.list_collection_names())
+        for shape in QUERY_SHAPES:
+            if shape.collection not in collections:
+                failures.append((shape.name, f"collection {shape.collection} absente, plan non vérifiable"))
+                continue
+            cursor = self.db[shape.collection].find(shape.filter)
+            if shape.sort:
+                cursor = cursor.sort(shape.sort)
+            if shape.limit:
+                cursor = cursor.limit(shape.limit)
+            stages = plan_stages(cursor.explain())
+
+            if "COLLSCAN" in stages and not shape.allow_collection_scan:
+                failures.append((shape.name, "COLLSCAN"))
+            if "SORT" in stages and not shape.allow_in_memory_sort:
+                failures.append((shape.name, "SORT en mémoire"))
+        return failures
+
+def plan_stages(explain):
+    """Liste les étapes du plan gagnant d'un explain()"""
+    planner = explain.get("queryPlanner", {})
+    plan = planner.get("winningPlan", {})
+    # Moteur SBE (MongoDB >= 7) : le plan classique est sous queryPlan
+    plan = plan.get("queryPlan", plan)
+
+    stages = []
+    pending = [plan]
+    while pending:
+        stage = pending.pop()
+        if not stage:
+            continue
+        stages.append(stage.get("stage"))
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+        pending.extend(stage.get("inputStages", []))
+    return stages
+
+def main(argv=None):
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Gestion et vérification des index MongoDB")
+    parser.add_argument("--apply", action="store_true", help="Crée les index déclarés")
+    parser.add_argument("--drop-redundant", action="store_true", help="Supprime les index non déclarés")
+    parser.add_argument("--check", action="store_true", help="Vérifie les plans d'exécution (échoue sur COLLSCAN/SORT)")
+    parser.add_argument("--store", action="append", dest="stores",
+                        help="Magasin traité (répétable ; tous par défaut)")
+    args = parser.parse_args(argv)
+
+    status = 0
+    for store_id in args.stores or db_config.store_ids():
+        with use_store(store_id):
+            manager = IndexManager()
+            if args.apply:
+                manager.ensure_indexes()
+            redundant = manager.drop_redundant_indexes() if args.drop_redundant else manager.redundant_indexes()
+            for collection_name, name, _ in manager.undeclared_indexes():
+                if (collection_name, name) in redundant and not args.drop_redundant:
+                    print(f"[{store_id}] Index redondant: {collection_name}.{name}")
+                elif (collection_name, name) not in redundant:
+                    print(f"[{store_id}] Index non déclaré (conservé): {collection_name}.{name}")
+
+            if args.check:
+                failures = manager.check()
+                for shape_name, problem in failures:
+                    print(f"[{store_id}] ÉCHEC {shape_name}: {problem}")
+                if failures:
+                    status = 1
+                else:
+                    print(f"[{store_id}] {len(QUERY_SHAPES)} requêtes vérifiées, aucun COLLSCAN ni tri en mémoire")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Journalisation asynchrone et structurée de l'API Coffee Shop
+
+Les threads de requête ne font que déposer l'enregistrement dans une file
+bornée (QueueHandler) : le formatage du message et l'écriture sur stderr ou
+dans LOG_FILE sont faits par un thread d'écriture (QueueListener). Si la
+file est pleine, l'enregistrement est abandonné et compté plutôt que de
+bloquer la requête.
+
+- LOG_FORMAT : 'json' (défaut, un objet par ligne) ou 'text',
+- LOG_LEVEL : niveau racine (INFO par défaut),
+- LOG_INFO_SAMPLE_RATE : proportion des requêtes dont les logs INFO et
+  DEBUG sont conservés (1 par défaut) ; WARNING et au-delà le sont toujours,
+- chaque enregistrement porte le requestId de la requête (en-tête
+  X-Request-Id repris ou généré, renvoyé dans la réponse).
+"""
+import os
+import sys
+import json
+import uuid
+import queue
+import random
+import zlib
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from flask import g, request, has_request_context
+
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.getenv('LOG_FILE', '')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_INFO_SAMPLE_RATE = float(os.getenv('LOG_INFO_SAMPLE_RATE', '1'))
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+
+class JsonFormatter(logging.Formatter):
+    """Un objet JSON par enregistrement"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'requestId': getattr(record, 'request_id', None),
+            'pid': record.process,
+            'thread': record.threadName
+        }
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RequestContextFilter(logging.Filter):
+    """Ajoute le requestId et échantillonne les logs INFO/DEBUG par requête"""
+
+    def __init__(self, sample_rate=LOG_INFO_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        request_id = g.get('request_id') if has_request_context() else None
+        record.request_id = request_id
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1:
+            return True
+        # Même décision pour tous les logs d'une requête
+        if request_id is not None:
+            return zlib.crc32(request_id.encode()) % 10000 < self.sample_rate * 10000
+        return random.random() < self.sample_rate
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui ne formate pas et ne bloque jamais le thread appelant"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Le message reste à formater (msg + args) ; seule la trace d'exception,
+        # liée aux frames en cours, est figée maintenant
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LoggingPipeline:
+    """File de journalisation et thread d'écriture du processus"""
+
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+        self.output = None
+
+    def _create_output(self):
+        output = logging.FileHandler(LOG_FILE) if LOG_FILE else logging.StreamHandler(sys.stderr)
+        if LOG_FORMAT == 'json':
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter(
+                '%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s'
+            ))
+        return output
+
+    def configure(self):
+        """Remplace les handlers racine par la file asynchrone"""
+        if self.handler is not None:
+            return
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.setLevel(LOG_LEVEL)
+
+        self.output = self._create_output()
+        self.handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        self.handler.addFilter(RequestContextFilter())
+        root.addHandler(self.handler)
+        self._start_listener()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset_after_fork)
+
+    def _start_listener(self):
+        self.listener = logging.handlers.QueueListener(self.handler.queue, self.output, respect_handler_level=True)
+        self.listener.start()
+
+    def reset_after_fork(self):
+        """Le thread d'écriture ne survit pas au fork : nouvelle file et nouveau thread"""
+        if self.handler is None:
+            return
+        self.handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler.dropped = 0
+        self._start_listener()
+
+    def stop(self):
+        """Vide la file et arrête le thread d'écriture"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def get_status(self):
+        if self.handler is None:
+            return {'async': False}
+        return {
+            'async': True,
+            'format': LOG_FORMAT,
+            'queued': self.handler.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'infoSampleRate': LOG_INFO_SAMPLE_RATE
+        }
+
+logging_pipeline = LoggingPipeline()
+
+def _assign_request_id():
+    g.request_id = request.headers.get(REQUEST_ID_HEADER, '')[:128] or uuid.uuid4().hex
+
+def _return_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+def init_logging(app):
+    """Journalisation asynchrone et corrélation des requêtes"""
+    logging_pipeline.configure()
+    app.before_request(_assign_request_id)
+    app.after_request(_return_request_id)
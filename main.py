@@ -1,21 +1,38 @@
 import os
 import sys
+import time
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory, jsonify
+from flask import Flask, jsonify
 from flask_cors import CORS
-from src.config.database import db_config, init_collections
-from src.routes.orders import orders_bp
+from src.config.database import db_config, init_collections, init_collections_in_background
+from src.config.cache import get_cache_stats
+from src.routes.orders import orders_bp, order_schema
 from src.routes.bills import bills_bp
-from src.routes.stock import stock_bp
+from src.routes.stock import stock_bp, stock_catalog, ledger_compactor
+from src.routes.reports import reports_bp
+from src.models.archive import ArchiveScheduler
+from src.models.write_behind import order_status_writer
+from src.models.offline_queue import offline_queue, offline_replicator
+from src.middleware.metrics import init_metrics
+from src.middleware.admission import init_admission, admission_controller
+from src.middleware.profiling import init_profiling
+from src.middleware.health import init_health, health_prober
+from src.middleware.static_assets import StaticManifest
+from src.middleware.logging_pipeline import init_logging, logging_pipeline
+from src.middleware.stores import init_stores
 import logging
+import threading
 
-# Configuration du logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Instant de démarrage du processus, pour mesurer le délai avant la première requête
+PROCESS_START = time.monotonic()
+startup_metrics = {
+    'initializedAfterSeconds': None,
+    'timeToFirstRequestSeconds': None
+}
+
+# Handlers racine posés par init_logging (logging_pipeline)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
@@ -24,33 +41,36 @@ app.config['SECRET_KEY'] = 'coffee_shop_secret_key_2024'
 # Configuration CORS pour permettre les requêtes cross-origin
 CORS(app, origins="*")
 
+# Journalisation asynchrone en JSON, corrélée par X-Request-Id
+init_logging(app)
+# Magasin de la requête (X-Store-Id ou ?storeId) : base et pool de ce magasin
+init_stores(app)
+
 # Enregistrement des blueprints
 app.register_blueprint(orders_bp)
 app.register_blueprint(bills_bp)
 app.register_blueprint(stock_bp)
+app.register_blueprint(reports_bp)
 
-# Route de santé pour vérifier que l'API fonctionne
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Endpoint de vérification de santé de l'API"""
-    try:
-        # Tester la connexion à MongoDB
-        db = db_config.get_database()
-        db.command('ping')
-        
-        return jsonify({
-            'success': True,
-            'message': 'API Coffee Shop opérationnelle',
-            'database': 'MongoDB connecté',
-            'version': '1.0.0'
-        }), 200
-    except Exception as e:
-        logger.error(f"Erreur de santé de l'API: {e}")
-        return jsonify({
-            'success': False,
-            'message': 'Problème de connexion à la base de données',
-            'error': str(e)
-        }), 500
+# Métriques Prometheus (/api/metrics)
+init_metrics(app)
+# Contrôle d'admission : priorité aux commandes et paiements, délestage en 503
+init_admission(app)
+# Profilage à la demande (en-tête X-Profile) et requêtes lentes
+init_profiling(app)
+# Santé servie depuis la mémoire (/api/health, /api/live, /api/ready)
+init_health(app)
+health_prober.add_component('stockCatalog', lambda: stock_catalog.get_status())
+health_prober.add_component('entityCache', get_cache_stats)
+health_prober.add_component('orderStatusWriter', order_status_writer.get_status)
+health_prober.add_component('offlineQueue', offline_queue.get_status)
+
+@app.before_request
+def record_first_request():
+    """Mesure le délai entre le démarrage du processus et la première requête"""
+    if startup_metrics['timeToFirstRequestSeconds'] is None:
+        startup_metrics['timeToFirstRequestSeconds'] = round(time.monotonic() - PROCESS_START, 3)
+        logger.info(f"Première requête servie {startup_metrics['timeToFirstRequestSeconds']}s après le démarrage")
 
 # Route pour obtenir les informations de l'API
 @app.route('/api/info', methods=['GET'])
@@ -64,15 +84,28 @@ def api_info():
             'orders': '/api/orders',
             'bills': '/api/bills',
             'stock': '/api/stock',
-            'health': '/api/health'
+            'reports': '/api/reports/stores',
+            'health': '/api/health',
+            'live': '/api/live',
+            'ready': '/api/ready',
+            'metrics': '/api/metrics'
         },
         'features': [
             'Gestion des commandes',
             'Gestion des additions',
             'Gestion du stock',
             'Validation des données',
-            'Alertes de stock'
-        ]
+            'Alertes de stock',
+            'Multi-magasins'
+        ],
+        'startup': startup_metrics,
+        'stores': db_config.store_ids(),
+        'cache': get_cache_stats(),
+        'admission': admission_controller.get_status(),
+        'static': static_manifest.get_status(),
+        'logging': logging_pipeline.get_status(),
+        'orderStatusWriter': order_status_writer.get_status(),
+        'offlineQueue': offline_queue.get_status()
     }), 200
 
 # Gestionnaire d'erreurs global
@@ -94,51 +127,115 @@ def internal_error(error):
         'error': 'Erreur interne du serveur'
     }), 500
 
+# Manifeste des fichiers du frontend, construit une fois (partagé par fork)
+static_manifest = StaticManifest(app.static_folder).build()
+
 # Routes pour servir le frontend (SPA)
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    """Sert les fichiers statiques du frontend"""
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
+    """Sert les fichiers statiques du frontend depuis le manifeste en mémoire"""
+    if app.static_folder is None:
         return jsonify({
             'success': False,
             'error': 'Dossier statique non configuré'
         }), 404
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Frontend non déployé',
-                'info': 'Utilisez les endpoints API: /api/health, /api/info'
-            }), 404
-
-def initialize_app():
-    """Initialise l'application et la base de données"""
+    response = static_manifest.response(path)
+    if response is None:
+        return jsonify({
+            'success': False,
+            'message': 'Frontend non déployé',
+            'info': 'Utilisez les endpoints API: /api/health, /api/info'
+        }), 404
+    return response
+
+# Archivage périodique des données froides
+archive_scheduler = ArchiveScheduler()
+
+def warm_up():
+    """Prépare le processus avant d'accepter du trafic (pool, catalogue, schémas)"""
+    # Connexion à MongoDB : ouvre le pool (minPoolSize est complété en arrière-plan)
+    if not db_config.connect():
+        logger.error("Échec de connexion à MongoDB")
+        return False
+    # Charger la réplique en mémoire du catalogue de stock
+    stock_catalog.start()
+    # Premier passage dans le schéma de commande (compilation paresseuse de marshmallow)
+    order_schema.validate({'customerName': 'warmup', 'items': [{'productName': 'warmup', 'quantity': 1}]})
+    return True
+
+# Processus dans lequel initialize_app a déjà tourné (un worker forké refait la sienne)
+_initialized_pid = None
+_initialize_lock = threading.Lock()
+
+def initialize_app(warmup=None):
+    """Initialise l'application et la base de données, une seule fois par processus
+    
+    INIT_INDEXES : 'background' (défaut), 'startup' ou 'skip' (index créés
+    à l'étape de déploiement : python -m src.config.database).
+    APP_WARMUP : 'true' pour préparer pool, caches et schémas avant de
+    rendre la main ; sinon le catalogue est chargé en arrière-plan.
+    
+    Retourne False si le processus était déjà initialisé (aucun thread relancé).
+    """
+    global _initialized_pid
+    with _initialize_lock:
+        if _initialized_pid == os.getpid():
+            logger.info("Application déjà initialisée dans ce processus")
+            return False
+        _initialized_pid = os.getpid()
+    
+    if warmup is None:
+        warmup = os.getenv('APP_WARMUP', 'false').lower() == 'true'
+    # Sonde de santé du worker : démarrée d'abord, pour signaler aussi une
+    # initialisation en échec
+    health_prober.start()
     try:
-        # Connexion à MongoDB
-        if db_config.connect():
-            logger.info("Connexion à MongoDB réussie")
-            # Initialiser les collections et index
+        index_mode = os.getenv('INIT_INDEXES', 'background')
+        if index_mode == 'startup':
             init_collections()
             logger.info("Collections MongoDB initialisées")
+        elif index_mode == 'background':
+            init_collections_in_background()
+        
+        if warmup:
+            warm_up()
         else:
-            logger.error("Échec de connexion à MongoDB")
+            threading.Thread(target=stock_catalog.start, name='stock-catalog-start', daemon=True).start()
             
     except Exception as e:
         logger.error(f"Erreur lors de l'initialisation: {e}")
+    
+    # Tâches de fond démarrées même si l'initialisation a échoué (MongoDB indisponible)
+    try:
+        # Compaction périodique du journal des mouvements de stock
+        ledger_compactor.start()
+        # Archivage des commandes et additions clôturées (ARCHIVE_ENABLED=true)
+        if os.getenv('ARCHIVE_ENABLED', 'false').lower() == 'true':
+            archive_scheduler.start()
+        # Écriture différée des statuts (ORDER_STATUS_WRITE_BEHIND=true)
+        order_status_writer.start()
+        # Réplication de la file locale hors ligne (OFFLINE_QUEUE_ENABLED=true)
+        offline_replicator.start()
+    except Exception as e:
+        logger.error(f"Erreur lors du démarrage des tâches de fond: {e}")
+    
+    startup_metrics['initializedAfterSeconds'] = round(time.monotonic() - PROCESS_START, 3)
+    logger.info(f"Application initialisée en {startup_metrics['initializedAfterSeconds']}s")
+    return True
+
+def get_app(warmup=None):
+    """Application du module, initialisée au premier appel dans le processus
+    (point d'entrée des serveurs WSGI : src.main:get_app())"""
+    initialize_app(warmup=warmup)
+    return app
 
 if __name__ == '__main__':
     # Initialiser l'application
     initialize_app()
     
-    # Démarrer le serveur
-    logger.info("Démarrage du serveur Coffee Shop API...")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Démarrer le serveur de développement (production : python -m src.server)
+    logger.info("Démarrage du serveur Coffee Shop API (développement)...")
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG', 'true').lower() == 'true')
 
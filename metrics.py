@@ -0,0 +1,146 @@
+"""
+Métriques Prometheus de l'API Coffee Shop
+
+- latence des requêtes par blueprint et par route (histogramme),
+- requêtes en cours,
+- nombre et latence des commandes MongoDB par collection et par opération
+  (CommandListener pymongo),
+- utilisation du pool de connexions.
+
+Exposées au format texte Prometheus sur /api/metrics. Sous Gunicorn,
+définir PROMETHEUS_MULTIPROC_DIR pour agréger les workers.
+"""
+import os
+import time
+import threading
+from flask import request, g, Response
+from pymongo import monitoring
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+)
+from prometheus_client import multiprocess
+from src.config.database import db_config
+
+REQUEST_LATENCY = Histogram(
+    'coffeeshop_http_request_duration_seconds',
+    'Latence des requêtes HTTP',
+    ['blueprint', 'route', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'coffeeshop_http_requests_in_flight',
+    'Requêtes HTTP en cours de traitement',
+    multiprocess_mode='livesum'
+)
+MONGO_COMMANDS = Counter(
+    'coffeeshop_mongo_commands_total',
+    'Commandes MongoDB émises',
+    ['collection', 'command', 'outcome']
+)
+MONGO_LATENCY = Histogram(
+    'coffeeshop_mongo_command_duration_seconds',
+    'Latence des commandes MongoDB',
+    ['collection', 'command'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    'coffeeshop_mongo_pool_checked_out_connections',
+    'Connexions MongoDB empruntées au pool',
+    multiprocess_mode='livesum'
+)
+MONGO_POOL_OPEN = Gauge(
+    'coffeeshop_mongo_pool_open_connections',
+    'Connexions MongoDB ouvertes',
+    multiprocess_mode='livesum'
+)
+MONGO_POOL_WAITING = Gauge(
+    'coffeeshop_mongo_pool_waiting_requests',
+    'Demandes en attente d\'une connexion MongoDB',
+    multiprocess_mode='livesum'
+)
+
+# Commandes dont le premier champ n'est pas un nom de collection
+_NO_COLLECTION = {'ping', 'hello', 'isMaster', 'ismaster', 'endSessions', 'killCursors', 'buildInfo'}
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Compte et chronomètre les commandes MongoDB par collection et opération"""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection', '')
+        elif event.command_name in _NO_COLLECTION:
+            collection = ''
+        else:
+            collection = event.command.get(event.command_name, '')
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = (
+                collection if isinstance(collection, str) else ''
+            )
+
+    def _finish(self, event, outcome):
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), '')
+        MONGO_COMMANDS.labels(collection, event.command_name, outcome).inc()
+        MONGO_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, 'success')
+
+    def failed(self, event):
+        self._finish(event, 'failure')
+
+def _route_labels():
+    rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    return request.blueprint or 'app', rule
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_in_flight = True
+    REQUESTS_IN_FLIGHT.inc()
+
+def _after_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        blueprint, rule = _route_labels()
+        REQUEST_LATENCY.labels(blueprint, rule, request.method, str(response.status_code)).observe(
+            time.perf_counter() - start
+        )
+    _update_pool_gauges()
+    return response
+
+def _teardown_request(exc):
+    if g.pop('metrics_in_flight', False):
+        REQUESTS_IN_FLIGHT.dec()
+
+def _update_pool_gauges():
+    stats = db_config.get_pool_stats()
+    MONGO_POOL_CHECKED_OUT.set(stats['checkedOut'])
+    MONGO_POOL_OPEN.set(stats['open'])
+    MONGO_POOL_WAITING.set(max(stats['waiting'], 0))
+
+def metrics_endpoint():
+    """Expose les métriques au format texte Prometheus"""
+    _update_pool_gauges()
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+def init_metrics(app):
+    """Instrumente l'application Flask et le client MongoDB"""
+    db_config.add_event_listener(MongoCommandMetrics())
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/api/metrics', 'metrics', metrics_endpoint, methods=['GET'])
+
+def mark_worker_dead(pid):
+    """Nettoie les fichiers de métriques d'un worker arrêté (mode multi-processus)"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
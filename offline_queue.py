@@ -0,0 +1,571 @@
+"""
+File d'écriture locale pour la prise de commande hors ligne
+
+Avec OFFLINE_QUEUE_ENABLED=true, les écritures de la caisse (création et
+suppression de commande, ventes au journal de stock, changement de statut,
+création, remise, paiement et suppression d'addition) sont tentées sur MongoDB avec un délai court (OFFLINE_WRITE_TIMEOUT_MS). Si le primaire
+est injoignable ou trop lent, l'opération est enregistrée dans une base
+SQLite locale (OFFLINE_QUEUE_PATH, partagée par les workers de la machine)
+et la requête réussit quand même. Le magasin est alors considéré hors ligne
+pendant OFFLINE_RETRY_SECONDS : les écritures suivantes vont directement
+dans la file, sans attendre un nouveau délai.
+
+Ordre : tant qu'un magasin a des opérations en file, toutes ses nouvelles
+écritures y passent aussi, pour que MongoDB les reçoive dans l'ordre où la
+caisse les a faites (un paiement après la création de son addition).
+L'état de la file est gardé en mémoire par magasin et relu au plus toutes
+les OFFLINE_PENDING_CHECK_SECONDS : une opération mise en file par un autre
+worker peut donc ne pas être vue pendant ce délai.
+
+Réplication : un thread par worker vide la file toutes les
+OFFLINE_REPLAY_SECONDS, dans l'ordre, sous un verrou de fichier (un seul
+worker à la fois ; le verrou repose sur fcntl, le module suppose donc un
+système POSIX, et ailleurs un seul processus doit utiliser la file). Les
+insertions portent leur _id (doublon = déjà écrit), les mises à jour sont
+des $set et les suppressions portent leur condition (statut encore
+« pending ») : rejouer une opération est sans effet.
+Une opération refusée par MongoDB (hors indisponibilité) est mise de côté
+(état 'failed') pour ne pas bloquer les suivantes.
+
+Lectures : les commandes et additions encore en file sont lues depuis la
+file locale, et les mises à jour et suppressions en file sont appliquées aux
+documents lus dans MongoDB. Les lectures qui précèdent une écriture
+(read()) ont le même délai court ; hors ligne, elles se rabattent sur la
+dernière copie en cache.
+
+Prix : chaque lecture réussie du catalogue met à jour un relevé local des
+prix (table `prices`). Hors ligne, la prise de commande utilise ce relevé au
+lieu d'interroger MongoDB. Limite : un produit dont le prix n'a jamais été
+lu sur cette machine avant la coupure est refusé (erreur explicite).
+
+Échecs : une insertion en doublon sur le numéro (et non sur l'_id) est
+rejouée avec un nouveau numéro. Si une insertion est refusée, les
+opérations suivantes qui en dépendent (mises à jour de l'entité, additions
+et ventes de la commande) sont mises de côté avec elle ; les derniers échecs sont
+listés dans get_status().
+"""
+import os
+import time
+import secrets
+import sqlite3
+import threading
+import logging
+import bson
+from bson import ObjectId
+import pymongo
+from pymongo.errors import PyMongoError, ConnectionFailure, DuplicateKeyError
+from prometheus_client import Counter
+from src.config.database import current_store, use_store, get_db
+from src.config.cache import order_cache, bill_cache
+
+try:
+    import fcntl
+except ImportError:
+    # Hors POSIX : pas de verrou entre processus, un seul worker doit utiliser la file
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+OFFLINE_QUEUE_ENABLED = os.getenv('OFFLINE_QUEUE_ENABLED', 'false').lower() == 'true'
+# Doit survivre à un redémarrage de la machine (pas de tmpfs)
+OFFLINE_QUEUE_PATH = os.getenv('OFFLINE_QUEUE_PATH', '/var/lib/coffeeshop/journal/offline-queue.sqlite3')
+OFFLINE_WRITE_TIMEOUT_MS = float(os.getenv('OFFLINE_WRITE_TIMEOUT_MS', '500'))
+OFFLINE_RETRY_SECONDS = float(os.getenv('OFFLINE_RETRY_SECONDS', '5'))
+OFFLINE_REPLAY_SECONDS = float(os.getenv('OFFLINE_REPLAY_SECONDS', '1'))
+OFFLINE_REPLAY_BATCH_SIZE = int(os.getenv('OFFLINE_REPLAY_BATCH_SIZE', '200'))
+# Durée pendant laquelle has_pending() se fie à son dernier relevé de la file
+OFFLINE_PENDING_CHECK_SECONDS = float(os.getenv('OFFLINE_PENDING_CHECK_SECONDS', '1'))
+
+# Caches d'entités à invalider quand une opération est rejouée
+ENTITY_CACHES = {'orders': order_cache, 'bills': bill_cache}
+# Champ du numéro unique par magasin de chaque collection
+NUMBER_FIELDS = {'orders': 'orderNumber', 'bills': 'billNumber'}
+# Tentatives de renumérotation d'une insertion en doublon
+RENUMBER_ATTEMPTS = 5
+
+OFFLINE_WRITES = Counter(
+    'coffeeshop_offline_writes_total',
+    'Écritures mises en file locale et rejouées vers MongoDB',
+    ['collection', 'result']
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    store TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    number TEXT,
+    document BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS operations_state_store_seq ON operations (state, store, seq);
+CREATE INDEX IF NOT EXISTS operations_entity ON operations (collection, entity_id);
+CREATE INDEX IF NOT EXISTS operations_number ON operations (collection, number);
+CREATE TABLE IF NOT EXISTS prices (
+    store TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price REAL,
+    status TEXT,
+    updated_at REAL NOT NULL,
+    stock_id TEXT,
+    product_id TEXT,
+    PRIMARY KEY (store, name)
+);
+"""
+# Colonnes ajoutées après coup à une table existante : (table, colonne, type)
+SCHEMA_COLUMNS = [('prices', 'stock_id', 'TEXT'), ('prices', 'product_id', 'TEXT')]
+
+def is_unavailable(error):
+    """Erreur due à un primaire injoignable ou trop lent (et non à l'écriture elle-même)"""
+    return isinstance(error, ConnectionFailure) or getattr(error, 'timeout', False)
+
+def renumber(number):
+    """Même préfixe et horodatage, nouveau suffixe aléatoire (ORD-20240101120000-A1B2C3)"""
+    return f"{'-'.join(number.split('-')[:2])}-{secrets.token_hex(3).upper()}"
+
+class OfflineWriteQueue:
+    """File SQLite des écritures en attente de MongoDB"""
+
+    def __init__(self, path=OFFLINE_QUEUE_PATH, enabled=OFFLINE_QUEUE_ENABLED,
+                 write_timeout_ms=OFFLINE_WRITE_TIMEOUT_MS, retry_seconds=OFFLINE_RETRY_SECONDS,
+                 pending_check_seconds=OFFLINE_PENDING_CHECK_SECONDS):
+        self.path = path
+        self.enabled = enabled
+        self.write_timeout = write_timeout_ms / 1000
+        self.retry_seconds = retry_seconds
+        self.pending_check_seconds = pending_check_seconds
+        self.db = get_db()
+        # Magasin -> instant jusqu'auquel les écritures vont directement en file
+        self._offline_until = {}
+        # Magasin -> (opérations en attente, instant du relevé)
+        self._pending = {}
+        # Dernier relevé de prix écrit par ce processus : (magasin, nom) -> (prix, statut)
+        self._prices = {}
+        self._local = threading.local()
+        self.stats = {'queued': 0, 'replayed': 0, 'failed': 0, 'renumbered': 0, 'offlinePrices': 0}
+
+    # --- Base locale ---
+
+    def _connection(self):
+        # Une connexion par thread et par processus (sqlite3 ne survit pas au fork)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Une opération acquittée doit survivre à une coupure de courant
+            connection.execute('PRAGMA synchronous=FULL')
+            connection.executescript(SCHEMA)
+            self._migrate(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _migrate(self, connection):
+        """Ajoute aux fichiers existants les colonnes apparues depuis leur création"""
+        for table, column, column_type in SCHEMA_COLUMNS:
+            columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+            if column in columns:
+                continue
+            try:
+                connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            except sqlite3.OperationalError as e:
+                # Un autre worker vient d'ajouter la colonne
+                if 'duplicate column' not in str(e):
+                    raise
+
+    def has_pending(self, store_id=None):
+        """Indique si le magasin a des opérations en attente de réplication
+
+        Appelée à chaque lecture et écriture : la base locale n'est relue
+        qu'après pending_check_seconds (opérations mises en file par un autre
+        worker, ou rejouées).
+        """
+        if not self.enabled:
+            return False
+        store_id = store_id or current_store()
+        now = time.monotonic()
+        pending, checked_at = self._pending.get(store_id, (False, None))
+        if checked_at is not None and now - checked_at < self.pending_check_seconds:
+            return pending
+        pending = self._connection().execute(
+            "SELECT 1 FROM operations WHERE state = 'pending' AND store = ? LIMIT 1",
+            (store_id,)
+        ).fetchone() is not None
+        self._pending[store_id] = (pending, now)
+        return pending
+
+    def enqueue(self, collection, kind, entity_id, document, number=None):
+        """Enregistre une opération pour le magasin courant
+
+        kind : 'insert' (document complet), 'update' ($set) ou 'delete'
+        (document = condition de la suppression, en plus de l'_id).
+        """
+        store_id = current_store()
+        self._connection().execute(
+            "INSERT INTO operations (store, collection, kind, entity_id, number, document, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (store_id, collection, kind, str(entity_id), number, bson.encode(document), time.time())
+        )
+        self._pending[store_id] = (True, time.monotonic())
+        self.stats['queued'] += 1
+        OFFLINE_WRITES.labels(collection, 'queued').inc()
+
+    # --- Écritures ---
+
+    def is_offline(self, store_id=None):
+        return time.monotonic() < self._offline_until.get(store_id or current_store(), 0)
+
+    def _mark_offline(self, store_id, error, fallback):
+        self._offline_until[store_id] = time.monotonic() + self.retry_seconds
+        logger.warning(f"MongoDB indisponible pour le magasin {store_id}, {fallback}: {error}")
+
+    def read(self, online, offline):
+        """Lecture préalable à une écriture : online() avec le délai court, ou offline() hors ligne"""
+        if not self.enabled:
+            return online()
+        store_id = current_store()
+        if not self.is_offline(store_id):
+            try:
+                with pymongo.timeout(self.write_timeout):
+                    return online()
+            except PyMongoError as e:
+                if not is_unavailable(e):
+                    raise
+                self._mark_offline(store_id, e, "lectures servies par la file locale et le cache")
+        return offline()
+
+    def execute(self, collection, kind, entity_id, document, online, number=None):
+        """Exécute online() sur MongoDB, ou met l'opération en file si le primaire est indisponible
+
+        Retourne le résultat de online(), ou None si l'opération a été mise en file.
+        """
+        if not self.enabled:
+            return online()
+        store_id = current_store()
+        if not self.is_offline(store_id) and not self.has_pending(store_id):
+            try:
+                with pymongo.timeout(self.write_timeout):
+                    return online()
+            except PyMongoError as e:
+                if not is_unavailable(e):
+                    raise
+                self._mark_offline(store_id, e, "écritures mises en file locale")
+        self.enqueue(collection, kind, entity_id, document, number)
+        return None
+
+    # --- Prix ---
+
+    def read_prices(self, names, online):
+        """Prix du catalogue via online(), ou dernier relevé local si le magasin est hors ligne"""
+        if not self.enabled:
+            return online()
+        store_id = current_store()
+        if not self.is_offline(store_id):
+            try:
+                with pymongo.timeout(self.write_timeout):
+                    prices = online()
+            except PyMongoError as e:
+                if not is_unavailable(e):
+                    raise
+                self._mark_offline(store_id, e, "prix lus dans le relevé local")
+            else:
+                self._remember_prices(store_id, prices)
+                return prices
+        return self.known_prices(names, store_id)
+
+    def _remember_prices(self, store_id, prices):
+        # Seuls les prix qui ont changé depuis le dernier relevé sont écrits
+        changed = []
+        for name, data in prices.items():
+            stock_id = str(data['_id']) if data.get('_id') is not None else None
+            values = (data.get('price', 0), data.get('status'), stock_id, data.get('productId'))
+            if self._prices.get((store_id, name)) != values:
+                changed.append((store_id, name, *values, time.time()))
+        if not changed:
+            return
+        self._connection().executemany(
+            "INSERT OR REPLACE INTO prices (store, name, price, status, stock_id, product_id, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            changed
+        )
+        for store, name, *values, _ in changed:
+            self._prices[(store, name)] = tuple(values)
+
+    def known_prices(self, names, store_id=None):
+        """Prix relevés localement ; ValueError si un produit n'a jamais été relevé"""
+        store_id = store_id or current_store()
+        names = list(names)
+        rows = self._connection().execute(
+            f"SELECT name, price, status, stock_id, product_id FROM prices "
+            f"WHERE store = ? AND name IN ({','.join('?' * len(names))})",
+            [store_id, *names]
+        ).fetchall()
+        prices = {
+            name: {'_id': ObjectId(stock_id) if stock_id else None, 'name': name, 'price': price,
+                   'status': status, 'productId': product_id}
+            for name, price, status, stock_id, product_id in rows
+        }
+        missing = sorted(set(names) - set(prices))
+        if missing:
+            raise ValueError(f"Prix inconnus hors ligne (jamais relevés sur cette caisse): {', '.join(missing)}")
+        self.stats['offlinePrices'] += 1
+        return prices
+
+    # --- Lectures ---
+
+    def _apply_pending(self, collection, document):
+        """Document avec les mises à jour en file appliquées ; None si sa suppression est en file"""
+        rows = self._connection().execute(
+            "SELECT kind, document FROM operations WHERE state = 'pending' AND store = ? AND collection = ? "
+            "AND kind IN ('update', 'delete') AND entity_id = ? ORDER BY seq",
+            (current_store(), collection, str(document['_id']))
+        ).fetchall()
+        if not rows:
+            return document
+        document = dict(document)
+        for kind, change in rows:
+            if kind == 'delete':
+                return None
+            document.update(bson.decode(change))
+        return document
+
+    def find(self, collection, entity_id=None, number=None):
+        """Document créé hors ligne et pas encore répliqué (par ID ou par numéro), ou None"""
+        if not self.has_pending():
+            return None
+        column, value = ('entity_id', str(entity_id)) if entity_id is not None else ('number', number)
+        row = self._connection().execute(
+            f"SELECT document FROM operations WHERE state = 'pending' AND store = ? AND collection = ? "
+            f"AND kind = 'insert' AND {column} = ? ORDER BY seq LIMIT 1",
+            (current_store(), collection, value)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._apply_pending(collection, bson.decode(row[0]))
+
+    def overlay(self, collection, data):
+        """Applique à un document lu dans MongoDB les mises à jour et suppressions encore en file"""
+        if data is None or not self.has_pending():
+            return data
+        return self._apply_pending(collection, data)
+
+    def pending_documents(self, collection):
+        """Documents créés hors ligne et pas encore répliqués, mises à jour en file appliquées"""
+        rows = self._connection().execute(
+            "SELECT document FROM operations WHERE state = 'pending' AND store = ? AND collection = ? "
+            "AND kind = 'insert' ORDER BY seq",
+            (current_store(), collection)
+        ).fetchall()
+        documents = (self._apply_pending(collection, bson.decode(row[0])) for row in rows)
+        return [document for document in documents if document is not None]
+
+    def merge_pending(self, collection, documents, query, date_field, limit=None):
+        """Complète une liste lue dans MongoDB (triée par date desc) avec l'état de la file
+
+        `query` est le filtre d'égalité de la requête MongoDB : il est réappliqué
+        après les mises à jour en file et aux documents créés hors ligne.
+        """
+        if not self.has_pending():
+            return documents
+        matches = lambda data: data is not None and all(data.get(field) == value for field, value in query.items())
+        documents = [data for data in (self.overlay(collection, data) for data in documents) if matches(data)]
+        documents.extend(data for data in self.pending_documents(collection) if matches(data))
+        documents.sort(key=lambda data: data[date_field], reverse=True)
+        return documents[:limit] if limit else documents
+
+    # --- Réplication ---
+
+    def _insert(self, collection, document):
+        """Insère un document créé hors ligne ; renuméroté si son numéro est déjà pris"""
+        number_field = NUMBER_FIELDS.get(collection)
+        for attempt in range(RENUMBER_ATTEMPTS):
+            try:
+                self.db[collection].insert_one(document)
+                return
+            except DuplicateKeyError as e:
+                key_pattern = (e.details or {}).get('keyPattern', {'_id': 1})
+                if '_id' in key_pattern:
+                    # Déjà écrit (délai dépassé après l'écriture, ou rejeu interrompu)
+                    return
+                if number_field not in key_pattern or attempt == RENUMBER_ATTEMPTS - 1:
+                    raise
+                number = renumber(document[number_field])
+                logger.warning(f"Numéro {document[number_field]} déjà pris dans {collection}, "
+                               f"{document['_id']} rejoué sous le numéro {number}")
+                document = {**document, number_field: number}
+                self.stats['renumbered'] += 1
+
+    def _apply(self, collection, kind, entity_id, document):
+        if kind == 'insert':
+            self._insert(collection, document)
+        elif kind == 'delete':
+            self.db[collection].delete_one({'_id': ObjectId(entity_id), **document})
+        else:
+            self.db[collection].update_one({'_id': ObjectId(entity_id)}, {'$set': document})
+        cache = ENTITY_CACHES.get(collection)
+        if cache is not None:
+            cache.invalidate(entity_id)
+
+    def _failed_insert(self, store_id, collection, entity_id):
+        return self._connection().execute(
+            "SELECT seq FROM operations WHERE state = 'failed' AND kind = 'insert' "
+            "AND store = ? AND collection = ? AND entity_id = ? LIMIT 1",
+            (store_id, collection, str(entity_id))
+        ).fetchone()
+
+    def _dependency_failed(self, store_id, collection, kind, entity_id, document):
+        """Insertion en échec dont dépend l'opération (son entité, ou la commande d'une addition)"""
+        if kind in ('update', 'delete'):
+            failed = self._failed_insert(store_id, collection, entity_id)
+            if failed:
+                return f"insertion {failed[0]} de {collection} {entity_id} en échec"
+        if collection in ('bills', 'stock_movements') and kind == 'insert' and document.get('orderId') is not None:
+            failed = self._failed_insert(store_id, 'orders', document['orderId'])
+            if failed:
+                return f"insertion {failed[0]} de la commande {document['orderId']} en échec"
+        return None
+
+    def _mark_failed(self, seq, collection, kind, entity_id, error):
+        self._connection().execute("UPDATE operations SET state = 'failed', last_error = ? WHERE seq = ?",
+                                   (error, seq))
+        self.stats['failed'] += 1
+        OFFLINE_WRITES.labels(collection, 'failed').inc()
+        logger.error(f"Opération hors ligne {seq} ({kind} {collection} {entity_id}) mise de côté: {error}")
+
+    def replay(self, batch_size=OFFLINE_REPLAY_BATCH_SIZE):
+        """Rejoue les opérations en attente dans l'ordre ; retourne le nombre d'opérations répliquées"""
+        connection = self._connection()
+        rows = connection.execute(
+            "SELECT seq, store, collection, kind, entity_id, document FROM operations "
+            "WHERE state = 'pending' ORDER BY seq LIMIT ?",
+            (batch_size,)
+        ).fetchall()
+        blocked = set()
+        replayed = 0
+        for seq, store_id, collection, kind, entity_id, document in rows:
+            # L'ordre est garanti par magasin : on s'arrête au premier échec
+            if store_id in blocked:
+                continue
+            document = bson.decode(document)
+            dependency = self._dependency_failed(store_id, collection, kind, entity_id, document)
+            if dependency:
+                # Rejouer la suite d'une insertion refusée écrirait un état incohérent
+                self._mark_failed(seq, collection, kind, entity_id, dependency)
+                continue
+            try:
+                with use_store(store_id):
+                    self._apply(collection, kind, entity_id, document)
+            except PyMongoError as e:
+                if is_unavailable(e):
+                    blocked.add(store_id)
+                    connection.execute("UPDATE operations SET attempts = attempts + 1, last_error = ? WHERE seq = ?",
+                                       (str(e), seq))
+                    continue
+                self._mark_failed(seq, collection, kind, entity_id, str(e))
+                continue
+            connection.execute("DELETE FROM operations WHERE seq = ?", (seq,))
+            replayed += 1
+            self.stats['replayed'] += 1
+            OFFLINE_WRITES.labels(collection, 'replayed').inc()
+
+        for store_id in {row[1] for row in rows}:
+            # Relevé à refaire : la file du magasin a pu se vider
+            self._pending.pop(store_id, None)
+        for store_id in {row[1] for row in rows} - blocked:
+            # Magasin joignable : les écritures repassent par MongoDB une fois la file vidée
+            self._offline_until.pop(store_id, None)
+        if replayed:
+            logger.info(f"{replayed} opérations hors ligne répliquées vers MongoDB")
+        return replayed
+
+    def counts(self):
+        return dict(self._connection().execute(
+            "SELECT state, COUNT(*) FROM operations GROUP BY state"
+        ).fetchall())
+
+    def failures(self, limit=20):
+        """Dernières opérations mises de côté, à reprendre à la main"""
+        return [
+            {'seq': seq, 'store': store_id, 'collection': collection, 'kind': kind,
+             'entityId': entity_id, 'number': number, 'error': error}
+            for seq, store_id, collection, kind, entity_id, number, error in self._connection().execute(
+                "SELECT seq, store, collection, kind, entity_id, number, last_error FROM operations "
+                "WHERE state = 'failed' ORDER BY seq DESC LIMIT ?",
+                (limit,)
+            )
+        ]
+
+    def get_status(self):
+        if not self.enabled:
+            return {'enabled': False}
+        counts = self.counts()
+        now = time.monotonic()
+        return {
+            'enabled': True,
+            'pending': counts.get('pending', 0),
+            'failed': counts.get('failed', 0),
+            'offlineStores': [store_id for store_id, until in self._offline_until.items() if until > now],
+            'failures': self.failures() if counts.get('failed') else [],
+            'stats': dict(self.stats)
+        }
+
+class OfflineReplicator:
+    """Thread de réplication de la file locale vers MongoDB"""
+
+    def __init__(self, queue, interval=OFFLINE_REPLAY_SECONDS):
+        self.queue = queue
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Démarre la réplication en arrière-plan"""
+        if self.queue.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='offline-replicator', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Arrête la réplication"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.drain()
+            except Exception as e:
+                logger.error(f"Erreur lors de la réplication de la file hors ligne: {e}")
+
+    def drain(self):
+        """Vide la file tant qu'elle progresse, si aucun autre worker ne le fait déjà"""
+        if not self.queue.counts().get('pending'):
+            return 0
+        if fcntl is None:
+            return self._replay_all()
+        with open(self.queue.path + '.lock', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            return self._replay_all()
+
+    def _replay_all(self):
+        replayed = 0
+        while not self._stop.is_set():
+            count = self.queue.replay()
+            replayed += count
+            if count < OFFLINE_REPLAY_BATCH_SIZE:
+                break
+        return replayed
+
+# File partagée par les services du processus
+offline_queue = OfflineWriteQueue()
+offline_replicator = OfflineReplicator(offline_queue)
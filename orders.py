@@ -4,7 +4,12 @@ Routes API pour la gestion des commandes
 from flask import Blueprint, request, jsonify
 from marshmallow import ValidationError
 from bson import ObjectId
-from src.models.Order import OrderService, OrderSchema
+from src.models.Order import OrderService, OrderSchema, compute_order_stats
+from src.routes.stock import stock_catalog, movement_service
+from src.config.services import LazyService
+from src.config.cache import CoalescedCache
+from src.config.database import current_store
+from src.middleware.validation import CompiledValidator
 import logging
 
 # Configuration du logging
@@ -13,9 +18,17 @@ logger = logging.getLogger(__name__)
 # Création du blueprint
 orders_bp = Blueprint('orders', __name__, url_prefix='/api/orders')
 
-# Instance du service
-order_service = OrderService()
+# Instance du service, construite au premier usage
+# (prix résolus depuis la réplique en mémoire du catalogue, ventes au journal de stock)
+order_service = LazyService(lambda: OrderService(price_catalog=stock_catalog, movement_service=movement_service))
 order_schema = OrderSchema()
+order_validator = CompiledValidator(order_schema)
+# Statistiques partagées par les tableaux de bord qui se rafraîchissent ensemble
+stats_cache = CoalescedCache('orders_stats')
+
+def wants_history():
+    """?history=true : inclure les commandes archivées"""
+    return request.args.get('history', 'false').lower() == 'true'
 
 @orders_bp.route('/', methods=['GET'])
 def get_all_orders():
@@ -24,7 +37,7 @@ def get_all_orders():
         status = request.args.get('status')
         limit = int(request.args.get('limit', 50))
         
-        orders = order_service.get_all_orders(status=status, limit=limit)
+        orders = order_service.get_all_orders(status=status, limit=limit, include_archive=wants_history())
         
         orders_data = []
         for order in orders:
@@ -57,7 +70,7 @@ def get_order_by_id(order_id):
                 'error': 'ID de commande invalide'
             }), 400
         
-        order = order_service.get_order_by_id(order_id)
+        order = order_service.get_order_by_id(order_id, include_archive=wants_history())
         
         if not order:
             return jsonify({
@@ -84,7 +97,7 @@ def get_order_by_id(order_id):
 def get_order_by_number(order_number):
     """Récupère une commande par son numéro"""
     try:
-        order = order_service.get_order_by_number(order_number)
+        order = order_service.get_order_by_number(order_number, include_archive=wants_history())
         
         if not order:
             return jsonify({
@@ -113,7 +126,7 @@ def create_order():
     try:
         # Validation des données
         try:
-            order_data = order_schema.load(request.json)
+            order_data = order_validator.load(request.json)
         except ValidationError as err:
             return jsonify({
                 'success': False,
@@ -133,6 +146,11 @@ def create_order():
             'data': order_dict
         }), 201
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         logger.error(f"Erreur lors de la création de la commande: {e}")
         return jsonify({
@@ -197,8 +215,8 @@ def delete_order(order_id):
                 'error': 'ID de commande invalide'
             }), 400
         
-        # Vérifier que la commande existe
-        order = order_service.get_order_by_id(order_id)
+        # Vérifier que la commande existe (lecture sans cache)
+        order = order_service.get_order_by_id(order_id, for_update=True)
         if not order:
             return jsonify({
                 'success': False,
@@ -237,22 +255,11 @@ def delete_order(order_id):
 def get_order_stats():
     """Récupère les statistiques des commandes"""
     try:
-        # Récupérer toutes les commandes pour calculer les stats
-        all_orders = order_service.get_all_orders(limit=1000)
-        
-        stats = {
-            'total': len(all_orders),
-            'pending': len([o for o in all_orders if o.status == 'pending']),
-            'preparing': len([o for o in all_orders if o.status == 'preparing']),
-            'ready': len([o for o in all_orders if o.status == 'ready']),
-            'completed': len([o for o in all_orders if o.status == 'completed']),
-            'total_revenue': sum(o.total_amount for o in all_orders if o.status == 'completed'),
-            'average_order_value': 0
-        }
-        
-        if stats['completed'] > 0:
-            completed_orders = [o for o in all_orders if o.status == 'completed']
-            stats['average_order_value'] = sum(o.total_amount for o in completed_orders) / len(completed_orders)
+        # Un seul calcul par magasin pour tous les appels simultanés
+        stats = stats_cache.get(
+            current_store(),
+            lambda: compute_order_stats(order_service.get_all_orders(limit=1000))
+        )
         
         return jsonify({
             'success': True,
@@ -0,0 +1,208 @@
+"""
+Profilage à la demande et journal des requêtes MongoDB lentes
+
+- Profilage : une requête portant l'en-tête `X-Profile` (égal à
+  PROFILE_TOKEN) ou tirée au sort (PROFILE_SAMPLE_RATE) est exécutée sous
+  un profileur par échantillonnage. Les piles sont écrites au format
+  « folded » (flamegraph.pl, speedscope) dans PROFILE_DIR.
+- Requêtes lentes : toute commande MongoDB plus longue que SLOW_QUERY_MS est
+  consignée avec la route d'origine et son plan `explain`, calculé en
+  arrière-plan pour ne pas rallonger la requête.
+"""
+import os
+import sys
+import time
+import hmac
+import json
+import queue
+import random
+import threading
+import logging
+from collections import Counter, deque
+from datetime import datetime
+from flask import request, g, jsonify, has_request_context
+from pymongo import monitoring
+from src.config.database import db_config, current_store
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL_MS', '1')) / 1000
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/coffeeshop-profiles')
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+
+# Commandes pour lesquelles MongoDB sait produire un explain
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+# Champs ajoutés par le driver, refusés dans une commande explain
+_DRIVER_FIELDS = {'lsid', '$clusterTime', '$db', 'txnNumber', '$readPreference', 'readConcern', 'writeConcern'}
+
+class StackSampler:
+    """Profileur par échantillonnage de la pile d'un thread"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        """Piles au format folded : une ligne « pile;de;frames nombre » par pile"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Consigne les commandes MongoDB lentes avec leur route et leur plan"""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, max_entries=200):
+        self.threshold_ms = threshold_ms
+        self.entries = deque(maxlen=max_entries)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._explain_queue = queue.Queue(maxsize=100)
+        self._worker = None
+
+    def started(self, event):
+        route = 'background'
+        if has_request_context():
+            route = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                event.command, event.database_name, route, current_store()
+            )
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if pending is None or duration_ms < self.threshold_ms:
+            return
+
+        command, database_name, route, store_id = pending
+        entry = {
+            'at': datetime.utcnow().isoformat(),
+            'command': event.command_name,
+            'collection': command.get(event.command_name) if isinstance(command.get(event.command_name), str) else None,
+            'durationMs': round(duration_ms, 2),
+            'route': route,
+            'store': store_id,
+            'explain': None
+        }
+        self.entries.append(entry)
+        logger.warning(f"Requête MongoDB lente ({entry['durationMs']} ms) {entry['command']} "
+                       f"{entry['collection']} depuis {route}")
+
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            explainable = {k: v for k, v in command.items() if k not in _DRIVER_FIELDS}
+            try:
+                self._explain_queue.put_nowait((entry, store_id, database_name, explainable))
+                self._ensure_worker()
+            except queue.Full:
+                pass
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._explain_loop, name='slow-query-explain', daemon=True)
+            self._worker.start()
+
+    def _explain_loop(self):
+        """Calcule les plans hors du chemin des requêtes"""
+        while True:
+            entry, store_id, database_name, command = self._explain_queue.get()
+            try:
+                db = db_config.get_database(store_id).client[database_name]
+                explain = db.command('explain', command, verbosity='queryPlanner')
+                entry['explain'] = explain.get('queryPlanner', {}).get('winningPlan')
+            except Exception as e:
+                entry['explain'] = {'error': str(e)}
+
+# Journal global des requêtes lentes du processus
+slow_query_log = SlowQueryLog()
+
+def _is_privileged():
+    # Comparaison en temps constant : la durée ne renseigne pas sur le jeton
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(
+        request.headers.get('X-Profile', '').encode(), PROFILE_TOKEN.encode()
+    )
+
+def _start_profiling():
+    if _is_privileged() or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+        g.profiler = StackSampler(threading.get_ident())
+        g.profiler.start()
+
+def _write_profile(profiler):
+    """Arrête le profileur et écrit ses piles ; retourne l'identifiant du profil ou None"""
+    profiler.stop()
+    route = (request.url_rule.rule if request.url_rule else request.path).strip('/').replace('/', '_') or 'root'
+    profile_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}_{request.method}_{route}"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded"), 'w') as profile_file:
+            profile_file.write(profiler.folded())
+        return profile_id
+    except OSError as e:
+        logger.error(f"Impossible d'écrire le profil {profile_id}: {e}")
+        return None
+
+def _stop_profiling(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profile_id = _write_profile(profiler)
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+    return response
+
+def _teardown_profiling(exception=None):
+    """Arrête le profileur d'une requête dont after_request n'a pas tourné (exception)"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profile_id = _write_profile(profiler)
+        logger.warning(f"Requête profilée interrompue par une exception ({exception}), profil {profile_id}")
+
+def get_slow_queries():
+    """Dernières requêtes lentes (accès réservé à l'en-tête de profilage)"""
+    if not _is_privileged():
+        return jsonify({
+            'success': False,
+            'error': 'Accès refusé'
+        }), 403
+    entries = list(slow_query_log.entries)
+    return jsonify({
+        'success': True,
+        'data': json.loads(json.dumps(entries, default=str)),
+        'count': len(entries),
+        'thresholdMs': slow_query_log.threshold_ms
+    }), 200
+
+def init_profiling(app):
+    """Active le profilage à la demande et le journal des requêtes lentes"""
+    db_config.add_event_listener(slow_query_log)
+    app.before_request(_start_profiling)
+    app.after_request(_stop_profiling)
+    app.teardown_request(_teardown_profiling)
+    app.add_url_rule('/api/debug/slow-queries', 'slow_queries', get_slow_queries, methods=['GET'])
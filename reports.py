@@ -0,0 +1,79 @@
+"""
+Routes API de reporting multi-magasins
+
+Chaque magasin a sa propre base : les statistiques de chaque magasin sont
+calculées sur sa base, en parallèle, puis agrégées. Un magasin injoignable
+n'empêche pas le rapport des autres.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request, jsonify
+from src.config.database import db_config, use_store
+from src.models.Order import compute_order_stats
+from src.models.Bill import compute_bill_stats
+from src.routes import orders, bills
+import logging
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Création du blueprint
+reports_bp = Blueprint('reports', __name__, url_prefix='/api/reports')
+
+def store_report(store_id):
+    """Statistiques des commandes et additions d'un magasin"""
+    with use_store(store_id):
+        # Mêmes micro-caches que /api/orders/stats et /api/bills/stats
+        return {
+            'orders': orders.stats_cache.get(
+                store_id,
+                lambda: compute_order_stats(orders.order_service.get_all_orders(limit=1000))
+            ),
+            'bills': bills.stats_cache.get(
+                store_id,
+                lambda: compute_bill_stats(bills.bill_service.get_all_bills(limit=1000))
+            )
+        }
+
+@reports_bp.route('/stores', methods=['GET'])
+def get_store_reports():
+    """Statistiques par magasin et totaux (?stores=a,b pour restreindre)"""
+    requested = request.args.get('stores')
+    store_ids = requested.split(',') if requested else db_config.store_ids()
+    unknown = [store_id for store_id in store_ids if not db_config.has_store(store_id)]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'error': f"Magasins inconnus: {', '.join(unknown)}"
+        }), 400
+
+    with ThreadPoolExecutor(max_workers=len(store_ids), thread_name_prefix='store-report') as executor:
+        futures = {store_id: executor.submit(store_report, store_id) for store_id in store_ids}
+
+    stores = {}
+    errors = {}
+    for store_id, future in futures.items():
+        try:
+            stores[store_id] = future.result()
+        except Exception as e:
+            logger.error(f"Rapport du magasin {store_id} impossible: {e}")
+            errors[store_id] = 'Magasin injoignable'
+
+    totals = {
+        'orders': sum(report['orders']['total'] for report in stores.values()),
+        'completedOrders': sum(report['orders']['completed'] for report in stores.values()),
+        'bills': sum(report['bills']['total'] for report in stores.values()),
+        'paidBills': sum(report['bills']['paid'] for report in stores.values()),
+        'revenue': sum(report['bills']['total_revenue'] for report in stores.values()),
+        'tax': sum(report['bills']['total_tax'] for report in stores.values())
+    }
+
+    body = {
+        'success': not errors,
+        'data': {
+            'stores': stores,
+            'totals': totals
+        }
+    }
+    if errors:
+        body['errors'] = errors
+    return jsonify(body), 200 if stores else 503
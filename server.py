@@ -0,0 +1,109 @@
+"""
+Serveur de production de l'API Coffee Shop
+
+Lance l'application Flask sous Gunicorn : plusieurs processus pré-forkés
+(un par cœur par défaut), chacun avec un pool de threads. Les index sont
+créés une seule fois dans le processus maître ; chaque worker recrée son
+client MongoDB et ses tâches de fond après le fork.
+
+Démarrage : python -m src.server
+Rechargement gracieux : kill -HUP <pid du maître>
+"""
+import os
+import multiprocessing
+import logging
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger(__name__)
+
+def server_options():
+    """Options Gunicorn issues des variables d'environnement"""
+    cpu_count = multiprocessing.cpu_count()
+    return {
+        'bind': os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}"),
+        'workers': int(os.getenv('WEB_WORKERS', str(cpu_count))),
+        'worker_class': 'gthread',
+        'threads': int(os.getenv('WEB_THREADS', '8')),
+        'keepalive': int(os.getenv('WEB_KEEPALIVE', '5')),
+        'timeout': int(os.getenv('WEB_TIMEOUT', '30')),
+        'graceful_timeout': int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30')),
+        'max_requests': int(os.getenv('WEB_MAX_REQUESTS', '5000')),
+        'max_requests_jitter': int(os.getenv('WEB_MAX_REQUESTS_JITTER', '500')),
+        'backlog': int(os.getenv('WEB_BACKLOG', '2048')),
+        # L'application est importée une fois dans le maître puis partagée par fork
+        'preload_app': True,
+        'accesslog': os.getenv('WEB_ACCESS_LOG') or None,
+        'on_starting': on_starting,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+        'child_exit': child_exit
+    }
+
+def on_starting(server):
+    """Processus maître : création des index une seule fois pour tous les workers"""
+    from src.config.database import init_collections, db_config
+    if os.getenv('INIT_INDEXES', 'startup') != 'skip':
+        try:
+            init_collections()
+        except Exception as e:
+            logger.error(f"Erreur lors de la création des index: {e}")
+    # Le client du maître ne doit pas être utilisé par les workers
+    db_config.close_connection()
+
+def post_fork(server, worker):
+    """Worker : nouveau client MongoDB et tâches de fond propres au processus"""
+    from src.config.database import db_config
+    from src.main import initialize_app
+    db_config.reset_after_fork()
+    # Les index sont déjà créés par le maître
+    os.environ['INIT_INDEXES'] = 'skip'
+    initialize_app()
+    logger.info(f"Worker {worker.pid} initialisé")
+
+def worker_exit(server, worker):
+    """Worker : vidage des statuts en attente, fermeture du client MongoDB et des logs"""
+    from src.config.database import db_config
+    from src.middleware.logging_pipeline import logging_pipeline
+    from src.models.write_behind import order_status_writer
+    from src.models.offline_queue import offline_replicator
+    # Avant la fermeture du client : le vidage écrit dans MongoDB ; la file
+    # hors ligne, sur disque, est reprise par les autres workers
+    order_status_writer.stop()
+    offline_replicator.stop()
+    db_config.close_connection()
+    logging_pipeline.stop()
+
+def child_exit(server, worker):
+    """Maître : nettoyage des métriques du worker arrêté"""
+    from src.middleware.metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
+
+class CoffeeShopServer(BaseApplication):
+    """Application Gunicorn embarquée"""
+
+    def __init__(self, options=None):
+        self.options = options or server_options()
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from src.main import app
+        return app
+
+def serve():
+    """Point d'entrée du serveur de production"""
+    options = server_options()
+    # Lu au chargement de l'app (backend du cache des entités, src.config.cache)
+    os.environ['WEB_WORKERS'] = str(options['workers'])
+    logger.info(
+        f"Démarrage du serveur Coffee Shop API: {options['workers']} workers x "
+        f"{options['threads']} threads sur {options['bind']}"
+    )
+    CoffeeShopServer(options).run()
+
+if __name__ == '__main__':
+    serve()
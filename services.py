@@ -0,0 +1,34 @@
+"""
+Câblage paresseux des services du Coffee Shop CRUD
+
+Les modules de routes déclarent leurs services au niveau module ; avec
+LazyService, l'instance réelle n'est construite qu'au premier usage (premier
+appel de méthode), dans le processus qui sert la requête.
+"""
+import threading
+
+class LazyService:
+    """Proxy qui construit le service à la première utilisation"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """Retourne l'instance du service, en la construisant si nécessaire"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    @property
+    def resolved(self):
+        """Indique si le service a déjà été construit"""
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
@@ -0,0 +1,121 @@
+"""
+Manifeste des fichiers statiques du frontend
+
+Au démarrage, index.html, js/, css/ et les autres fichiers du dossier
+statique sont lus une fois : chaque fichier
+reçoit une empreinte de contenu (SHA-256) et une URL versionnée
+(css/main.3f2a9c1b.css). index.html est réécrit pour pointer vers ces URL,
+servies avec `Cache-Control: immutable` ; index.html lui-même est revalidé
+par ETag. Les fichiers de moins de STATIC_INLINE_MAX_BYTES restent en
+mémoire : une requête statique ne touche jamais le disque.
+"""
+import os
+import re
+import hashlib
+import mimetypes
+from flask import Response, request, send_file
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATIC_INLINE_MAX_BYTES = int(os.getenv('STATIC_INLINE_MAX_BYTES', str(512 * 1024)))
+INDEX_FILE = 'index.html'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# Références relatives dans index.html (href="css/main.css", src="js/app.js")
+_REFERENCE = re.compile(r'(href|src)="([^"#?:]+)"')
+
+class StaticAsset:
+    """Fichier du frontend avec son empreinte et, s'il est petit, son contenu"""
+
+    def __init__(self, path, fs_path, content, max_inline_bytes=STATIC_INLINE_MAX_BYTES):
+        self.path = path
+        self.fs_path = fs_path
+        self.size = len(content)
+        self.digest = hashlib.sha256(content).hexdigest()
+        self.etag = self.digest[:16]
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.content = content if self.size <= max_inline_bytes else None
+        base, extension = os.path.splitext(path)
+        self.fingerprinted_path = f"{base}.{self.digest[:8]}{extension}"
+
+class StaticManifest:
+    """Manifeste en mémoire des fichiers statiques, construit une fois au démarrage"""
+
+    def __init__(self, root, max_inline_bytes=STATIC_INLINE_MAX_BYTES):
+        self.root = root
+        self.max_inline_bytes = max_inline_bytes
+        self.assets = {}
+        self.fingerprinted = {}
+        self.index = None
+
+    def build(self):
+        """Lit le dossier statique et calcule les empreintes"""
+        assets = {}
+        if self.root and os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    fs_path = os.path.join(dirpath, filename)
+                    path = os.path.relpath(fs_path, self.root).replace(os.sep, '/')
+                    if path == INDEX_FILE:
+                        continue
+                    with open(fs_path, 'rb') as asset_file:
+                        assets[path] = StaticAsset(path, fs_path, asset_file.read(), self.max_inline_bytes)
+
+        index = None
+        index_path = os.path.join(self.root, INDEX_FILE) if self.root else None
+        if index_path and os.path.isfile(index_path):
+            with open(index_path, encoding='utf-8') as index_file:
+                html = index_file.read()
+            html = _REFERENCE.sub(lambda match: self._rewrite(match, assets), html)
+            # index.html est toujours gardé en mémoire : c'est aussi le repli de la SPA
+            index = StaticAsset(INDEX_FILE, index_path, html.encode('utf-8'), max_inline_bytes=float('inf'))
+
+        self.assets = assets
+        self.fingerprinted = {asset.fingerprinted_path: asset for asset in assets.values()}
+        self.index = index
+        logger.info(f"Manifeste statique: {len(assets)} fichiers, "
+                    f"{sum(asset.size for asset in assets.values())} octets")
+        return self
+
+    @staticmethod
+    def _rewrite(match, assets):
+        attribute, reference = match.groups()
+        asset = assets.get(reference[2:] if reference.startswith('./') else reference)
+        if asset is None:
+            return match.group(0)
+        return f'{attribute}="{asset.fingerprinted_path}"'
+
+    def url_for(self, path):
+        """URL versionnée d'un fichier (chemin inchangé s'il est inconnu)"""
+        asset = self.assets.get(path)
+        return asset.fingerprinted_path if asset else path
+
+    def response(self, path):
+        """Réponse pour un chemin du frontend, ou None si aucun frontend n'est déployé"""
+        asset = self.fingerprinted.get(path)
+        if asset is not None:
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            # Chemin non versionné (ancienne page) ou route de la SPA
+            asset = self.assets.get(path) or self.index
+            cache_control = REVALIDATE_CACHE_CONTROL
+        if asset is None:
+            return None
+
+        if asset.content is not None:
+            response = Response(asset.content, mimetype=asset.mimetype)
+        else:
+            response = send_file(asset.fs_path, mimetype=asset.mimetype, etag=False, conditional=False)
+        response.headers['Cache-Control'] = cache_control
+        response.set_etag(asset.etag)
+        return response.make_conditional(request)
+
+    def get_status(self):
+        return {
+            'files': len(self.assets),
+            'bytes': sum(asset.size for asset in self.assets.values()),
+            'inMemoryBytes': sum(asset.size for asset in self.assets.values() if asset.content is not None),
+            'index': self.index is not None
+        }
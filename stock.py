@@ -2,18 +2,39 @@ from flask import Blueprint, request, jsonify
 from bson import ObjectId
 from bson.errors import InvalidId
 from marshmallow import ValidationError
+from pymongo.errors import DuplicateKeyError
 import logging
 
-from src.models.Stock import StockService, StockSchema
+from src.models.Inventory import StockService, StockSchema, duplicate_key_field
+from src.models.stock_import import StockImporter, detect_format, open_text_stream, SUPPORTED_FORMATS
+from src.models.stock_catalog import StockCatalogReplica
+from src.models.StockMovement import StockMovementService, StockMovementSchema, StockLedgerCompactor
+from src.config.services import LazyService
+from src.config.cache import CoalescedCache
+from src.config.database import current_store
+from src.middleware.validation import CompiledValidator
 
 logger = logging.getLogger(__name__)
 
 # Création du blueprint pour les routes stock
 stock_bp = Blueprint('stock', __name__, url_prefix='/api/stock')
 
-# Instance du service stock
-stock_service = StockService()
+# Instance du service stock, construite au premier usage
+stock_service = LazyService(StockService)
 stock_schema = StockSchema()
+stock_validator = CompiledValidator(stock_schema)
+
+# Réplique en mémoire du catalogue pour les lectures (démarrée par initialize_app)
+stock_catalog = LazyService(lambda: StockCatalogReplica(stock_service))
+
+# Journal des mouvements de stock et son compacteur (démarré par initialize_app)
+movement_service = LazyService(lambda: StockMovementService(stock_service))
+movement_schema = StockMovementSchema()
+movement_validator = CompiledValidator(movement_schema)
+ledger_compactor = LazyService(lambda: StockLedgerCompactor(movement_service))
+
+# Alertes partagées par les tableaux de bord qui se rafraîchissent ensemble
+alerts_cache = CoalescedCache('low_stock_alerts')
 
 @stock_bp.route('/', methods=['GET'])
 def get_all_stock():
@@ -34,12 +55,12 @@ def get_all_stock():
             filters['status'] = status
         if search:
             filters['$or'] = [
-                {'name': {'$regex': search, '$options': 'i'}},
-                {'description': {'$regex': search, '$options': 'i'}}
+                {'name': {'$regex': re.escape(search), '$options': 'i'}},
+                {'description': {'$regex': re.escape(search), '$options': 'i'}}
             ]
         
         # Récupérer les produits
-        products = stock_service.get_all_stock(filters, page, limit)
+        products = stock_catalog.get_all_stock(filters, page, limit)
         
         return jsonify({
             'success': True,
@@ -47,7 +68,7 @@ def get_all_stock():
             'pagination': {
                 'page': page,
                 'limit': limit,
-                'total': stock_service.count_stock(filters)
+                'total': stock_catalog.count_stock(filters)
             }
         }), 200
         
@@ -62,7 +83,7 @@ def get_all_stock():
 def get_stock_by_id(product_id):
     """Récupère un produit par son ID"""
     try:
-        product = stock_service.get_stock_by_id(product_id)
+        product = stock_catalog.get_stock_by_id(product_id)
         if not product:
             return jsonify({
                 'success': False,
@@ -91,7 +112,7 @@ def create_stock():
     """Crée un nouveau produit en stock"""
     try:
         # Validation des données
-        data = stock_schema.load(request.json)
+        data = stock_validator.load(request.json)
         
         # Créer le produit
         product = stock_service.create_stock(data)
@@ -108,6 +129,11 @@ def create_stock():
             'error': 'Données invalides',
             'details': e.messages
         }), 400
+    except DuplicateKeyError as e:
+        return jsonify({
+            'success': False,
+            'error': f"Un produit existe déjà avec ce {duplicate_key_field(e) or 'name'}"
+        }), 409
     except Exception as e:
         logger.error(f"Erreur lors de la création du produit: {e}")
         return jsonify({
@@ -115,15 +141,56 @@ def create_stock():
             'error': 'Erreur lors de la création du produit'
         }), 500
 
+@stock_bp.route('/import', methods=['POST'])
+def import_stock():
+    """Importe (upsert par productId) un fichier CSV ou NDJSON de produits"""
+    try:
+        upload = request.files.get('file')
+        if upload:
+            binary_stream = upload.stream
+            file_format = request.args.get('format') or detect_format(upload.filename, upload.mimetype)
+        else:
+            binary_stream = request.stream
+            file_format = request.args.get('format') or detect_format(content_type=request.content_type)
+
+        if file_format not in SUPPORTED_FORMATS:
+            return jsonify({
+                'success': False,
+                'error': f'Format d\'import invalide, formats acceptés: {", ".join(SUPPORTED_FORMATS)}'
+            }), 400
+
+        chunk_size = int(request.args.get('chunkSize', 500))
+        importer = StockImporter(stock_service, movement_service=movement_service, chunk_size=max(1, min(chunk_size, 5000)))
+        report = importer.import_stream(open_text_stream(binary_stream), file_format)
+
+        return jsonify({
+            'success': report['failed'] == 0,
+            'message': 'Import du stock terminé',
+            'data': report
+        }), 200
+
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Erreur lors de l'import du stock: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Erreur lors de l\'import du stock'
+        }), 500
+
 @stock_bp.route('/<product_id>', methods=['PUT'])
 def update_stock(product_id):
     """Met à jour un produit"""
     try:
         # Validation des données
-        data = stock_schema.load(request.json, partial=True)
+        data = stock_validator.load(request.json, partial=True)
         
         # Mettre à jour le produit
-        product = stock_service.update_stock(product_id, data)
+        # Une nouvelle quantité devient un ajustement du journal de mouvements
+        product = movement_service.update_stock(product_id, data)
         if not product:
             return jsonify({
                 'success': False,
@@ -147,6 +214,11 @@ def update_stock(product_id):
             'success': False,
             'error': 'ID de produit invalide'
         }), 400
+    except DuplicateKeyError as e:
+        return jsonify({
+            'success': False,
+            'error': f"Un produit existe déjà avec ce {duplicate_key_field(e) or 'name'}"
+        }), 409
     except Exception as e:
         logger.error(f"Erreur lors de la mise à jour du produit {product_id}: {e}")
         return jsonify({
@@ -182,15 +254,105 @@ def delete_stock(product_id):
             'error': 'Erreur lors de la suppression du produit'
         }), 500
 
+@stock_bp.route('/<product_id>/movements', methods=['POST'])
+def record_stock_movement(product_id):
+    """Enregistre un mouvement de stock (réception, vente, perte, ajustement)"""
+    try:
+        data = movement_validator.load(request.json)
+
+        product = stock_catalog.get_stock_by_id(product_id)
+        if not product:
+            return jsonify({
+                'success': False,
+                'error': 'Produit non trouvé'
+            }), 404
+
+        movement = movement_service.record_movement(product, data)
+        movement_dict = movement.to_dict()
+        movement_dict['_id'] = str(movement_dict['_id'])
+        movement_dict['stockId'] = str(movement_dict['stockId'])
+
+        return jsonify({
+            'success': True,
+            'message': 'Mouvement de stock enregistré',
+            'data': movement_dict
+        }), 201
+
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': 'Données invalides',
+            'details': e.messages
+        }), 400
+    except InvalidId:
+        return jsonify({
+            'success': False,
+            'error': 'ID de produit invalide'
+        }), 400
+    except Exception as e:
+        logger.error(f"Erreur lors de l'enregistrement du mouvement pour {product_id}: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Erreur lors de l\'enregistrement du mouvement'
+        }), 500
+
+@stock_bp.route('/<product_id>/movements', methods=['GET'])
+def get_stock_movements(product_id):
+    """Récupère l'historique des mouvements, la quantité à jour et les instantanés d'un produit"""
+    try:
+        limit = int(request.args.get('limit', 50))
+        current_quantity = movement_service.get_current_quantity(product_id)
+        if current_quantity is None:
+            return jsonify({
+                'success': False,
+                'error': 'Produit non trouvé'
+            }), 404
+
+        movements_data = []
+        for movement in movement_service.get_movements(product_id, limit=limit):
+            movement_dict = movement.to_dict()
+            movement_dict['_id'] = str(movement_dict['_id'])
+            movement_dict['stockId'] = str(movement_dict['stockId'])
+            movements_data.append(movement_dict)
+
+        snapshots = movement_service.get_snapshots(product_id)
+        for snapshot in snapshots:
+            snapshot['stockId'] = str(snapshot['stockId'])
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'currentQuantity': current_quantity,
+                'movements': movements_data,
+                'snapshots': snapshots
+            },
+            'count': len(movements_data)
+        }), 200
+
+    except InvalidId:
+        return jsonify({
+            'success': False,
+            'error': 'ID de produit invalide'
+        }), 400
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des mouvements de {product_id}: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Erreur lors de la récupération des mouvements'
+        }), 500
+
 @stock_bp.route('/alerts/low-stock', methods=['GET'])
 def get_low_stock_alerts():
     """Récupère les alertes de stock faible"""
     try:
-        alerts = stock_service.get_low_stock_alerts()
+        alerts = alerts_cache.get(
+            current_store(),
+            lambda: [alert.to_dict() for alert in stock_catalog.get_low_stock_alerts()]
+        )
         
         return jsonify({
             'success': True,
-            'data': [alert.to_dict() for alert in alerts],
+            'data': alerts,
             'count': len(alerts)
         }), 200
         
@@ -205,7 +367,7 @@ def get_low_stock_alerts():
 def get_categories():
     """Récupère toutes les catégories de produits"""
     try:
-        categories = stock_service.get_categories()
+        categories = stock_catalog.get_categories()
         
         return jsonify({
             'success': True,
@@ -219,3 +381,11 @@ def get_categories():
             'error': 'Erreur lors de la récupération des catégories'
         }), 500
 
+
+@stock_bp.route('/catalog/status', methods=['GET'])
+def get_catalog_status():
+    """État de la réplique en mémoire du catalogue (fraîcheur, taux de service)"""
+    return jsonify({
+        'success': True,
+        'data': stock_catalog.get_status()
+    }), 200
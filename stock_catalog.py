@@ -0,0 +1,392 @@
+"""
+Réplique en mémoire du catalogue de stock
+
+Le catalogue est petit et beaucoup plus lu qu'écrit : chaque processus en
+garde une copie complète par magasin, chargée au démarrage puis tenue à jour
+par un change stream MongoDB (si le serveur le permet), par les écritures de
+StockService et par un rechargement périodique. Les lectures filtrées,
+triées et paginées sont servies depuis la mémoire ; tant que la réplique
+n'est pas chaude (ou si elle est trop ancienne) on retombe sur MongoDB.
+
+Chaque lecture de MongoDB prend un ticket (compteur croissant) avant de
+partir : un document n'est remplacé que par une lecture plus récente, et un
+rechargement complet conserve les documents relus après son propre ticket.
+
+Tous les magasins configurés au démarrage sont répliqués ; un magasin ajouté
+ensuite est servi par sa base (compté dans stats['unreplicatedStores']).
+
+La recherche n'est servie depuis la mémoire que pour des motifs littéraux
+(échappés avec re.escape) : les expressions régulières quelconques sont
+confiées à MongoDB, dont le moteur PCRE ne se comporte pas comme `re`.
+"""
+import os
+import re
+import itertools
+import threading
+import time
+import logging
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from src.config.database import current_store, use_store, db_config
+from src.models.Inventory import Stock
+
+logger = logging.getLogger(__name__)
+
+class _StoreReplica:
+    """État de la réplique d'un magasin"""
+
+    def __init__(self, store_id):
+        self.store_id = store_id
+        self.documents = {}
+        # Ticket de la dernière lecture appliquée à chaque document
+        self.versions = {}
+        self.reload_ticket = 0
+        self.warm = False
+        self.stale = False
+        self.last_synced_at = None
+        self.change_stream_active = False
+        self.reload_requested = threading.Event()
+
+class StockCatalogReplica:
+    """Copie en mémoire de la collection stock, interchangeable avec StockService en lecture"""
+
+    def __init__(self, stock_service, refresh_interval=None, max_staleness=None):
+        self.stock_service = stock_service
+        self.enabled = os.getenv('STOCK_CATALOG_ENABLED', 'true').lower() == 'true'
+        self.refresh_interval = refresh_interval or float(os.getenv('STOCK_CATALOG_REFRESH_SECONDS', '60'))
+        self.max_staleness = max_staleness or float(os.getenv('STOCK_CATALOG_MAX_STALENESS', '120'))
+
+        self._stores = {}
+        self._tickets = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.stats = {'hits': 0, 'fallbacks': 0, 'reloads': 0, 'events': 0, 'unreplicatedStores': 0}
+
+        # Les écritures de ce processus sont répercutées immédiatement
+        stock_service.add_listener(self.on_stock_change)
+
+    @property
+    def warm(self):
+        return bool(self._stores) and all(state.warm for state in self._stores.values())
+
+    # --- Cycle de vie ---
+
+    def start(self):
+        """Charge le catalogue de chaque magasin et démarre la synchronisation en arrière-plan"""
+        if not self.enabled:
+            logger.info("Réplique du catalogue de stock désactivée")
+            return False
+
+        for store_id in db_config.store_ids():
+            state = self._stores.setdefault(store_id, _StoreReplica(store_id))
+            self.reload(state)
+            for target, name in ((self._watch_changes, 'stock-catalog-watch'),
+                                 (self._periodic_reload, 'stock-catalog-refresh')):
+                thread = threading.Thread(target=self._run_for_store, args=(target, state),
+                                          name=f'{name}-{store_id}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self.warm
+
+    def stop(self):
+        """Arrête les threads de synchronisation"""
+        self._stop.set()
+        for state in self._stores.values():
+            state.reload_requested.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+    def _run_for_store(self, target, state):
+        with use_store(state.store_id):
+            target(state)
+
+    def reload(self, state=None):
+        """Recharge l'intégralité du catalogue d'un magasin depuis MongoDB"""
+        state = state or self._stores.get(current_store())
+        if state is None:
+            return False
+        ticket = next(self._tickets)
+        try:
+            with use_store(state.store_id):
+                documents = {
+                    str(document['_id']): document
+                    for document in self.stock_service.collection.find({})
+                }
+        except PyMongoError as e:
+            logger.error(f"Échec du chargement du catalogue de stock ({state.store_id}): {e}")
+            return False
+
+        with self._lock:
+            # Les documents relus après le début de ce chargement sont plus récents
+            for key, version in state.versions.items():
+                if version <= ticket:
+                    continue
+                if key in state.documents:
+                    documents[key] = state.documents[key]
+                else:
+                    documents.pop(key, None)
+            state.versions = {k: v for k, v in state.versions.items() if v > ticket}
+            state.reload_ticket = ticket
+            state.documents = documents
+            state.last_synced_at = time.monotonic()
+            state.warm = True
+            state.stale = False
+        self.stats['reloads'] += 1
+        logger.info(f"Catalogue de stock chargé en mémoire ({state.store_id}): {len(documents)} produits")
+        return True
+
+    def _periodic_reload(self, state):
+        """Rechargement complet : demandé par une écriture en masse, ou de sécurité
+        (écritures d'autres processus sans change stream)"""
+        while not self._stop.is_set():
+            requested = state.reload_requested.wait(self.refresh_interval)
+            if self._stop.is_set():
+                return
+            state.reload_requested.clear()
+            if requested or not state.change_stream_active:
+                self.reload(state)
+
+    def _watch_changes(self, state):
+        """Suit le change stream de la collection stock (replica set uniquement)"""
+        while not self._stop.is_set():
+            try:
+                with self.stock_service.collection.watch(
+                    full_document='updateLookup', max_await_time_ms=1000
+                ) as stream:
+                    state.change_stream_active = True
+                    # Ce qui a changé avant l'ouverture du stream est rattrapé ici
+                    self.reload(state)
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self._apply_change(state, change)
+                        with self._lock:
+                            state.last_synced_at = time.monotonic()
+            except PyMongoError as e:
+                if not state.change_stream_active:
+                    logger.info(f"Change stream indisponible ({state.store_id}), synchronisation par rechargement: {e}")
+                    return
+                logger.warning(f"Change stream du stock interrompu ({state.store_id}): {e}")
+                state.change_stream_active = False
+                self._stop.wait(5)
+
+    def _apply_change(self, state, change):
+        """Applique un évènement du change stream"""
+        self.stats['events'] += 1
+        key = str(change['documentKey']['_id'])
+        ticket = next(self._tickets)
+        if change['operationType'] == 'delete':
+            self._put(state, key, None, ticket)
+        elif change.get('fullDocument') is not None:
+            self._put(state, key, change['fullDocument'], ticket)
+
+    def _put(self, state, key, document, ticket):
+        """Remplace un document si la lecture qui l'a produit est la plus récente"""
+        with self._lock:
+            if ticket <= max(state.versions.get(key, 0), state.reload_ticket):
+                return
+            state.versions[key] = ticket
+            if document is None:
+                state.documents.pop(key, None)
+            else:
+                state.documents[key] = document
+
+    def on_stock_change(self, operation, product_id=None):
+        """Hook appelé par StockService après une écriture locale"""
+        state = self._stores.get(current_store())
+        if state is None or not state.warm:
+            return
+        if product_id is None:
+            # Écriture en masse : le thread de rechargement s'en charge, MongoDB
+            # répond en attendant
+            state.stale = True
+            state.reload_requested.set()
+            return
+
+        key = str(product_id)
+        ticket = next(self._tickets)
+        if operation == 'delete':
+            self._put(state, key, None, ticket)
+            return
+
+        try:
+            document = self.stock_service.collection.find_one({'_id': ObjectId(key)})
+        except PyMongoError as e:
+            logger.warning(f"Rafraîchissement du produit {key} impossible: {e}")
+            return
+        self._put(state, key, document, ticket)
+
+    # --- Métriques ---
+
+    def staleness(self, state=None):
+        """Âge en secondes de la dernière synchronisation connue (la plus ancienne des magasins)"""
+        states = [state] if state else list(self._stores.values())
+        if not states or any(s.last_synced_at is None for s in states):
+            return None
+        return time.monotonic() - min(s.last_synced_at for s in states)
+
+    def is_serving(self, state=None):
+        """Indique si la réplique peut répondre à la place de MongoDB"""
+        states = [state] if state else list(self._stores.values())
+        if not (self.enabled and states):
+            return False
+        for s in states:
+            staleness = self.staleness(s)
+            if not s.warm or s.stale or staleness is None or staleness > self.max_staleness:
+                return False
+        return True
+
+    def get_status(self):
+        """État de la réplique pour la supervision"""
+        staleness = self.staleness()
+        return {
+            'enabled': self.enabled,
+            'warm': self.warm,
+            'serving': self.is_serving(),
+            'products': sum(len(s.documents) for s in self._stores.values()),
+            'stalenessSeconds': round(staleness, 3) if staleness is not None else None,
+            'maxStalenessSeconds': self.max_staleness,
+            'changeStream': bool(self._stores) and all(s.change_stream_active for s in self._stores.values()),
+            'stores': {
+                store_id: {
+                    'serving': self.is_serving(s),
+                    'products': len(s.documents),
+                    'changeStream': s.change_stream_active
+                }
+                for store_id, s in self._stores.items()
+            },
+            'stats': dict(self.stats)
+        }
+
+    # --- Lectures (même interface que StockService) ---
+
+    def _snapshot(self, state):
+        with self._lock:
+            return list(state.documents.values())
+
+    def _serve(self):
+        """Réplique du magasin courant si elle peut répondre, sinon None"""
+        state = self._stores.get(current_store())
+        if state is None:
+            self.stats['unreplicatedStores'] += 1
+            return None
+        if self.is_serving(state):
+            self.stats['hits'] += 1
+            return state
+        self.stats['fallbacks'] += 1
+        return None
+
+    def _matcher(self, filters):
+        """Compile les filtres ; None si la réplique ne sait pas les évaluer comme MongoDB"""
+        try:
+            return compile_filters(filters or {})
+        except ValueError:
+            self.stats['fallbacks'] += 1
+            return None
+
+    def get_all_stock(self, filters=None, page=1, limit=20):
+        """Récupère les produits avec filtres et pagination"""
+        state = self._serve()
+        matcher = state and self._matcher(filters)
+        if not matcher:
+            return self.stock_service.get_all_stock(filters, page, limit)
+        documents = sorted(
+            (d for d in self._snapshot(state) if matcher(d)),
+            key=lambda d: d.get('name', '')
+        )
+        skip = (page - 1) * limit
+        return [Stock.from_dict(d) for d in documents[skip:skip + limit]]
+
+    def count_stock(self, filters=None):
+        """Compte les produits correspondant aux filtres"""
+        state = self._serve()
+        matcher = state and self._matcher(filters)
+        if not matcher:
+            return self.stock_service.count_stock(filters)
+        return sum(1 for d in self._snapshot(state) if matcher(d))
+
+    def get_stock_by_id(self, product_id):
+        """Récupère un produit par son ID"""
+        # Même validation que MongoDB : lève InvalidId si l'ID est mal formé
+        key = str(ObjectId(product_id))
+        state = self._serve()
+        if not state:
+            return self.stock_service.get_stock_by_id(product_id)
+        with self._lock:
+            document = state.documents.get(key)
+        return Stock.from_dict(document) if document else None
+
+    def get_prices(self, names):
+        """Récupère prix et statut d'un ensemble de produits (par nom)"""
+        state = self._serve()
+        if not state:
+            return self.stock_service.get_prices(names)
+        names = set(names)
+        return {
+            d['name']: {'_id': d['_id'], 'name': d['name'], 'price': d.get('price', 0),
+                        'status': d.get('status'), 'productId': d.get('productId')}
+            for d in self._snapshot(state) if d.get('name') in names
+        }
+
+    def get_low_stock_alerts(self):
+        """Récupère les produits en stock faible ou en rupture"""
+        state = self._serve()
+        if not state:
+            return self.stock_service.get_low_stock_alerts()
+        documents = sorted(
+            (d for d in self._snapshot(state) if d.get('status') in ('low_stock', 'out_of_stock')),
+            key=lambda d: d.get('quantity', 0)
+        )
+        return [Stock.from_dict(d) for d in documents]
+
+    def get_categories(self):
+        """Récupère la liste des catégories utilisées"""
+        state = self._serve()
+        if not state:
+            return self.stock_service.get_categories()
+        return sorted({d['category'] for d in self._snapshot(state) if d.get('category') is not None})
+
+def compile_filters(filters):
+    """Compile le sous-ensemble de filtres MongoDB utilisé par les routes stock.
+
+    Gère l'égalité simple, `$in`, `$regex`/`$options` (motifs littéraux) et `$or`.
+    Lève ValueError pour tout ce que la réplique ne sait pas évaluer à l'identique.
+    """
+    predicates = []
+    for field, condition in filters.items():
+        if field == '$or':
+            alternatives = [compile_filters(clause) for clause in condition]
+            predicates.append(lambda d, alts=alternatives: any(alt(d) for alt in alts))
+        elif isinstance(condition, dict):
+            predicates.append(_compile_operators(field, condition))
+        else:
+            predicates.append(lambda d, f=field, v=condition: d.get(f) == v)
+    return lambda document: all(predicate(document) for predicate in predicates)
+
+def _literal(pattern):
+    """Texte recherché par un motif produit par re.escape, None sinon"""
+    text = re.sub(r'\\(.)', r'\1', pattern, flags=re.DOTALL)
+    return text if re.escape(text) == pattern else None
+
+def _compile_operators(field, condition):
+    """Compile les opérateurs d'un champ"""
+    predicates = []
+    if '$regex' in condition:
+        options = condition.get('$options', '')
+        text = _literal(condition['$regex'])
+        if text is None or set(options) - {'i'}:
+            raise ValueError(f"Motif non littéral, confié à MongoDB: {condition['$regex']!r}")
+        if 'i' in options:
+            text = text.lower()
+            predicates.append(lambda d: isinstance(d.get(field), str) and text in d[field].lower())
+        else:
+            predicates.append(lambda d: isinstance(d.get(field), str) and text in d[field])
+    if '$in' in condition:
+        values = condition['$in']
+        predicates.append(lambda d: d.get(field) in values)
+    unsupported = set(condition) - {'$regex', '$options', '$in'}
+    if unsupported:
+        raise ValueError(f"Opérateurs non gérés par la réplique: {', '.join(sorted(unsupported))}")
+    return lambda document: all(predicate(document) for predicate in predicates)
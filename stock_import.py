@@ -0,0 +1,224 @@
+"""
+Import en masse du stock (CSV ou NDJSON) pour le Coffee Shop CRUD
+
+Le fichier est lu en flux, validé par paquets avec StockSchema puis écrit
+par `bulk_write` : la mémoire utilisée dépend de la taille d'un paquet,
+pas de la taille du fichier.
+
+Une ligne ne remplace que les champs qu'elle renseigne : une cellule vide
+(ou une clé absente en NDJSON) garde la valeur du produit existant, et les
+valeurs par défaut du schéma ne servent qu'à la création. Créer un produit
+exige name et category ; une ligne sans eux ne peut que mettre à jour.
+
+La quantité d'un produit existant n'est pas écrite telle quelle : elle
+devient un ajustement du journal de mouvements (écart avec la quantité à
+jour), pour ne pas écraser les mouvements pas encore compactés. Le rapport
+compte ces ajustements dans adjusted.
+
+Chaque ligne lue est comptée une seule fois : processed = inserted +
+updated + unchanged + duplicates + failed. Une ligne dont le productId
+réapparaît plus loin dans le même paquet est comptée en duplicates (la
+dernière l'emporte).
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+from marshmallow import ValidationError
+from src.models.Inventory import StockService, StockSchema
+from src.models.StockMovement import StockMovementService
+
+# Champs obligatoires pour créer un produit (productId l'est toujours)
+CREATE_FIELDS = ("name", "category")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_MAX_ERRORS = 1000
+SUPPORTED_FORMATS = ["csv", "ndjson"]
+
+def detect_format(filename=None, content_type=None):
+    """Devine le format d'import à partir du nom de fichier ou du Content-Type"""
+    filename = (filename or "").lower()
+    content_type = (content_type or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    if filename.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    return None
+
+def iter_rows(text_stream, file_format):
+    """Itère sur les lignes du fichier sous la forme (numéro de ligne, données)"""
+    if file_format == "csv":
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            # Cellule vide : champ absent, la valeur existante est conservée
+            yield reader.line_num, {k: v for k, v in row.items() if k and v not in (None, "")}
+    elif file_format == "ndjson":
+        for line_number, line in enumerate(text_stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, e
+    else:
+        raise ValueError(f"Format d'import invalide: {file_format}")
+
+class StockImporter:
+    """Importe un flux de produits par paquets et produit un rapport par ligne"""
+
+    def __init__(self, stock_service=None, chunk_size=DEFAULT_CHUNK_SIZE, max_errors=DEFAULT_MAX_ERRORS,
+                 movement_service=None):
+        self.stock_service = stock_service or StockService()
+        self.movement_service = movement_service or StockMovementService(self.stock_service)
+        self.schema = StockSchema()
+        # Seul productId est exigé ; les défauts ne sont pas appliqués (partial)
+        self.partial_fields = tuple(name for name in self.schema.fields if name != "productId")
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+
+    def import_stream(self, text_stream, file_format):
+        """Importe un flux texte et retourne le rapport d'import"""
+        report = {
+            "processed": 0,
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "adjusted": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "errors": [],
+            "errorsTruncated": False,
+            "duplicateRows": [],
+            "duplicateRowsTruncated": False
+        }
+
+        chunk = {}
+        for line_number, raw in iter_rows(text_stream, file_format):
+            report["processed"] += 1
+
+            if isinstance(raw, Exception):
+                self._add_error(report, line_number, None, f"JSON invalide: {raw}")
+                continue
+            if not isinstance(raw, dict):
+                self._add_error(report, line_number, None, "Objet JSON attendu")
+                continue
+
+            try:
+                data = self.schema.load(raw, partial=self.partial_fields)
+            except ValidationError as err:
+                self._add_error(report, line_number, raw.get("productId"), err.messages)
+                continue
+
+            # Un même productId dans le paquet : la dernière ligne l'emporte
+            previous = chunk.get(data["productId"])
+            if previous is not None:
+                self._add_duplicate(report, previous[0], data["productId"], line_number)
+            chunk[data["productId"]] = (line_number, data)
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk, report)
+                chunk = {}
+
+        self._flush(chunk, report)
+        return report
+
+    def _flush(self, chunk, report):
+        """Écrit un paquet de lignes validées"""
+        if not chunk:
+            return
+        rows = [((line_number, data["productId"]), data) for line_number, data in chunk.values()]
+        existing = self.stock_service.existing_product_ids(chunk)
+
+        # Quantité d'un produit existant : ajustement du journal, pas d'écriture absolue
+        targets = {}
+        quantity_only = []
+        for ref, data in rows:
+            if ref[1] in existing and "quantity" in data:
+                targets[existing[ref[1]]] = data.pop("quantity")
+                if len(data) == 1:
+                    quantity_only.append(ref)
+        rows = [row for row in rows if row[0] not in quantity_only]
+
+        creatable = [row for row in rows if all(field in row[1] for field in CREATE_FIELDS)]
+        update_only = [row for row in rows if not all(field in row[1] for field in CREATE_FIELDS)]
+        for (line_number, product_id), _ in update_only:
+            if product_id not in existing:
+                missing = [field for field in CREATE_FIELDS if field not in chunk[product_id][1]]
+                self._add_error(report, line_number, product_id, {
+                    field: ["Requis pour créer un produit."] for field in missing
+                })
+        update_only = [row for row in update_only if row[0][1] in existing]
+
+        for batch, upsert in ((creatable, True), (update_only, False)):
+            result = self.stock_service.bulk_upsert_stock(batch, upsert=upsert)
+            report["inserted"] += result["inserted"]
+            report["updated"] += result["updated"]
+            report["unchanged"] += result["unchanged"]
+            for (line_number, product_id), message in result["errors"]:
+                self._add_error(report, line_number, product_id, message)
+
+        adjusted = {movement.stock_id for movement in self.movement_service.set_quantities(targets, reason="Import")}
+        report["adjusted"] += len(adjusted)
+        for _, product_id in quantity_only:
+            report["updated" if existing[product_id] in adjusted else "unchanged"] += 1
+        # Statut des produits existants recalculé sur leur quantité à jour
+        self.movement_service.refresh_status(existing.values())
+
+    def _add_duplicate(self, report, line_number, product_id, superseded_by):
+        """Signale une ligne remplacée par une ligne suivante du même productId"""
+        report["duplicates"] += 1
+        if len(report["duplicateRows"]) < self.max_errors:
+            report["duplicateRows"].append({
+                "line": line_number,
+                "productId": product_id,
+                "supersededBy": superseded_by
+            })
+        else:
+            report["duplicateRowsTruncated"] = True
+
+    def _add_error(self, report, line_number, product_id, message):
+        """Ajoute une erreur au rapport en bornant sa taille"""
+        report["failed"] += 1
+        if len(report["errors"]) < self.max_errors:
+            report["errors"].append({
+                "line": line_number,
+                "productId": product_id,
+                "errors": message
+            })
+        else:
+            report["errorsTruncated"] = True
+
+def open_text_stream(binary_stream, encoding="utf-8"):
+    """Enveloppe un flux binaire (fichier uploadé, corps de requête) en flux texte"""
+    return io.TextIOWrapper(binary_stream, encoding=encoding, newline="")
+
+def main(argv=None):
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Import en masse du stock (CSV ou NDJSON)")
+    parser.add_argument("path", help="Fichier à importer ('-' pour l'entrée standard)")
+    parser.add_argument("--format", choices=SUPPORTED_FORMATS, help="Format du fichier (déduit de l'extension sinon)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Nombre de lignes par écriture")
+    parser.add_argument("--max-errors", type=int, default=DEFAULT_MAX_ERRORS, help="Nombre maximal d'erreurs détaillées")
+    args = parser.parse_args(argv)
+
+    file_format = args.format or detect_format(filename=args.path)
+    if file_format is None:
+        parser.error("Impossible de déterminer le format, utilisez --format")
+
+    importer = StockImporter(chunk_size=args.chunk_size, max_errors=args.max_errors)
+    if args.path == "-":
+        report = importer.import_stream(open_text_stream(sys.stdin.buffer), file_format)
+    else:
+        with open(args.path, encoding="utf-8", newline="") as text_stream:
+            report = importer.import_stream(text_stream, file_format)
+
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2, default=str)
+    sys.stdout.write("\n")
+    return 0 if report["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
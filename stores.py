@@ -0,0 +1,41 @@
+"""
+Magasin visé par une requête
+
+Chaque requête est rattachée à un magasin : en-tête X-Store-Id, ou
+paramètre ?storeId (liens et tablettes sans en-têtes personnalisés), sinon
+DEFAULT_STORE_ID. Le magasin est placé dans le contexte courant pour toute
+la durée de la requête : services, caches et connexions MongoDB le
+résolvent d'eux-mêmes (voir src.config.database).
+"""
+from flask import g, jsonify, request
+from src.config.database import db_config, current_store, set_current_store, reset_current_store
+
+STORE_HEADER = 'X-Store-Id'
+STORE_PARAMETER = 'storeId'
+
+def _bind_store():
+    store_id = request.headers.get(STORE_HEADER) or request.args.get(STORE_PARAMETER)
+    if store_id is None:
+        return None
+    if not db_config.has_store(store_id):
+        return jsonify({
+            'success': False,
+            'error': f"Magasin inconnu: {store_id}"
+        }), 400
+    g.store_token = set_current_store(store_id)
+    return None
+
+def _return_store(response):
+    response.headers[STORE_HEADER] = current_store()
+    return response
+
+def _unbind_store(exc):
+    token = g.pop('store_token', None)
+    if token is not None:
+        reset_current_store(token)
+
+def init_stores(app):
+    """Rattache chaque requête au magasin demandé"""
+    app.before_request(_bind_store)
+    app.after_request(_return_store)
+    app.teardown_request(_unbind_store)
@@ -0,0 +1,108 @@
+"""
+Tests du contrôle d'admission (src.middleware.admission)
+"""
+import threading
+import time
+from flask import Flask, jsonify
+from src.middleware import admission
+from src.middleware.admission import AdmissionController, TokenBucketLimiter, classify_request
+
+def make_classes(timeout=0.05, queue=4, rate=0, burst=1):
+    config = lambda priority, concurrency: {
+        'priority': priority, 'concurrency': concurrency, 'queue': queue,
+        'timeout': timeout, 'rate': rate, 'burst': burst
+    }
+    return {'critical': config(0, 4), 'default': config(1, 4), 'reporting': config(2, 1)}
+
+def test_non_critical_requests_never_enter_the_reserve():
+    controller = AdmissionController(make_classes(timeout=5), max_concurrency=4, critical_reserve=2)
+    assert controller.acquire('default')
+    assert controller.acquire('default')
+
+    # Réserve atteinte : refus immédiat, sans attendre le délai de la file
+    started = time.monotonic()
+    assert not controller.acquire('default')
+    assert not controller.acquire('reporting')
+    assert time.monotonic() - started < 1
+    assert controller.get_status()['waiting']['default'] == 0
+
+    assert controller.acquire('critical')
+    assert controller.acquire('critical')
+
+def test_non_critical_waiters_count_against_the_reserve():
+    controller = AdmissionController(make_classes(timeout=5), max_concurrency=4, critical_reserve=2)
+    # Toutes les places prises par des commandes : les lectures attendent, deux au plus
+    for _ in range(4):
+        assert controller.acquire('critical')
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(controller.acquire('default'))) for _ in range(2)]
+    for waiter in waiters:
+        waiter.start()
+    while controller.get_status()['waiting']['default'] < 2:
+        time.sleep(0.001)
+
+    # Une troisième bloquerait un thread de la réserve
+    assert not controller.acquire('default')
+
+    controller.release('critical')
+    controller.release('critical')
+    for waiter in waiters:
+        waiter.join(timeout=2)
+    assert results == [True, True]
+
+def test_queue_timeout_rejects_waiting_request():
+    controller = AdmissionController(make_classes(timeout=0.05), max_concurrency=1, critical_reserve=0)
+    assert controller.acquire('critical')
+
+    started = time.monotonic()
+    assert not controller.acquire('critical')
+    elapsed = time.monotonic() - started
+    assert 0.04 <= elapsed < 1
+    assert controller.get_status()['waiting']['critical'] == 0
+
+def test_waiting_request_runs_when_a_slot_is_released():
+    controller = AdmissionController(make_classes(timeout=2), max_concurrency=1, critical_reserve=0)
+    assert controller.acquire('critical')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(controller.acquire('critical')))
+    waiter.start()
+    while controller.get_status()['waiting']['critical'] == 0:
+        time.sleep(0.001)
+
+    controller.release('critical')
+    waiter.join(timeout=2)
+    assert results == [True]
+    assert controller.get_status()['active']['critical'] == 1
+
+def test_full_queue_rejects_immediately():
+    controller = AdmissionController(make_classes(timeout=2, queue=0), max_concurrency=1, critical_reserve=0)
+    assert controller.acquire('critical')
+    started = time.monotonic()
+    assert not controller.acquire('critical')
+    assert time.monotonic() - started < 0.5
+
+def test_coalesced_reads_are_not_reporting():
+    assert classify_request('GET', '/api/orders/stats') == 'default'
+    assert classify_request('GET', '/api/stock/alerts/low-stock') == 'default'
+    assert classify_request('GET', '/api/reports/stores') == 'reporting'
+    assert classify_request('POST', '/api/orders/') == 'critical'
+    assert classify_request('GET', '/api/health') is None
+
+def test_rate_limited_client_gets_429(monkeypatch):
+    classes = make_classes(rate=0.5, burst=1)
+    monkeypatch.setattr(admission, 'rate_limiter', TokenBucketLimiter(classes))
+    monkeypatch.setattr(admission, 'admission_controller', AdmissionController(classes, max_concurrency=4))
+    app = Flask(__name__)
+    admission.init_admission(app)
+    app.add_url_rule('/api/orders/', 'orders', lambda: jsonify({'success': True}), methods=['GET'])
+    client = app.test_client()
+
+    assert client.get('/api/orders/').status_code == 200
+    response = client.get('/api/orders/')
+    assert response.status_code == 429
+    assert response.get_json()['success'] is False
+    assert int(response.headers['Retry-After']) >= 1
+    # Un autre client a son propre seau
+    assert client.get('/api/orders/', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+    # Les places réservées ont été rendues
+    assert admission.admission_controller.get_status()['active']['default'] == 0
@@ -0,0 +1,149 @@
+"""
+Tests de la file d'écriture hors ligne (src.models.offline_queue)
+"""
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure, ServerSelectionTimeoutError
+from src.models.offline_queue import OfflineWriteQueue, OfflineReplicator
+
+class FakeCollection:
+    """Collection en mémoire : _id et numéro uniques, filtres d'égalité"""
+
+    def __init__(self, number_field):
+        self.number_field = number_field
+        self.documents = {}
+
+    def _matches(self, document, query):
+        return all(document.get(field) == value for field, value in query.items())
+
+    def insert_one(self, document):
+        if document['_id'] in self.documents:
+            raise DuplicateKeyError('E11000 _id', 11000, {'keyPattern': {'_id': 1}})
+        number = document.get(self.number_field)
+        if any(existing.get(self.number_field) == number for existing in self.documents.values()):
+            raise DuplicateKeyError('E11000 numéro', 11000, {'keyPattern': {self.number_field: 1}})
+        self.documents[document['_id']] = dict(document)
+
+    def update_one(self, query, update):
+        for document in self.documents.values():
+            if self._matches(document, query):
+                document.update(update['$set'])
+                return
+
+    def delete_one(self, query):
+        for entity_id, document in list(self.documents.items()):
+            if self._matches(document, query):
+                del self.documents[entity_id]
+                return
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = OfflineWriteQueue(path=str(tmp_path / 'queue.sqlite3'), enabled=True, pending_check_seconds=0)
+    queue.db = {'orders': FakeCollection('orderNumber'), 'bills': FakeCollection('billNumber'),
+                'stock_movements': FakeCollection('orderId')}
+    return queue
+
+def order(number, status='pending'):
+    return {'_id': ObjectId(), 'orderNumber': number, 'status': status}
+
+def unavailable():
+    raise ServerSelectionTimeoutError('primaire injoignable')
+
+def test_unavailable_write_is_queued_and_replayed_in_order(queue):
+    document = order('ORD-20240101120000-AAAAAA')
+    assert queue.execute('orders', 'insert', document['_id'], document, unavailable,
+                         number=document['orderNumber']) is None
+    # Hors ligne : les écritures suivantes vont en file sans tenter MongoDB
+    queue.execute('orders', 'update', document['_id'], {'status': 'preparing'}, unavailable)
+    assert queue.find('orders', entity_id=document['_id'])['status'] == 'preparing'
+    assert queue.db['orders'].documents == {}
+
+    assert queue.replay() == 2
+    assert queue.db['orders'].documents[document['_id']]['status'] == 'preparing'
+    assert not queue.has_pending()
+    assert queue.find('orders', entity_id=document['_id']) is None
+
+def test_replay_is_idempotent_after_partial_write(queue):
+    document = order('ORD-20240101120000-AAAAAA')
+    queue.enqueue('orders', 'insert', document['_id'], document, number=document['orderNumber'])
+    # Écrit par MongoDB malgré le délai dépassé : le doublon d'_id vaut succès
+    queue.db['orders'].insert_one(document)
+
+    assert queue.replay() == 1
+    assert queue.counts().get('failed') is None
+    assert queue.stats['renumbered'] == 0
+
+def test_duplicate_number_is_renumbered(queue):
+    taken = order('ORD-20240101120000-AAAAAA')
+    queue.db['orders'].insert_one(taken)
+    document = order('ORD-20240101120000-AAAAAA')
+    queue.enqueue('orders', 'insert', document['_id'], document, number=document['orderNumber'])
+
+    assert queue.replay() == 1
+    replayed = queue.db['orders'].documents[document['_id']]
+    assert replayed['orderNumber'] != taken['orderNumber']
+    assert replayed['orderNumber'].startswith('ORD-20240101120000-')
+    assert queue.stats['renumbered'] == 1
+
+def test_rejected_insert_sets_aside_its_dependents(queue):
+    rejected, other = order('ORD-1'), order('ORD-2')
+    def refuse(document):
+        if document['_id'] == rejected['_id']:
+            raise OperationFailure('document invalide', 121)
+        FakeCollection.insert_one(queue.db['orders'], document)
+    queue.db['orders'].insert_one = refuse
+
+    queue.enqueue('orders', 'insert', rejected['_id'], rejected, number='ORD-1')
+    queue.enqueue('orders', 'update', rejected['_id'], {'status': 'ready'})
+    queue.enqueue('bills', 'insert', ObjectId(), {'_id': ObjectId(), 'billNumber': 'BILL-1',
+                                                    'orderId': rejected['_id']})
+    queue.enqueue('orders', 'delete', rejected['_id'], {'status': 'pending'})
+    queue.enqueue('orders', 'insert', other['_id'], other, number='ORD-2')
+
+    assert queue.replay() == 1
+    assert other['_id'] in queue.db['orders'].documents
+    assert queue.counts() == {'failed': 4}
+    assert [failure['kind'] for failure in queue.failures()] == ['delete', 'insert', 'update', 'insert']
+
+def test_conditional_delete_keeps_an_order_that_moved_on(queue):
+    document = order('ORD-1')
+    queue.db['orders'].insert_one(document)
+    queue.enqueue('orders', 'delete', document['_id'], {'status': 'pending'})
+    assert queue.overlay('orders', document) is None
+    # Passée en préparation par un autre worker avant le rejeu
+    queue.db['orders'].documents[document['_id']]['status'] = 'preparing'
+
+    assert queue.replay() == 1
+    assert document['_id'] in queue.db['orders'].documents
+
+def test_pending_documents_skip_queued_deletes(queue):
+    kept, deleted = order('ORD-1'), order('ORD-2')
+    for document in (kept, deleted):
+        queue.enqueue('orders', 'insert', document['_id'], document, number=document['orderNumber'])
+    queue.enqueue('orders', 'delete', deleted['_id'], {'status': 'pending'})
+
+    assert [document['_id'] for document in queue.pending_documents('orders')] == [kept['_id']]
+    assert queue.find('orders', entity_id=deleted['_id']) is None
+
+def test_read_falls_back_when_unavailable(queue):
+    assert queue.read(lambda: 'mongo', lambda: 'cache') == 'mongo'
+    assert queue.read(unavailable, lambda: 'cache') == 'cache'
+    # Magasin marqué hors ligne : plus de tentative pendant retry_seconds
+    assert queue.read(lambda: pytest.fail('MongoDB interrogé hors ligne'), lambda: 'cache') == 'cache'
+
+def test_has_pending_is_cached_between_checks(queue):
+    queue.pending_check_seconds = 60
+    assert not queue.has_pending()
+    other_worker = OfflineWriteQueue(path=queue.path, enabled=True)
+    document = order('ORD-1')
+    other_worker.enqueue('orders', 'insert', document['_id'], document, number='ORD-1')
+
+    assert not queue.has_pending()
+    queue.pending_check_seconds = 0
+    assert queue.has_pending()
+
+def test_replicator_drains_under_file_lock(queue):
+    document = order('ORD-1')
+    queue.enqueue('orders', 'insert', document['_id'], document, number='ORD-1')
+    assert OfflineReplicator(queue).drain() == 1
+    assert queue.counts() == {}
@@ -1,8 +1,16 @@
 """
 Middleware de validation pour l'application Coffee Shop
+
+Les décorateurs historiques (validate_json, validate_required_fields...)
+relisent chacun le corps de la requête. CompiledValidator compile une fois
+un schéma marshmallow (et des règles supplémentaires) en une seule fonction
+de validation : le corps est lu une fois et toutes les erreurs sont
+renvoyées en un seul passage, au même format que Schema.load.
 """
+import math
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, g
+from marshmallow import fields, ValidationError, RAISE, EXCLUDE, missing as MISSING
 import logging
 
 logger = logging.getLogger(__name__)
@@ -137,17 +145,18 @@ def validate_choice(field_name, choices):
     return decorator
 
 def log_request():
-    """Décorateur pour logger les requêtes"""
+    """Décorateur pour logger les requêtes (formatage différé au thread d'écriture)"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            logger.info(f"{request.method} {request.path} - IP: {request.remote_addr}")
+            logger.info("%s %s - IP: %s", request.method, request.path, request.remote_addr)
             
-            if request.method in ['POST', 'PUT', 'PATCH'] and request.is_json:
+            if (logger.isEnabledFor(logging.DEBUG) and request.method in ['POST', 'PUT', 'PATCH']
+                    and request.is_json):
                 # Logger les données de la requête (sans les mots de passe)
-                data = request.get_json()
+                data = request.get_json(silent=True) or {}
                 safe_data = {k: v for k, v in data.items() if 'password' not in k.lower()}
-                logger.debug(f"Request data: {safe_data}")
+                logger.debug("Request data: %s", safe_data)
             
             return f(*args, **kwargs)
         return decorated_function
@@ -208,3 +217,247 @@ def validate_pagination():
         return decorated_function
     return decorator
 
+# --- Validation compilée --------------------------------------------------
+
+# Hooks de schéma que le validateur compilé sait exécuter lui-même
+_SUPPORTED_HOOKS = {'validates_schema', 'post_load'}
+
+class _Unsupported(Exception):
+    """Construction de schéma non compilable : repli sur Schema.load"""
+
+def _schema_hooks(schema):
+    """Méthodes de hook du schéma, par étiquette ('post_load', 'validates_schema'...)"""
+    hooks = {}
+    for name in dir(type(schema)):
+        hook_config = getattr(getattr(type(schema), name, None), '__marshmallow_hook__', None)
+        if not hook_config:
+            continue
+        for key, options in hook_config.items():
+            tag, many = key if isinstance(key, tuple) else (key, False)
+            options = options or {}
+            if (tag not in _SUPPORTED_HOOKS or many or options.get('pass_original')
+                    or options.get('skip_on_field_errors') is False):
+                raise _Unsupported(f"hook {tag}")
+            hooks.setdefault(tag, []).append(getattr(schema, name))
+    return hooks
+
+def _load_default(field):
+    return getattr(field, 'load_default', getattr(field, 'missing', MISSING))
+
+def _compile_validators(validators, failed_message):
+    validators = list(validators)
+    if not validators:
+        return None
+
+    def run(value):
+        messages = []
+        for validator in validators:
+            try:
+                if validator(value) is False:
+                    messages.append(failed_message)
+            except ValidationError as e:
+                messages.extend(e.messages if isinstance(e.messages, list) else [e.messages])
+        return messages
+    return run
+
+def _compile_field(field, extra_validators=()):
+    """Fonction value -> (valeur, erreurs) pour un champ marshmallow"""
+    messages = field.error_messages
+    validators = _compile_validators(
+        list(field.validators) + list(extra_validators),
+        messages.get('validator_failed', 'Invalid value.')
+    )
+    field_type = type(field)
+
+    if field_type is fields.String:
+        def convert(value):
+            if isinstance(value, str):
+                return value, None
+            if isinstance(value, bytes):
+                try:
+                    return value.decode('utf-8'), None
+                except UnicodeDecodeError:
+                    return None, [messages['invalid_utf8']]
+            return None, [messages['invalid']]
+    elif field_type is fields.Integer:
+        strict = field.strict
+        def convert(value):
+            if value is True or value is False or (strict and not isinstance(value, int)):
+                return None, [messages['invalid']]
+            try:
+                return int(value), None
+            except (TypeError, ValueError):
+                return None, [messages['invalid']]
+            except OverflowError:
+                return None, [messages['too_large']]
+    elif field_type is fields.Float:
+        allow_nan = field.allow_nan
+        def convert(value):
+            if value is True or value is False:
+                return None, [messages['invalid']]
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                return None, [messages['invalid']]
+            except OverflowError:
+                return None, [messages['too_large']]
+            if not allow_nan and (math.isnan(number) or math.isinf(number)):
+                return None, [messages['special']]
+            return number, None
+    elif field_type is fields.List:
+        inner = _compile_field(field.inner)
+        def convert(value):
+            if not isinstance(value, (list, tuple)):
+                return None, [messages['invalid']]
+            result, errors = [], {}
+            for index, item in enumerate(value):
+                item_value, item_errors = inner(item)
+                if item_errors:
+                    errors[index] = item_errors
+                else:
+                    result.append(item_value)
+            return result, errors or None
+    elif field_type is fields.Nested and not field.many:
+        nested = _compile_schema(field.schema)
+        def convert(value):
+            return nested(value, False)
+    else:
+        # Type sans chemin rapide : désérialisation marshmallow du seul champ
+        def convert(value):
+            try:
+                return field.deserialize(value), None
+            except ValidationError as e:
+                return None, e.messages
+        return convert
+
+    allow_none = field.allow_none
+
+    def check(value):
+        if value is None:
+            return (None, None) if allow_none else (None, [messages['null']])
+        value, errors = convert(value)
+        if errors:
+            return None, errors
+        if validators:
+            errors = validators(value)
+            if errors:
+                return None, errors
+        return value, None
+    return check
+
+def _compile_schema(schema, extra_rules=None):
+    """Fonction (data, partial) -> (données, erreurs) pour un schéma marshmallow"""
+    extra_rules = extra_rules or {}
+    hooks = _schema_hooks(schema)
+    compiled = []
+    for name, field in schema.fields.items():
+        if field.dump_only:
+            continue
+        if (field.data_key or name) != name or (field.attribute or name) != name:
+            raise _Unsupported(f"champ {name} renommé")
+        compiled.append((
+            name,
+            _compile_field(field, extra_rules.get(name, ())),
+            field.error_messages['required'] if field.required else None,
+            _load_default(field)
+        ))
+    known = {entry[0] for entry in compiled}
+    unknown_mode = schema.unknown
+    type_message = schema.error_messages.get('type', 'Invalid input type.')
+    unknown_message = schema.error_messages.get('unknown', 'Unknown field.')
+
+    def validate(data, partial):
+        if not isinstance(data, dict):
+            return None, {'_schema': [type_message]}
+        result, errors = {}, {}
+        for name, check, required_message, default in compiled:
+            if name in data:
+                value, field_errors = check(data[name])
+                if field_errors:
+                    errors[name] = field_errors
+                else:
+                    result[name] = value
+            elif required_message and not partial:
+                errors[name] = [required_message]
+            elif default is not MISSING and not partial:
+                result[name] = default() if callable(default) else (
+                    default.copy() if isinstance(default, (list, dict)) else default
+                )
+        if unknown_mode != EXCLUDE:
+            for key in data:
+                if key not in known:
+                    if unknown_mode == RAISE:
+                        errors[key] = [unknown_message]
+                    else:
+                        result[key] = data[key]
+        if errors:
+            return None, errors
+
+        for hook in hooks.get('validates_schema', ()):
+            try:
+                hook(result, partial=partial, many=False)
+            except ValidationError as e:
+                field_name = e.field_name or '_schema'
+                field_messages = e.messages if isinstance(e.messages, (list, dict)) else [e.messages]
+                if isinstance(field_messages, dict):
+                    errors.update(field_messages)
+                else:
+                    errors.setdefault(field_name, []).extend(field_messages)
+        if errors:
+            return None, errors
+
+        for hook in hooks.get('post_load', ()):
+            result = hook(result, partial=partial, many=False)
+        return result, None
+    return validate
+
+class CompiledValidator:
+    """Validateur compilé une fois à partir d'un schéma marshmallow
+
+    extra_rules : {champ: [validateurs marshmallow]} ajoutés aux règles du
+    schéma. Les constructions non compilables (pre_load, @validates,
+    champs renommés...) sont déléguées à Schema.load, sans changement de
+    comportement.
+    """
+
+    def __init__(self, schema, extra_rules=None):
+        self.schema = schema
+        try:
+            self._validate = _compile_schema(schema, extra_rules)
+            self.compiled = True
+        except _Unsupported as e:
+            logger.info(f"Schéma {type(schema).__name__} non compilé ({e}), utilisation de Schema.load")
+            self._validate = None
+            self.compiled = False
+
+    def load(self, data, partial=False):
+        """Valide et convertit data ; lève ValidationError avec toutes les erreurs"""
+        if self._validate is None:
+            return self.schema.load(data, partial=partial)
+        result, errors = self._validate(data, partial)
+        if errors:
+            raise ValidationError(errors)
+        return result
+
+def validate_body(validator, partial=False):
+    """Décorateur : lit le corps JSON une fois, le valide et le place dans g.body"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            data = request.get_json(silent=True)
+            if data is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Corps de requête JSON invalide'
+                }), 400
+            try:
+                g.body = validator.load(data, partial=partial)
+            except ValidationError as err:
+                return jsonify({
+                    'success': False,
+                    'error': 'Données invalides',
+                    'details': err.messages
+                }), 400
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -0,0 +1,375 @@
+"""
+Écriture différée des changements de statut des commandes
+
+Avec ORDER_STATUS_WRITE_BEHIND=true, OrderService.update_order_status ne fait
+plus d'update_one sur le thread de la requête : le changement est ajouté au
+journal local du worker (fichier en ajout seul, fsync par défaut), placé
+dans le tampon des écritures en attente, puis acquitté. Un thread regroupe
+toutes les commandes modifiées toutes les ORDER_STATUS_FLUSH_MS
+millisecondes en un seul bulk_write par magasin ; plusieurs changements
+d'une même commande dans l'intervalle n'en font qu'un.
+
+Conflits : chaque écriture porte le statut lu avant le changement et ne
+s'applique que si la commande l'a encore ; sinon un autre worker (ou une
+écriture directe) l'a fait avancer entre-temps, et son statut l'emporte.
+Ces changements écartés sont comptés dans stats['conflicts'].
+
+Lectures : le processus qui a accepté le changement le voit immédiatement
+(les lectures d'OrderService appliquent le tampon, read-your-writes). Les
+autres workers le voient après le vidage, soit quelques millisecondes.
+
+Reprise : chaque worker écrit dans son propre journal
+ORDER_STATUS_JOURNAL_DIR/order-status-<pid>-<jeton>.journal (jeton aléatoire :
+un PID réutilisé après redémarrage ne désigne pas le même journal) et le
+garde verrouillé (flock) tant qu'il vit. Au démarrage, les journaux que l'on
+peut verrouiller sont ceux de workers disparus (arrêt brutal avant vidage) :
+ils sont repris. Chaque vidage ajoute au journal la séquence écrite par
+commande ; seuls les changements postérieurs sont rejoués, avec la même
+condition sur le statut de départ.
+"""
+import os
+import json
+import glob
+import fcntl
+import secrets
+import threading
+import logging
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from prometheus_client import Counter
+from src.config.database import current_store, use_store, get_db
+from src.config.cache import order_cache
+
+logger = logging.getLogger(__name__)
+
+ORDER_STATUS_WRITE_BEHIND = os.getenv('ORDER_STATUS_WRITE_BEHIND', 'false').lower() == 'true'
+ORDER_STATUS_FLUSH_MS = float(os.getenv('ORDER_STATUS_FLUSH_MS', '5'))
+ORDER_STATUS_BATCH_SIZE = int(os.getenv('ORDER_STATUS_BATCH_SIZE', '1000'))
+# Doit survivre à un redémarrage de la machine (pas de tmpfs)
+ORDER_STATUS_JOURNAL_DIR = os.getenv('ORDER_STATUS_JOURNAL_DIR', '/var/lib/coffeeshop/journal')
+ORDER_STATUS_JOURNAL_FSYNC = os.getenv('ORDER_STATUS_JOURNAL_FSYNC', 'true').lower() == 'true'
+# Au-delà, le journal est réécrit avec les seules écritures encore en attente
+ORDER_STATUS_JOURNAL_MAX_BYTES = int(os.getenv('ORDER_STATUS_JOURNAL_MAX_BYTES', str(1024 * 1024)))
+
+JOURNAL_PATTERN = 'order-status-*.journal'
+
+STATUS_WRITES = Counter(
+    'coffeeshop_order_status_writes_total',
+    'Changements de statut différés (acceptés, écrits, en échec, en conflit)',
+    ['result']
+)
+
+class OrderStatusWriteBehind:
+    """Tampon journalisé des changements de statut, vidé en bulk_write"""
+
+    def __init__(self, enabled=ORDER_STATUS_WRITE_BEHIND, flush_ms=ORDER_STATUS_FLUSH_MS,
+                 batch_size=ORDER_STATUS_BATCH_SIZE, journal_dir=ORDER_STATUS_JOURNAL_DIR,
+                 fsync=ORDER_STATUS_JOURNAL_FSYNC, cache=None):
+        self.enabled = enabled
+        self.interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self.journal_dir = journal_dir
+        self.fsync = fsync
+        self.cache = cache or order_cache
+        self.db = get_db()
+        # (magasin, ID de commande) -> (statut, numéro de séquence, statut de départ,
+        # reprise conditionnelle au statut de départ)
+        self._pending = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._journal = None
+        self._journal_path = None
+        self._journal_pid = None
+        self.stats = {'queued': 0, 'flushed': 0, 'flushes': 0, 'failures': 0, 'recovered': 0, 'conflicts': 0}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    # --- Journal local ---
+
+    def _reset_after_fork(self):
+        # Le journal (et son verrou) du parent ne sont pas ceux de l'enfant
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = self._journal_path = self._journal_pid = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _open_journal(self):
+        # Un journal par processus, verrouillé tant que le processus vit
+        if self._journal is None or self._journal_pid != os.getpid():
+            os.makedirs(self.journal_dir, exist_ok=True)
+            path = os.path.join(self.journal_dir, f"order-status-{os.getpid()}-{secrets.token_hex(4)}.journal")
+            journal = open(path, 'a', encoding='utf-8')
+            fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._journal, self._journal_path, self._journal_pid = journal, path, os.getpid()
+        return self._journal
+
+    def _append(self, entries):
+        journal = self._open_journal()
+        journal.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+
+    @staticmethod
+    def _entry(key, pending):
+        status, sequence, base, conditional = pending
+        entry = {'store': key[0], 'id': key[1], 'status': status, 'from': base, 'seq': sequence}
+        if conditional:
+            entry['recovered'] = True
+        return entry
+
+    def _rewrite_journal(self):
+        """Remplace le journal par les seules écritures en attente (verrou tenu)"""
+        journal = self._open_journal()
+        if not self._pending:
+            journal.truncate(0)
+            return
+        if journal.tell() < ORDER_STATUS_JOURNAL_MAX_BYTES:
+            return
+        path = self._journal_path
+        rewritten = open(path + '.tmp', 'w', encoding='utf-8')
+        # Verrouillé avant d'être visible : jamais pris pour le journal d'un worker disparu
+        fcntl.flock(rewritten, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for key, pending in self._pending.items():
+            rewritten.write(json.dumps(self._entry(key, pending)) + '\n')
+        rewritten.flush()
+        os.fsync(rewritten.fileno())
+        os.replace(path + '.tmp', path)
+        journal.close()
+        self._journal = rewritten
+
+    @staticmethod
+    def _read_journal(journal):
+        """Changements non vidés d'un journal : clé -> (statut, statut de départ, conditionnel)"""
+        entries = {}
+        flushed = {}
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Dernière ligne tronquée par l'arrêt brutal
+                continue
+            if 'flushed' in entry:
+                for store_id, order_id, sequence in entry['flushed']:
+                    flushed[(store_id, order_id)] = max(sequence, flushed.get((store_id, order_id), 0))
+                continue
+            entries.setdefault((entry['store'], entry['id']), []).append(entry)
+
+        changes = {}
+        for key, history in entries.items():
+            written = [entry for entry in history if entry['seq'] <= flushed.get(key, 0)]
+            unwritten = [entry for entry in history if entry['seq'] > flushed.get(key, 0)]
+            if not unwritten:
+                continue
+            # Statut de départ : le dernier écrit, sinon celui du premier changement non écrit
+            base = written[-1]['status'] if written else unwritten[0].get('from')
+            changes[key] = (unwritten[-1]['status'], base, unwritten[0].get('recovered', False))
+        return changes
+
+    def recover(self):
+        """Reprend les journaux des workers disparus ; retourne le nombre de changements repris"""
+        own = self._journal_path if self._journal_pid == os.getpid() else None
+        recovered = 0
+        for path in glob.glob(os.path.join(self.journal_dir, JOURNAL_PATTERN)):
+            if path == own:
+                continue
+            try:
+                journal = open(path, encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with journal:
+                try:
+                    # Verrou libre : le worker propriétaire a disparu
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    if os.stat(path).st_ino != os.fstat(journal.fileno()).st_ino:
+                        continue
+                except FileNotFoundError:
+                    # Déjà repris par un autre worker
+                    continue
+                changes = self._read_journal(journal)
+                with self._lock:
+                    journaled = []
+                    for key, (status, base, _) in changes.items():
+                        if key in self._pending:
+                            # Changement plus récent déjà accepté par ce worker
+                            continue
+                        self._sequence += 1
+                        # Rejoué seulement si la commande n'a pas bougé depuis
+                        self._pending[key] = (status, self._sequence, base, base is not None)
+                        journaled.append(self._entry(key, self._pending[key]))
+                    if journaled:
+                        self._append(journaled)
+                # Supprimé sous verrou : un autre worker ne peut plus le reprendre
+                os.remove(path)
+            recovered += len(changes)
+        if recovered:
+            self.stats['recovered'] += recovered
+            logger.warning(f"{recovered} changements de statut repris depuis des journaux orphelins")
+            self._wake.set()
+        return recovered
+
+    # --- Écritures et lectures ---
+
+    def enqueue(self, order_id, status, previous=None):
+        """Journalise et met en attente un changement de statut (previous : statut lu avant)"""
+        key = (current_store(), str(order_id))
+        with self._lock:
+            self._sequence += 1
+            current = self._pending.get(key)
+            # Changements successifs non vidés : le statut de départ reste celui du premier
+            base, conditional = (current[2], current[3]) if current else (previous, False)
+            pending = (status, self._sequence, base, conditional)
+            # Journalisé avant d'être visible : rien n'est acquitté sans être sur disque
+            self._append([self._entry(key, pending)])
+            self._pending[key] = pending
+            self.stats['queued'] += 1
+        STATUS_WRITES.labels('queued').inc()
+        self._ensure_thread()
+
+    def discard(self, order_id):
+        """Oublie le changement en attente d'une commande (supprimée, ou dont le statut est écrit autrement)"""
+        key = (current_store(), str(order_id))
+        with self._lock:
+            pending = self._pending.pop(key, None)
+            if pending is not None:
+                # Marqué comme vidé : il ne sera pas rejoué après un arrêt brutal
+                self._append([{'flushed': [[key[0], key[1], pending[1]]]}])
+
+    def pending_status(self, order_id):
+        """Statut en attente d'une commande du magasin courant, ou None"""
+        pending = self._pending.get((current_store(), str(order_id)))
+        return pending[0] if pending else None
+
+    def pending_with_status(self, status):
+        """IDs des commandes du magasin courant passant au statut donné"""
+        store_id = current_store()
+        with self._lock:
+            return [ObjectId(order_id) for (store, order_id), pending in self._pending.items()
+                    if store == store_id and pending[0] == status]
+
+    def overlay(self, data):
+        """Applique au document le statut en attente (read-your-writes)"""
+        if data is None or not self._pending:
+            return data
+        status = self.pending_status(data['_id'])
+        if status is None or status == data.get('status'):
+            return data
+        return {**data, 'status': status}
+
+    # --- Vidage ---
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='order-status-writer', daemon=True)
+            self._thread.start()
+
+    def start(self):
+        """Reprend les journaux orphelins et démarre le vidage en arrière-plan"""
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.journal_dir, exist_ok=True)
+        except OSError as e:
+            # Sans journal durable, les statuts sont écrits directement
+            logger.error(f"Journal des statuts indisponible ({self.journal_dir}), écriture différée désactivée: {e}")
+            self.enabled = False
+            return
+        self._stop.clear()
+        try:
+            self.recover()
+        except OSError as e:
+            logger.error(f"Reprise des journaux de statut impossible: {e}")
+        self._ensure_thread()
+
+    def stop(self):
+        """Vide les écritures en attente et arrête le thread"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._pending:
+            self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                if self._pending and self.flush() == 0 and self._pending:
+                    # MongoDB indisponible : on réessaie sans saturer les logs
+                    self._stop.wait(min(1.0, self.interval * 100))
+            except Exception as e:
+                logger.error(f"Erreur lors du vidage des statuts de commande: {e}")
+
+    def flush(self):
+        """Écrit les changements en attente ; retourne le nombre de commandes mises à jour"""
+        with self._lock:
+            batch = dict(list(self._pending.items())[:self.batch_size])
+        by_store = {}
+        for (store_id, order_id), pending in batch.items():
+            by_store.setdefault(store_id, []).append((order_id, pending))
+
+        written = []
+        for store_id, changes in by_store.items():
+            operations = []
+            for order_id, (status, _, base, conditional) in changes:
+                query = {'_id': ObjectId(order_id)}
+                if conditional or base is not None:
+                    # Ne pas écraser un statut écrit depuis la lecture (autre worker, reprise)
+                    query['status'] = base
+                operations.append(UpdateOne(query, {'$set': {'status': status}}))
+            try:
+                with use_store(store_id):
+                    result = self.db.orders.bulk_write(operations, ordered=False)
+                    for order_id, _ in changes:
+                        self.cache.invalidate(order_id)
+                written.extend((store_id, order_id, pending[1], pending[0]) for order_id, pending in changes)
+                conflicts = len(operations) - result.matched_count
+                if conflicts:
+                    self.stats['conflicts'] += conflicts
+                    STATUS_WRITES.labels('conflict').inc(conflicts)
+                    logger.warning(f"{conflicts} statuts du magasin {store_id} écartés : commande modifiée entre-temps")
+            except PyMongoError as e:
+                self.stats['failures'] += 1
+                STATUS_WRITES.labels('failed').inc(len(changes))
+                logger.warning(f"Vidage de {len(changes)} statuts du magasin {store_id} reporté: {e}")
+
+        with self._lock:
+            for store_id, order_id, sequence, status in written:
+                pending = self._pending.get((store_id, order_id))
+                if pending is None:
+                    continue
+                if pending[1] == sequence:
+                    del self._pending[(store_id, order_id)]
+                else:
+                    # Un changement arrivé pendant l'écriture reste en attente, à partir du statut écrit
+                    self._pending[(store_id, order_id)] = (pending[0], pending[1], status, pending[3])
+            if written:
+                # Marqueur de vidage : ces changements ne seront plus rejoués
+                self._append([{'flushed': [[store_id, order_id, sequence] for store_id, order_id, sequence, _ in written]}])
+            self._rewrite_journal()
+            self.stats['flushed'] += len(written)
+            self.stats['flushes'] += 1
+        STATUS_WRITES.labels('flushed').inc(len(written))
+        return len(written)
+
+    def get_status(self):
+        return {
+            'enabled': self.enabled,
+            'pending': len(self._pending),
+            'flushIntervalMs': self.interval * 1000,
+            'journal': self._journal_path if self.enabled else None,
+            'stats': dict(self.stats)
+        }
+
+# Tampon partagé par toutes les instances d'OrderService du processus
+order_status_writer = OrderStatusWriteBehind()